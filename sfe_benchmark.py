@@ -0,0 +1,581 @@
+"""
+Benchmarks for the Sound File Explorer library code.
+- scan: compares the single-pass scanner with the old recursive os.walk scan
+  on a generated deep tree, reporting time and directory listing/stat calls.
+- search: compares the trigram SearchIndex with the old linear scan over every
+  directory's audio_files on a generated in-memory library.
+- parallel: times the single-pass scanner against scanParallel with several
+  worker counts, with a simulated latency added to every folder listing as
+  on network storage.
+- watch: writes a burst of files into one folder of a generated library
+  added to a SoundLibrary and times how long the LibraryWatcher takes to
+  report it, and applying the change by refreshing the reported folders
+  against a rescan of the whole library.
+- columns: times filters and sorts of FileColumns on generated metadata,
+  against a pass over a dict per file.
+- suite: generates a library of tiny but valid WAV, AIFF and MP3 files and
+  times scanning, adding it to a SoundLibrary, searching, selecting
+  folders, probing, saving, loading and rescanning, with the throughput and
+  peak memory of each stage. Results can be saved as a baseline and later
+  runs compared with it; a stage whose throughput drops by more than the
+  tolerance is reported as a regression and the exit status is 1. Nothing
+  here needs a display or audio device.
+
+Usage: python sfe_benchmark.py scan [--depth N] [--fanout N] [--files N]
+       python sfe_benchmark.py search [--files N] [--depth N]
+       python sfe_benchmark.py parallel [--depth N] [--fanout N] [--latency S] [--workers N [N ...]]
+       python sfe_benchmark.py watch [--depth N] [--fanout N] [--burst N] [--poll]
+       python sfe_benchmark.py columns [--files N]
+       python sfe_benchmark.py suite [--depth N] [--fanout N] [--files N] [--root DIR]
+                                     [--save FILE] [--baseline FILE] [--tolerance F] [--trace-memory]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+from queue import Queue
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is not reported there
+    resource = None
+from sfe_scan import Directory, scanTree, scanParallel, setLatency, iterSubtree
+from sfe_watch import LibraryWatcher
+from sfe_core import SoundLibrary
+from sfe_probe import probe, ProbeError
+from sfe_index import SearchIndex
+from sfe_columns import FileColumns, parseFilter
+
+WORDS = ['kick', 'snare', 'hat', 'clap', 'tom', 'crash', 'ride', 'perc', 'bass', 'pad',
+         'lead', 'pluck', 'vox', 'fx', 'riser', 'impact', 'foley', 'door', 'rain', 'wind']
+
+
+def makeTree(root, depth, fanout, files):
+    # Generate a tree with `fanout` folders per level and `files` empty wavs per folder
+    count = 0
+    level = [root]
+    for d in range(depth + 1):
+        next_level = []
+        for folder in level:
+            for i in range(files):
+                open(os.path.join(folder, f"sample_{d}_{i}.wav"), 'wb').close()
+                count += 1
+            if d < depth:
+                for i in range(fanout):
+                    sub = os.path.join(folder, f"dir_{d}_{i}")
+                    os.mkdir(sub)
+                    next_level.append(sub)
+        level = next_level
+    return count
+
+
+class LegacyDirectory:
+    # The scan Directory used before the single-pass scanner: every subfolder
+    # found by os.walk builds a new Directory which walks its subtree again.
+    def __init__(self, path):
+        self.path = path
+        self.subdirectories = {}
+        self.audio_files = set()
+        for root, dirs, files in os.walk(self.path):
+            for file in files:
+                if os.path.splitext(file)[-1] in Directory.FILE_TYPES:
+                    self.audio_files.add(os.path.join(root, file))
+            if root != self.path:
+                self.subdirectories[root] = LegacyDirectory(root)
+        self.file_count = len(self.audio_files)
+
+
+class SyscallCounter:
+    # Counts os.scandir and os.stat calls made while active (os.walk uses os.scandir)
+    def __init__(self):
+        self.calls = {'scandir': 0, 'stat': 0}
+
+    def __enter__(self):
+        self.scandir, self.stat = os.scandir, os.stat
+
+        def scandir(*args, **kwargs):
+            self.calls['scandir'] += 1
+            return self.scandir(*args, **kwargs)
+
+        def stat(*args, **kwargs):
+            self.calls['stat'] += 1
+            return self.stat(*args, **kwargs)
+
+        os.scandir, os.stat = scandir, stat
+        return self
+
+    def __exit__(self, *exc):
+        os.scandir, os.stat = self.scandir, self.stat
+
+
+def timeScan(label, scan, path):
+    with SyscallCounter() as counter:
+        start = time.perf_counter()
+        directory = scan(path)
+        elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed:9.3f}s  scandir: {counter.calls['scandir']:<9} "
+          f"stat: {counter.calls['stat']:<9} files: {directory.file_count}")
+    return elapsed
+
+
+def benchScan(args):
+    root = tempfile.mkdtemp(prefix='sfe_bench_')
+    try:
+        count = makeTree(root, args.depth, args.fanout, args.files)
+        print(f"Generated {count} files, depth {args.depth}, fanout {args.fanout}")
+        legacy = timeScan('os.walk', LegacyDirectory, root)
+        single = timeScan('single-pass', Directory, root)
+        print(f"Speed-up: {legacy / single:.1f}x")
+    finally:
+        shutil.rmtree(root)
+
+
+def benchParallel(args):
+    root = tempfile.mkdtemp(prefix='sfe_bench_')
+    try:
+        count = makeTree(root, args.depth, args.fanout, args.files)
+        print(f"Generated {count} files, depth {args.depth}, fanout {args.fanout}, "
+              f"{args.latency * 1000:.1f}ms per folder listing")
+        setLatency(args.latency)
+        start = time.perf_counter()
+        directory = Directory(root, scan=False)
+        scanTree(directory)
+        serial = time.perf_counter() - start
+        print(f"{'single-pass':<12} {serial:9.3f}s {count / serial:>10.0f} files/s")
+        for workers in args.workers:
+            start = time.perf_counter()
+            directory = Directory(root, scan=False)
+            scanParallel([directory], workers, budget=args.chunk)
+            elapsed = time.perf_counter() - start
+            assert directory.file_count == count
+            print(f"{f'{workers} workers':<12} {elapsed:9.3f}s {count / elapsed:>10.0f} files/s  "
+                  f"speed-up {serial / elapsed:.1f}x")
+    finally:
+        setLatency(0.0)
+        shutil.rmtree(root)
+
+
+def benchWatch(args):
+    work = tempfile.mkdtemp(prefix='sfe_bench_')
+    root = os.path.join(work, 'library')
+    os.mkdir(root)
+    changes = Queue()
+    watcher = None
+    library = None
+    try:
+        count = makeTree(root, args.depth, args.fanout, args.files)
+        library = SoundLibrary(os.path.join(work, 'library.db'), os.path.join(work, 'metadata.db'))
+        directory = Directory(root)
+        library.addDirectory(directory)
+        folders = list(iterSubtree(directory))
+        print(f"Generated {count} files in {len(folders)} folders")
+        watcher = LibraryWatcher(lambda event, value: changes.put(value), not args.poll, args.debounce,
+                                 poll_interval=args.poll_interval)
+        watcher.watch(folders)
+        watcher.start()
+        # let the watcher take its folders before anything changes
+        time.sleep(0.5)
+        target = max(folders, key=lambda folder: folder.path.count(os.sep)).path
+        for i in range(args.burst):
+            with open(os.path.join(target, f"render_{i}.wav"), 'wb') as f:
+                f.write(wavBytes(44100, 1, 441))
+        written = time.perf_counter()
+        folders, rescans = changes.get(timeout=60)
+        reported = time.perf_counter()
+        print(f"{watcher.mode}: {args.burst} new files reported in {len(folders)} folder(s) "
+              f"{(reported - written) * 1000:.0f}ms after the last write (debounce {args.debounce * 1000:.0f}ms)")
+        library.refresh(folders)
+        watcher.follow(library.directory_map, folders)
+        # renamed files are told apart from new ones by the records of their probes
+        for name in os.listdir(target):
+            file_path = os.path.join(target, name)
+            library.metadata.put(file_path, os.stat(file_path), probe(file_path))
+
+        def renameBurst(prefix):
+            # rename the burst and wait for the watcher to report it
+            for name in os.listdir(target):
+                if name.startswith(('render_', 'again_')):
+                    os.rename(os.path.join(target, name), os.path.join(target, prefix + name.split('_', 1)[1]))
+            return changes.get(timeout=60)[0]
+
+        # the same change applied by a rescan of the whole library and by refreshing the reported folders
+        renameBurst('again_')
+        start = time.perf_counter()
+        renamed = library.rescan(root)[2]
+        rescanned = time.perf_counter() - start
+        watcher.watch(iterSubtree(directory))
+        folders = renameBurst('render_')
+        start = time.perf_counter()
+        renamed_again = library.refresh(folders)[2]
+        refreshed = time.perf_counter() - start
+        assert len(renamed) == len(renamed_again) == args.burst
+        print(f"Applying {args.burst} renames:")
+        print(f"{'rescan':<8} {rescanned * 1000:9.2f}ms")
+        print(f"{'refresh':<8} {refreshed * 1000:9.2f}ms  speed-up {rescanned / refreshed:.1f}x")
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        if library is not None:
+            library.close()
+        shutil.rmtree(work)
+
+
+def makeLibrary(files, depth, seed=0):
+    # Generate file paths in folders `depth` levels deep and the directory_map
+    # shape the old search walked, where every ancestor holds its descendants' files
+    rng = random.Random(seed)
+    directory_map = {}
+    paths = []
+    for i in range(files):
+        folders = [rng.choice(WORDS) for _ in range(depth)]
+        name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{i:07d}.wav"
+        path = os.path.join('/library', *folders, name)
+        paths.append(path)
+        folder = os.path.dirname(path)
+        while folder != '/':
+            directory_map.setdefault(folder, set()).add(path)
+            folder = os.path.dirname(folder)
+    return paths, directory_map
+
+
+def linearSearch(directory_map, term):
+    # The search used before the index: a substring test on every path of every directory
+    results = []
+    for audio_files in directory_map.values():
+        for file_path in audio_files:
+            if term in os.path.basename(file_path):
+                results.append(file_path)
+    return results
+
+
+def benchSearch(args):
+    paths, directory_map = makeLibrary(args.files, args.depth)
+    start = time.perf_counter()
+    index = SearchIndex()
+    index.addAll(paths)
+    print(f"Indexed {len(index)} files in {time.perf_counter() - start:.2f}s")
+    print(f"{'term':<12} {'linear':>10} {'index':>10} {'matches':>9}")
+    for term in args.terms:
+        start = time.perf_counter()
+        linear = linearSearch(directory_map, term)
+        linear_time = time.perf_counter() - start
+        start = time.perf_counter()
+        indexed = index.search(term)
+        index_time = time.perf_counter() - start
+        assert set(linear) == set(indexed)
+        print(f"{term:<12} {linear_time * 1000:9.1f}ms {index_time * 1000:9.1f}ms {len(indexed):>9}")
+
+
+def benchColumns(args):
+    paths, directory_map = makeLibrary(args.files, 3)
+    del directory_map
+    rng = random.Random(1)
+    records = {}
+    for path in paths:
+        records[path] = {'duration': rng.expovariate(1 / 8.0), 'sample_rate': rng.choice((44100, 48000, 96000)),
+                         'channels': rng.choice((1, 2, 2, 6)), 'bit_depth': rng.choice((16, 24, 32)),
+                         'size': rng.randrange(1 << 10, 1 << 26)}
+    start = time.perf_counter()
+    columns = FileColumns()
+    for path, record in records.items():
+        columns.set(path, record, record['size'])
+    print(f"Filled {len(columns)} rows in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    for column in ('duration', 'sample_rate', 'channels', 'size'):
+        columns.index(column)
+    print(f"Built the indexes in {time.perf_counter() - start:.2f}s")
+    tests = {'<': float.__lt__, '<=': float.__le__, '>': float.__gt__, '>=': float.__ge__, '=': float.__eq__}
+    print(f"{'filter':<36} {'dicts':>10} {'columns':>10} {'matches':>9}")
+    for text in args.filters:
+        conditions = parseFilter(text)
+        start = time.perf_counter()
+        expected = [path for path, record in records.items()
+                    if all(tests[op](float(record[column]), float(value)) for column, op, value in conditions)]
+        dict_time = time.perf_counter() - start
+        start = time.perf_counter()
+        found = columns.filter(paths, conditions)
+        column_time = time.perf_counter() - start
+        assert found == expected
+        print(f"{text:<36} {dict_time * 1000:9.1f}ms {column_time * 1000:9.1f}ms {len(found):>9}")
+    subset = paths[::100]
+    for label, rows in (('all', paths), ('1%', subset)):
+        start = time.perf_counter()
+        expected = sorted(rows, key=lambda path: records[path]['duration'])
+        dict_time = time.perf_counter() - start
+        start = time.perf_counter()
+        found = columns.sort(rows, 'duration')
+        column_time = time.perf_counter() - start
+        assert found == expected
+        print(f"{'sort ' + label + ' by duration':<36} {dict_time * 1000:9.1f}ms {column_time * 1000:9.1f}ms {len(found):>9}")
+
+
+def wavBytes(rate, channels, frames):
+    # A 16-bit PCM WAV file of frames frames of silence
+    data = bytes(frames * channels * 2)
+    return (b'RIFF' + struct.pack('<I', 36 + len(data)) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, rate, rate * channels * 2, channels * 2, 16)
+            + b'data' + struct.pack('<I', len(data)) + data)
+
+
+def aiffBytes(rate, channels, frames):
+    # A 16-bit AIFF file of frames frames of silence
+    data = bytes(frames * channels * 2)
+    # the sample rate is an 80-bit extended float
+    exponent = rate.bit_length() - 1
+    extended = struct.pack('>HQ', 16383 + exponent, rate << (63 - exponent))
+    comm = b'COMM' + struct.pack('>IhIh', 18, channels, frames, 16) + extended
+    ssnd = b'SSND' + struct.pack('>III', 8 + len(data), 0, 0) + data
+    return b'FORM' + struct.pack('>I', 4 + len(comm) + len(ssnd)) + b'AIFF' + comm + ssnd
+
+
+def mp3Bytes(frames):
+    # frames silent MPEG-1 Layer III frames at 128 kbps, 44.1 kHz and joint stereo
+    return (b'\xff\xfb\x90\x40' + bytes(413)) * frames
+
+
+def soundTemplates():
+    # The contents the generated files are drawn from, 5 to 50 ms long
+    templates = []
+    for rate in (44100, 48000):
+        for channels in (1, 2):
+            for ms in (5, 20, 50):
+                templates.append(('.wav', wavBytes(rate, channels, rate * ms // 1000)))
+                templates.append(('.aiff', aiffBytes(rate, channels, rate * ms // 1000)))
+    templates += [('.mp3', mp3Bytes(frames)) for frames in (1, 2)]
+    return templates
+
+
+def makeSoundLibrary(root, depth, fanout, files, seed=0):
+    # Generate `fanout` folders per level down to `depth` levels, each folder holding `files`
+    # audio files named from WORDS. The same seed always gives the same library.
+    rng = random.Random(seed)
+    templates = soundTemplates()
+    count = 0
+    level = [root]
+    for d in range(depth + 1):
+        next_level = []
+        for folder in level:
+            for i in range(files):
+                extension, data = rng.choice(templates)
+                name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{count:07d}{extension}"
+                with open(os.path.join(folder, name), 'wb') as f:
+                    f.write(data)
+                count += 1
+            if d < depth:
+                for i in range(fanout):
+                    sub = os.path.join(folder, f"{rng.choice(WORDS)}_{d}_{i}")
+                    os.mkdir(sub)
+                    next_level.append(sub)
+        level = next_level
+    return count
+
+
+def measure(results, name, unit, stage, trace=False):
+    # Run stage(), which returns the number of units it handled, and record its time, throughput and memory
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    items = stage()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    # ru_maxrss is in KB on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource is not None else None
+    results[name] = {'seconds': elapsed, 'items': items, 'unit': unit, 'rate': items / max(elapsed, 1e-9),
+                     'peak_rss_mb': rss, 'traced_peak_mb': peak}
+    print(f"{name:<14} {elapsed:9.3f}s {items:>9} {unit:<8} {items / max(elapsed, 1e-9):>12.0f}/s"
+          f"  rss {rss or 0:8.1f} MB" + (f"  traced {peak:8.1f} MB" if peak is not None else ''))
+    return results[name]
+
+
+def benchSuite(args):
+    work = tempfile.mkdtemp(prefix='sfe_suite_')
+    root = os.path.abspath(args.root) if args.root else os.path.join(work, 'library')
+    results = {}
+    trace = args.trace_memory
+    try:
+        print(f"{'stage':<14} {'time':>10} {'count':>9} {'unit':<8} {'throughput':>14}")
+        if not os.path.isdir(root) or not os.listdir(root):
+            os.makedirs(root, exist_ok=True)
+            measure(results, 'generate', 'files',
+                    lambda: makeSoundLibrary(root, args.depth, args.fanout, args.files, args.seed), trace)
+        directory = Directory(root, scan=False)
+
+        def scan():
+            scanTree(directory)
+            return directory.file_count
+        measure(results, 'scan', 'files', scan, trace)
+
+        library = SoundLibrary(os.path.join(work, 'library.db'), os.path.join(work, 'metadata.db'))
+
+        def add():
+            library.addDirectory(directory)
+            return directory.file_count
+        measure(results, 'add', 'files', add, trace)
+
+        def search():
+            for term in args.terms:
+                library.searchFiles(term)
+            return len(args.terms)
+        measure(results, 'search', 'queries', search, trace)
+
+        def firstResults():
+            for term in args.terms:
+                next(library.index.searchRanked(term), None)
+            return len(args.terms)
+        measure(results, 'search_first', 'queries', firstResults, trace)
+
+        # the top folder, the folders of the first level and a sample of the rest, as the GUI would show them
+        rng = random.Random(args.seed)
+        folders = list(library.directory_map.values())
+        selected = [directory] + list(directory.subdirectories.values())
+        selected += rng.sample(folders, min(len(folders), args.selections))
+
+        def selectFolders():
+            for folder in selected:
+                paths = sorted(folder.subtreeFiles())
+                library.metadata.lookup(paths[:50])
+            return len(selected)
+        measure(results, 'tree_select', 'folders', selectFolders, trace)
+
+        paths = library.library.allFiles()
+        if args.probe_files:
+            paths = rng.sample(paths, min(len(paths), args.probe_files))
+
+        def probeFiles():
+            for file_path in paths:
+                stat = os.stat(file_path)
+                try:
+                    info = probe(file_path)
+                except (OSError, ProbeError, struct.error) as e:
+                    print(f"Failed to probe {file_path}: {e}")
+                    info = None
+                library.metadata.put(file_path, stat, info)
+            library.metadata.flush()
+            return len(paths)
+        measure(results, 'probe', 'files', probeFiles, trace)
+
+        def save():
+            library.close()
+            return directory.file_count
+        measure(results, 'save', 'files', save, trace)
+
+        def load():
+            nonlocal library
+            library = SoundLibrary(os.path.join(work, 'library.db'), os.path.join(work, 'metadata.db'))
+            return len(library.index)
+        measure(results, 'load', 'files', load, trace)
+
+        def rescan():
+            library.rescan(root)
+            return len(folders)
+        measure(results, 'rescan', 'folders', rescan, trace)
+        library.close()
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    report = {'parameters': {'depth': args.depth, 'fanout': args.fanout, 'files': args.files, 'seed': args.seed,
+                             'terms': args.terms, 'selections': args.selections, 'probe_files': args.probe_files,
+                             'root': args.root, 'trace_memory': trace},
+              'platform': {'python': sys.version.split()[0], 'system': platform.platform(),
+                           'machine': platform.machine()},
+              'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.save}")
+    if args.baseline:
+        return compareBaseline(report, args.baseline, args.tolerance)
+    return 0
+
+
+def compareBaseline(report, path, tolerance):
+    # Compare the throughput of each stage with a saved report, returns 1 if any stage regressed
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline['parameters'] != report['parameters']:
+        print(f"Warning: {path} was measured with other parameters: {baseline['parameters']}")
+    print(f"{'stage':<14} {'baseline':>14} {'now':>14} {'change':>8}")
+    regressed = []
+    for name, result in report['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        change = result['rate'] / old['rate'] - 1
+        # stages this short are mostly noise
+        flag = change < -tolerance and result['seconds'] - old['seconds'] > 0.01
+        if flag:
+            regressed.append(name)
+        print(f"{name:<14} {old['rate']:>12.0f}/s {result['rate']:>12.0f}/s {change:>+7.0%}"
+              + ('  REGRESSION' if flag else ''))
+    if regressed:
+        print(f"{len(regressed)} stages slower than {path} by more than {tolerance:.0%}: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    scan = commands.add_parser('scan', help='compare single-pass and os.walk scanning')
+    scan.add_argument('--depth', type=int, default=6)
+    scan.add_argument('--fanout', type=int, default=3)
+    scan.add_argument('--files', type=int, default=10)
+    scan.set_defaults(run=benchScan)
+    parallel = commands.add_parser('parallel', help='compare serial and parallel scanning on slow storage')
+    parallel.add_argument('--depth', type=int, default=5)
+    parallel.add_argument('--fanout', type=int, default=4)
+    parallel.add_argument('--files', type=int, default=5)
+    parallel.add_argument('--latency', type=float, default=0.005, help='seconds added to every folder listing')
+    parallel.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    parallel.add_argument('--chunk', type=int, default=64, help='folders a worker lists at a time')
+    parallel.set_defaults(run=benchParallel)
+    watch = commands.add_parser('watch', help='time watching a library and applying a burst of new files')
+    watch.add_argument('--depth', type=int, default=4)
+    watch.add_argument('--fanout', type=int, default=8)
+    watch.add_argument('--files', type=int, default=10)
+    watch.add_argument('--burst', type=int, default=200, help='files written into one folder')
+    watch.add_argument('--debounce', type=float, default=0.5)
+    watch.add_argument('--poll', action='store_true', help='poll the folders instead of using inotify')
+    watch.add_argument('--poll-interval', type=float, default=1.0)
+    watch.set_defaults(run=benchWatch)
+    search = commands.add_parser('search', help='compare the search index and the linear scan')
+    search.add_argument('--files', type=int, default=200000)
+    search.add_argument('--depth', type=int, default=3)
+    search.add_argument('--terms', nargs='+', default=['kick_snare', 'riser', '0012345', 'fx', 'nothing'])
+    search.set_defaults(run=benchSearch)
+    columns = commands.add_parser('columns', help='time filters and sorts of the columnar metadata')
+    columns.add_argument('--files', type=int, default=1000000)
+    columns.add_argument('--filters', nargs='+', default=['duration<2s, 48kHz, stereo', 'duration>=1min',
+                                                          'size<100kb', 'rate>=96k, channels=6, bits=24'])
+    columns.set_defaults(run=benchColumns)
+    suite = commands.add_parser('suite', help='time every stage on a generated library of audio files')
+    suite.add_argument('--depth', type=int, default=3)
+    suite.add_argument('--fanout', type=int, default=6)
+    suite.add_argument('--files', type=int, default=20, help='files per folder')
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--root', help='generate the library here, or reuse the one already there')
+    suite.add_argument('--terms', nargs='+', default=['kick_snare', 'riser', '0001234', 'fx', 'nothing'])
+    suite.add_argument('--selections', type=int, default=50, help='random folders to select')
+    suite.add_argument('--probe-files', type=int, default=50000, help='files to probe, 0 for all')
+    suite.add_argument('--save', help='write the results to this JSON file')
+    suite.add_argument('--baseline', help='compare with results saved earlier')
+    suite.add_argument('--tolerance', type=float, default=0.2, help='slowdown reported as a regression')
+    suite.add_argument('--trace-memory', action='store_true',
+                       help='trace the peak Python memory of each stage, which slows them down')
+    suite.set_defaults(run=benchSuite)
+    args = parser.parse_args()
+    sys.exit(args.run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,18 @@
 import os
-import pickle
 import PySimpleGUI as sg
 import math
 import pygame as pg
 import time
-import wave
-import contextlib
 import threading
-from queue import Queue
-from mutagen.mp3 import MP3
-from mutagen.aiff import AIFF
+import itertools
+from collections import OrderedDict
+from queue import Queue, PriorityQueue
+from sfe_probe import probe
+from sfe_core import SoundLibrary
+from sfe_columns import parseFilter
+from sfe_duplicates import DuplicateSearch
+from sfe_metrics import metrics
+from sfe_scan import SCAN_WORKERS
 
 class Gui:        
     def __init__(self):
@@ -17,17 +20,23 @@ class Gui:
         #layout for the GUI
         
         #table layout      
-        headings = ['File Name', 'Type', 'Length']
+        headings = ['File Name', 'Type', 'Length', 'Group']
         self.tableData = []
         table = [sg.Table(values=self.tableData, headings=headings, key='-TABLE-',
                            num_rows=50, justification='right', alternating_row_color='black',
-                           enable_click_events=True, bind_return_key=True,
-                           auto_size_columns=False, col_widths=[30, 10, 10])] 
+                           enable_events=True, enable_click_events=True, bind_return_key=True,
+                           auto_size_columns=False, col_widths=[30, 10, 10, 6]),
+                 # the table only holds one page of rows, this scrolls through all of them
+                 sg.Slider(range=(0, 0), orientation='v', key='-SCROLL-', enable_events=True,
+                           disable_number_display=True, size=(30, 15), expand_y=True)] 
         
         #top row layout
         search = [[sg.Text("Enter search term:")],
                 [sg.Input(size=(25,1), focus=True, key="-TERM-", enable_events=True)],
                 [sg.Button('Search Sounds', size=(15,1), bind_return_key=True, key="-SEARCH-")],
+                [sg.Text("Filter results:")],
+                [sg.Input(size=(25,1), key="-FILTER-", tooltip='e.g. duration<2s, 48kHz, stereo, type=wav'),
+                 sg.Button('Filter', key="-APPLY-FILTER-")],
                 [sg.Sizer(100, 10)]]
         
         status = [sg.Text('', size=(1, 1), key='-STATUS-', expand_x=True, justification='right')]
@@ -48,10 +57,23 @@ class Gui:
         #column layout
         col1 =  [[sg.Input(visible=False, enable_events=True, key='-ADD-'),
                  sg.FolderBrowse('Add Directory', key='-BROWSE-', enable_events=True),
+                 sg.Button('Cancel Scan', key='-CANCEL-', visible=False),
+                 sg.Button('Rescan Selected', key='-RESCAN-'),
+                 sg.Button('Build Waveforms', key='-BUILD-PEAKS-'),
+                 sg.Button('Find Duplicates', key='-DUPES-'),
+                 sg.Button('Metrics', key='-METRICS-'),
+                 sg.Checkbox('Watch Folders', key='-WATCH-', enable_events=True,
+                             tooltip='keep the library up to date as files change on disk'),
                  sg.Button('Delete Selected', key='-DELETE-', button_color=('white', 'red'))], tree]
         
+        #waveform overview of the selected file, one x unit per pixel and -127..127 from bottom to top
+        self.waveformSize = (500, 80)
+        waveform = [sg.Graph(canvas_size=self.waveformSize, graph_bottom_left=(0, -128),
+                             graph_top_right=(self.waveformSize[0], 128), background_color='black', key='-WAVEFORM-')]
+
         col2 = [[sg.Text('Results:'), sg.Sizer(200,10),
-                 sg.Button('Open in original location', visible=False, key='-OPEN-', enable_events=True)], table]
+                 sg.Button('Open in original location', visible=False, key='-OPEN-', enable_events=True)], table,
+                waveform]
         
         #music player
         musicplayer = [[sg.Button('Play', key='-PLAY-', button_color=('white', 'green')),
@@ -68,16 +90,28 @@ class Gui:
                        [sg.Output(size=(100, 10)), sg.Sizegrip()]]
         self.window = sg.Window('Sound File Explorer', self.layout, finalize=True)
         self.window['-TREE-'].expand(True, True)
+        # scrolling over the table moves its page
+        self.window['-TABLE-'].bind('<MouseWheel>', '+WHEEL')
+        self.window['-TABLE-'].bind('<Button-4>', '+UP')
+        self.window['-TABLE-'].bind('<Button-5>', '+DOWN')
+        self.window['-TABLE-'].bind('<Prior>', '+PAGEUP')
+        self.window['-TABLE-'].bind('<Next>', '+PAGEDOWN')
 
 class File:
-    def __init__(self, path, queue=None):
+    # rows are built for every page of results, so Files keep no per-instance dict
+    __slots__ = ('path', 'index', 'name', 'file_type', 'length', 'info', 'size')
+
+    def __init__(self, path):
         self.path = path
-        self.queue = queue
         self.index = None
         #file name does not include the extension
         self.name = os.path.splitext(os.path.basename(path))[0]
         self.file_type = os.path.splitext(path)[-1]
         self.length = '...'
+        #duration in seconds, sample rate, channels and bit depth once probed
+        self.info = None
+        #size in bytes when probed in this session
+        self.size = None
         
 
     def play(self):
@@ -88,163 +122,454 @@ class File:
         # Delete the file
         pass
     
-    def getLength(self):
-        threading.Thread(target=self.calculateLength).start()
+    def getLength(self, pool, priority=0):
+        # queue the file on the shared ProbePool, lower priorities are probed first
+        pool.submit(self, priority)
+
+    def setInfo(self, info):
+        self.info = info
+        if info and info.get('duration') is not None:
+            self.length = formatLength(info['duration'])
+        else:
+            self.length = "unknown"
     
     def calculateLength(self):
         try:
-            with contextlib.closing(wave.open(self.path,'r')) as f:
-                if self.file_type == '.wav':
-                    # use wave to get the length of the wav file
-                    frames = f.getnframes()
-                    rate = f.getframerate()
-                    length = frames / float(rate)
-                elif self.file_type == '.mp3':
-                    # use mutagen to get the length of the mp3 file
-                    audio = MP3(self.path)
-                    length = audio.info.length
-                elif self.file_type == '.aiff':
-                    # use mutagen to get the length of the aiff file
-                    audio = AIFF(self.path)
-                    length = audio.info.length
-                # display the length in minutes and seconds
-                minutes = math.floor(length / 60)
-                seconds = round(length % 60)
-                self.length = f"{minutes}:{seconds:02}"
-                if self.queue:
-                    self.queue.put((self.path, self.length))
+            # read only the headers of the file
+            info = probe(self.path)
         except Exception as e:
             print(f"Failed to get length of {self.path}: {e}")
-            self.length = "unknown"
+            info = None
+        self.setInfo(info)
+        return info
+
+
+def formatLength(length):
+    # display the length in minutes and seconds
+    minutes = math.floor(length / 60)
+    seconds = round(length % 60)
+    return f"{minutes}:{seconds:02}"
             
         
 
-class Directory:
-    
-    FILE_TYPES = ('.mp3', '.wav', '.aiff')
-    
-    def __init__(self, path):
+class Player:
+    # Plays one file at a time. Files in the PreloadCache play at once from
+    # their decoded Sound; anything else is streamed through pygame.mixer.music,
+    # which decodes a small buffer at a time as it plays, so selecting a file
+    # costs nothing and playback starts without decoding the whole file.
+    def __init__(self, volume=0.75, cache=None):
+        self.path = None
+        self.volume = volume
+        self.cache = cache
+        self.channel = None
+
+    def select(self, path):
         self.path = path
-        self.subdirectories = {}
-        self.name = os.path.basename(path)
-        #contains a set of audio file paths (not objects)
-        self.audio_files = self.getFiles()
-        self.parent = ''
-
-    def getFiles(self):
-        self.audio_files = set()
-        # Get a list of audio files in the directory       
-        for root, dirs, files in os.walk(self.path):
-
-            for file in files:
-                file_type = os.path.splitext(file)[-1]
-                
-                if file_type in Directory.FILE_TYPES:
-                    # Create a new File object and add it to self.audio_files
-                    self.audio_files.add(os.path.join(root, file))
-                    contains_audio = True
-
-            if root != self.path:
-                # Create a new Directory object for the current directory
-                self.subdirectories[root] = Directory(root)
-        
-        return self.audio_files            
 
+    @metrics.timed('playback.start')
+    def play(self):
+        self.stop()
+        sound = self.cache.get(self.path) if self.cache else None
+        if sound is not None:
+            metrics.count('playback.preloaded')
+            self.channel = pg.mixer.Channel(1)
+            self.channel.set_volume(self.volume)
+            self.channel.play(sound)
+        else:
+            metrics.count('playback.streamed')
+            pg.mixer.music.load(self.path)
+            pg.mixer.music.set_volume(self.volume)
+            pg.mixer.music.play()
 
-        
-    
-    def toTreeData(self, gui):
-        # Use the full path as the key
-        key = self.path
-        
-        # Create a list of subdirectory names
-        subdirectory_names = []
-        for subdirectory in self.subdirectories.values():
-            subdirectory_names.append(subdirectory.name)
-        
-        # Insert the current directory into the tree
-        gui.treeData.Insert(self.parent, key, self.name, tuple(subdirectory_names))
-        if self.subdirectories:
-            # Recursively generate the tree data for subdirectories
-            for subdirectory in self.subdirectories.values():
-                subdirectory.toTreeData(gui)
-
-    def rename(self, new_name):
-        # Rename the directory
-        pass
+    def stop(self):
+        # Stop playback, returns True if something was playing
+        playing = self.isPlaying()
+        pg.mixer.music.stop()
+        if self.channel is not None:
+            self.channel.stop()
+        return playing
 
-    def delete(self):
-        # Delete the directory
-        pass
+    def setVolume(self, volume):
+        self.volume = volume
+        pg.mixer.music.set_volume(volume)
+        if self.channel is not None:
+            self.channel.set_volume(volume)
+
+    def isPlaying(self):
+        return pg.mixer.music.get_busy() or (self.channel is not None and self.channel.get_busy())
+
+
+class PreloadCache:
+    # Decoded Sounds for the rows around the selection, so stepping through the
+    # table plays each file at once. Sounds are loaded on a background thread
+    # and kept within budget bytes, dropping the least recently used first.
+    # Files whose decoded size would exceed max_file are left to be streamed.
+    def __init__(self, budget=256 * 2**20, max_file=32 * 2**20):
+        self.budget = budget
+        self.max_file = max_file
+        self.sounds = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.jobs = Queue()
+        self.generation = 0
+        threading.Thread(target=self.work, daemon=True).start()
+
+    def get(self, path):
+        with self.lock:
+            if path not in self.sounds:
+                return None
+            self.sounds.move_to_end(path)
+            return self.sounds[path][0]
+
+    def preload(self, files):
+        # Load files (File objects, most wanted first), forgetting earlier requests
+        self.generation += 1
+        for file in files:
+            self.jobs.put((self.generation, file))
+
+    def decodedSize(self, seconds):
+        # Bytes a Sound of that length takes, None while the mixer is not initialized
+        init = pg.mixer.get_init()
+        if init is None:
+            return None
+        frequency, size, channels = init
+        return int(seconds * frequency * channels * abs(size) // 8)
+
+    def work(self):
+        while True:
+            generation, file = self.jobs.get()
+            if generation != self.generation:
+                continue
+            with self.lock:
+                if file.path in self.sounds:
+                    continue
+            # only files of known, small enough length are worth decoding ahead, and only once the mixer is up
+            duration = file.info.get('duration') if file.info else None
+            size = self.decodedSize(duration) if duration is not None else None
+            if size is None or size > self.max_file:
+                continue
+            try:
+                with metrics.span('preload.decode'):
+                    sound = pg.mixer.Sound(file.path)
+                size = self.decodedSize(sound.get_length())
+            except Exception as e:
+                print(f"Failed to preload {file.path}: {e}")
+                continue
+            if size is not None:
+                self.add(file.path, sound, size)
+
+    def add(self, path, sound, size):
+        with self.lock:
+            self.sounds[path] = (sound, size)
+            self.size += size
+            while self.size > self.budget and len(self.sounds) > 1:
+                old_path, (old_sound, old_size) = self.sounds.popitem(last=False)
+                self.size -= old_size
+
+
+class LRUCache(OrderedDict):
+    # A dict that keeps at most limit entries, dropping the least recently used
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.limit:
+            self.popitem(last=False)
+
+
+class ProbePool:
+    # A fixed number of worker threads that work out the lengths of files.
+    # Jobs are taken in priority order and belong to the generation they were
+    # queued in. cancel() starts a new generation: queued jobs of older ones
+    # are skipped and their results are not put on the results queue.
+    def __init__(self, results, workers=4, metadata=None):
+        self.results = results
+        #MetadataStore that probed lengths are written to
+        self.metadata = metadata
+        self.jobs = PriorityQueue()
+        self.generation = 0
+        self.order = itertools.count()
+        for _ in range(workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def submit(self, file, priority=0):
+        self.jobs.put((priority, next(self.order), self.generation, file))
+
+    def cancel(self):
+        self.generation += 1
+        with self.jobs.mutex:
+            self.jobs.queue.clear()
+
+    def work(self):
+        while True:
+            priority, order, generation, file = self.jobs.get()
+            if generation != self.generation:
+                continue
+            # the file may already have been probed for an earlier view
+            if file.length == '...':
+                try:
+                    stat = os.stat(file.path)
+                except OSError:
+                    stat = None
+                with metrics.span('probe.file'):
+                    info = file.calculateLength()
+                metrics.count('probe.files' if info else 'probe.failed')
+                if stat is not None:
+                    file.size = stat.st_size
+                if self.metadata is not None and stat is not None:
+                    self.metadata.put(file.path, stat, info)
+            if generation == self.generation:
+                self.results.put((generation, file.path, file.length))
+
+
+class ResultsModel:
+    # The rows of the results table. Every row keeps its index into the full
+    # list of paths, but only the page in view and a buffer of rows on either
+    # side are built; rows that fall out of that range are dropped again.
+    def __init__(self, paths, loader, page_size=50, buffer=100, groups=None):
+        self.paths = paths
+        #the number shown in the Group column of each row, if any
+        self.groups = groups
+        #loader({index: path}, priority) returns {index: File}
+        self.loader = loader
+        self.page_size = page_size
+        self.buffer = buffer
+        self.rows = {}
+        self.files = {}
+        self.offset = 0
+        self.moves = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    @metrics.timed('table.page')
+    def scrollTo(self, offset):
+        # Move the page to start at row offset and return its rows
+        self.offset = max(0, min(offset, len(self.paths) - self.page_size))
+        end = min(self.offset + self.page_size, len(self.paths))
+        low = max(0, self.offset - self.buffer)
+        high = min(end + self.buffer, len(self.paths))
+        for index in [index for index in self.rows if index < low or index >= high]:
+            del self.rows[index]
+            del self.files[index]
+        # the rows in view are probed before the buffer, and both before rows of earlier pages
+        self.moves += 1
+        self.load(range(self.offset, end), -2 * self.moves)
+        self.load(range(low, high), -2 * self.moves + 1)
+        return self.page()
+
+    def setPaths(self, paths):
+        # Replace the list of paths, keeping the built rows whose path is unchanged, and return the rows of the page
+        self.paths = paths
+        for index in [index for index, file in self.files.items() if index >= len(paths) or paths[index] != file.path]:
+            del self.rows[index]
+            del self.files[index]
+        return self.scrollTo(self.offset)
+
+    def load(self, indexes, priority):
+        missing = {index: self.paths[index] for index in indexes if index not in self.rows}
+        if missing:
+            metrics.count('table.rows_built', len(missing))
+            for index, file in self.loader(missing, priority).items():
+                self.files[index] = file
+                group = self.groups[index] if self.groups else ''
+                self.rows[index] = [file.name, file.file_type, file.length, group, file.path]
+
+    def page(self):
+        return [self.rows[index] for index in range(self.offset, min(self.offset + self.page_size, len(self.paths)))]
+
+    def fileAt(self, row):
+        # The File shown in row of the current page
+        return self.files.get(self.offset + row)
+
+    def neighbours(self, row, count):
+        # The built Files nearest to row of the current page, nearest first
+        index = self.offset + row
+        files = []
+        for distance in range(1, count + 1):
+            for neighbour in (index + distance, index - distance):
+                if neighbour in self.files:
+                    files.append(self.files[neighbour])
+        return files
+
+    def setLength(self, file):
+        # Copy the length of file into its row, returns True if the row is in view
+        row = self.rows.get(file.index)
+        if row is None or self.files[file.index] is not file:
+            return False
+        row[2] = file.length
+        return self.offset <= file.index < self.offset + self.page_size
 
 
 #Creates the functionality for the SoundFileExplorer
-class SoundFileExplorer:
-    def __init__(self, file_queue):
-        self.loadState()
+class SoundFileExplorer(SoundLibrary):
+    def __init__(self, file_queue, probe_workers=4, page_size=50, cache_files=20000, scan_workers=SCAN_WORKERS):
+        super().__init__()
         self.file_queue = file_queue
-        self.fileCache = {}
-        self.table_update = False
-
-    def addDirectory(self, directory, parent=''):
-        # add the directory and its subdirectories to the directory_map
-        d1 = directory
-        queue = [(directory, parent)]
-        while queue:
-            current, parent = queue.pop(0)                
-            self.directory_map[current.path] = current
-            current.parent = parent
-            for subdirectory in current.subdirectories.values():
-                queue.append((subdirectory, current.path))
+        #worker processes that scan the subtrees of a folder being added
+        self.scan_workers = scan_workers
+        #probes file lengths in the background and puts them on file_queue
+        self.probes = ProbePool(file_queue, probe_workers, self.metadata)
+        #File objects of recently shown rows, the rows in view are always among the most recent
+        self.fileCache = LRUCache(cache_files)
+        #rows of the results table that are currently built
+        self.page_size = page_size
+        self.view = ResultsModel([], self.loadFiles, page_size)
+        #the running search, its term and the matches it has found so far
+        self.searching = None
+        self.term = ''
+        self.results = []
+        self.matches = 0
+        self.records = 0
+        #the paths and groups of the table before they are filtered and sorted
+        self.shown = []
+        self.groups = None
+        #filter conditions from parseFilter() and the (column, reverse) order of the table, if any
+        self.conditions = []
+        self.sorting = None
+        #what the table shows, ('folder', path) or ('search', term), None for anything else
+        self.showing = None
 
-    def removeDirectory(self, values):
-        try:
-            removed = self.directory_map.pop(values['-TREE-'][0], None)
-            removed.subdirectories.clear()
+    def rescanDirectory(self, path):
+        # Rescan a library directory and move the Files of renamed files to their new paths.
+        # Returns the number of files added, removed and renamed.
+        added, removed, renamed = self.rescan(path)
+        return self.moveFiles(added, removed, renamed)
+
+    def refreshDirectories(self, paths, rescans=()):
+        # List the library folders at paths again and rescan the folders in rescans, as
+        # reported by a LibraryWatcher, and bring the table up to date. Returns the number
+        # of files added, removed and renamed and the rows of the table's page, None if
+        # the table did not change.
+        added, removed, renamed = self.refresh(paths)
+        for path in rescans:
+            if path in self.directory_map:
+                changes = self.rescan(path)
+                for found, more in zip((added, removed, renamed), changes):
+                    found.update(more)
+        counts = self.moveFiles(added, removed, renamed)
+        return counts, self.followChanges(added, removed)
+
+    def moveFiles(self, added, removed, renamed):
+        # Move the Files of renamed files to their new paths and return the number of files added, removed and renamed.
+        # Files of other removed paths are dropped, so that whatever is there now is probed again.
+        # take every File out first, a renamed file may take the path of another one
+        moved = {file_path: self.fileCache.pop(file_path, None) for file_path in removed}
+        for file_path, files in moved.items():
+            if file_path in renamed and files:
+                new_path = renamed[file_path]
+                for file in files:
+                    file.path = new_path
+                    file.name = os.path.splitext(os.path.basename(new_path))[0]
+                    file.file_type = os.path.splitext(new_path)[-1]
+                self.fileCache[new_path] = files
+                self.fileProbed(files[0])
+        return len(added) - len(renamed), len(removed) - len(renamed), len(renamed)
 
-            if removed is None:
-                sg.popup_error(f"Directory not found: {values['-TREE-'][0]}")
-                return
+    def followChanges(self, added, removed):
+        # Take files added to and removed from the library into the table of a folder or
+        # a finished search, and return the rows of its page, None if the table did not change
+        if self.showing is None or self.searching is not None or not (added or removed):
+            return None
+        kind, key = self.showing
+        if kind == 'folder':
+            prefix = key + os.sep
+            belongs = lambda path: path.startswith(prefix)
+        else:
+            belongs = lambda path: key in os.path.basename(path)
+        new = [path for path in added if belongs(path)]
+        if not new and not any(map(belongs, removed)):
+            return None
+        shown = [path for path in self.shown if path not in removed] + new
+        if kind == 'folder':
+            shown.sort()
+        self.shown = shown
+        paths, groups = self.arrange()
+        if kind == 'search':
+            self.results = paths
+            self.matches = len(paths)
+        return self.view.setPaths(paths)
 
-            if removed.parent:
-                parent = self.directory_map.get(removed.parent)
-                if parent is not None and removed.path in parent.subdirectories:
-                    parent.subdirectories.pop(removed.path, None)
+    def fileProbed(self, file):
+        # Count the duration of a probed File in its folders' totals and keep its values for sorting and filtering
+        if file.info:
+            self.addDuration(file.path, file.info.get('duration'))
+        if self._columns is not None:
+            self._columns.set(file.path, file.info, file.size)
 
-            keys_to_remove = [key for key in self.directory_map.keys() if key.startswith(values['-TREE-'][0])]
-            for key in keys_to_remove:
-                self.directory_map.pop(key, None)  
+    def removeDirectory(self, values):
+        try:
+            self.removeFolder(values['-TREE-'][0])
+        except KeyError:
+            sg.popup_error(f"Directory not found: {values['-TREE-'][0]}")
         except Exception as e:
             sg.popup_error(f"Failed to remove directory: {e}")
-            
-            
-            
 
-    def search(self, values):
-        term = values['-TERM-']
+    def startSearch(self, term):
+        # Start a search for term with an empty table, continueSearch() fills it in as matches are found
+        rows = self.showFiles([])
         print(f"Searching for {term}")
-        
-        self.matches = 0
+        self.showing = ('search', term)
+        self.term = term
         self.results = []
-        self.records = 0
-        # Search for audio files by keyword
+        self.matches = 0
+        self.records = len(self.index)
+        self.ranked = []
+        self.others = []
+        #the others that pass the filter
+        self.kept = []
+        self.searching = self.index.searchRanked(term)
+        self.search_started = time.perf_counter()
+        metrics.count('search.started')
+        return rows
+
+    def continueSearch(self, budget=0.02):
+        # Take the matches found in about budget seconds into the table and return the rows of its page,
+        # None if no search is running. The best ranked matches stay at the top of the table.
+        if self.searching is None:
+            return None
+        deadline = time.monotonic() + budget
+        first = not self.ranked and not self.others
         try:
-            for directory in self.directory_map.values():
-                for file_path in directory.audio_files:
-                    self.records += 1
-                    if term in os.path.basename(file_path):
-                        self.results.append(file_path)
-                        self.matches += 1
-            print(f"{self.matches} Matches for {term} out of {self.records} records.")
-        except Exception as e:
-            sg.popup_error(f"Failed to search for {term}: {e}")
-            self.results = []
-            self.matches = 0
-            self.records = 0
-    
+            with metrics.span('search.step'):
+                while time.monotonic() < deadline:
+                    self.ranked, others = next(self.searching)
+                    self.others.extend(others)
+                    # each batch is filtered as it comes in, sorting waits for the last one
+                    self.kept.extend(self.filtered(others))
+        except StopIteration:
+            self.searching = None
+            metrics.observe('search.total', time.perf_counter() - self.search_started)
+            metrics.count('search.matches', len(self.ranked) + len(self.others))
+            print(f"{len(self.ranked) + len(self.others)} Matches for {self.term} out of {self.records} records.")
+        if first and (self.ranked or self.others or self.searching is None):
+            metrics.observe('search.first_results', time.perf_counter() - self.search_started)
+        ranked = self.filtered(self.ranked)
+        self.results = ranked + self.kept
+        self.matches = len(self.results)
+        if self.searching is None:
+            self.shown, self.groups = self.ranked + self.others, None
+            if self.sorting is not None:
+                self.results = self.columns.sort(self.results, *self.sorting)
+        return self.view.setPaths(self.results)
+
+    def stopSearch(self):
+        # Stop the running search, the matches found so far stay in the table
+        if self.searching is not None:
+            self.searching.close()
+            self.searching = None
+
     # Handles the event when a tree item is selected
+    @metrics.timed('table.tree')
     def handleTreeEvent(self, values):
-        start_time = time.time()
         if '-TREE-' in values and values['-TREE-']:
             # Get the key of the selected item
             key = values['-TREE-'][0]
@@ -254,73 +579,110 @@ class SoundFileExplorer:
                 sg.PopupError("Directory not found.")
                 return    
                  
-            tableData = []
-            if len(directory.audio_files) == 0:
-                return tableData
-            index = 0 #index to keep track of the file
-            # Add the audio files to the table
-            for file_path in directory.audio_files:
-                #check if already in fileCache
-                if file_path in self.fileCache:
-                    for file in self.fileCache[file_path]:
-                        file.index = index
-                        tableData.append([file.name, file.file_type, file.length, file.path])
-                        index += 1
-                else:
-                    #load the file into the table
-                    file = self.loadFile(file_path, index)
-                    tableData.append([file.name, file.file_type, file.length, file.path])
-                    index += 1
-            end_time = time.time()
-            print(f"Time to update table: {end_time - start_time}")
-            return tableData
-        
-            
-    def saveState(self):
-        # Use pickle to save the state of the explorer
-        with open('explorer.pkl', 'wb') as f:
-            pickle.dump(self.directory_map, f)
+            rows = self.showFiles(sorted(directory.subtreeFiles()))
+            self.showing = ('folder', key)
+            return rows
 
-    def loadState(self):
-        # Use pickle to load the state of the explorer
-        try:
-            with open('explorer.pkl', 'rb') as f:
-                self.directory_map = pickle.load(f)
-        except:
-            #initialize directories if not found
-            self.directory_map = {}
-    
-    def clearState(self):
-        # Clear the state of the explorer
-        self.directory_map = {}
+    @metrics.timed('table.build')
+    def showFiles(self, paths, groups=None):
+        # Put paths in the results table and return the rows of its first page
+        # lengths still being probed for the previous table are no longer needed
+        # a new table replaces the one a running search was filling
+        self.stopSearch()
+        self.probes.cancel()
+        self.shown, self.groups = paths, groups
+        self.showing = None
+        paths, groups = self.arrange()
+        self.view = ResultsModel(paths, self.loadFiles, self.page_size, groups=groups)
+        return self.view.scrollTo(0)
 
+    def arrange(self):
+        # The paths and groups of the table after the filter and sort order
+        if not self.conditions and self.sorting is None:
+            return self.shown, self.groups
+        paths = self.filtered(self.shown)
+        if self.sorting is not None:
+            paths = self.columns.sort(paths, *self.sorting)
+        groups = None
+        if self.groups:
+            group = dict(zip(self.shown, self.groups))
+            groups = [group[path] for path in paths]
+        return paths, groups
 
-    def updateAudioTable(self, values):
-        try:
-            tableData = []
-            index = 0
-            for file_path in self.results:
-                    #check if already in fileCache
-                if file_path in self.fileCache:
-                    for file in self.fileCache[file.path]:
-                        file.index = index
-                        tableData.append([file.name, file.file_type, file.length, file.path])
-                        index += 1
-                else:
-                    #load the file into the table
-                    file = self.loadFile(file_path, index)
-                    tableData.append([file.name, file.file_type, file.length, file.path])
-                    index += 1
-                    
-            return tableData
-            print(f"{sfe.matches } Matches for {values['-TERM-']} out of {sfe.records} records.")
-        except Exception as e:
-            sg.popup_error(f"Failed to update table: {e} : {file}")
+    def filtered(self, paths):
+        # The paths that meet the filter, or might once their values are probed
+        if not self.conditions:
+            return paths
+        return self.columns.filter(paths, self.conditions, keep_unknown=True)
+
+    def unprobed(self):
+        # How many rows of the table are only shown because their filtered values are not probed yet
+        if not self.conditions:
+            return 0
+        return self.columns.countUnknown(self.view.paths, [column for column, op, value in self.conditions])
+
+    @metrics.timed('table.filter')
+    def setFilter(self, text):
+        # Filter the table by conditions such as "duration<2s, 48kHz, stereo" and return the rows of its page.
+        # An empty text shows every file again; raises ValueError if the text cannot be read.
+        self.conditions = parseFilter(text)
+        return self.rearrange()
+
+    @metrics.timed('table.sort')
+    def sortBy(self, column):
+        # Sort the table by a column of FileColumns, or 'name', and return the rows of its first page.
+        # Sorting by the same column again reverses the order.
+        reverse = self.sorting == (column, False)
+        self.sorting = (column, reverse)
+        return self.rearrange()
+
+    def rearrange(self):
+        # Show the table with the current filter and sort order, a running search carries on with them
+        if self.searching is not None:
+            self.kept = list(self.filtered(self.others))
+            return self.continueSearch(0)
+        paths, groups = self.arrange()
+        self.view = ResultsModel(paths, self.loadFiles, self.page_size, groups=groups)
+        return self.view.scrollTo(0)
+
+    def findDuplicates(self, path, post):
+        # Start looking for duplicates under the library folder path, or in the whole library if path is None
+        paths = self.directory_map[path].subtreeFiles() if path else self.library.allFiles()
+        search = DuplicateSearch(paths, self.metadata, post)
+        search.start()
+        return search
+
+    def showDuplicates(self, groups):
+        # Show duplicate groups in the results table, one after the other with their group number
+        paths = [path for group in groups for path in group]
+        numbers = [number for number, group in enumerate(groups, 1) for path in group]
+        return self.showFiles(paths, numbers)
+
+    def loadFiles(self, rows, priority):
+        # Return File objects for a {row index: path} dict, probing the new ones with priority
+        # files probed in an earlier session need no probing
+        with metrics.span('metadata.lookup'):
+            known = self.metadata.lookup(p for p in rows.values() if p not in self.fileCache)
+        files = {}
+        for index, file_path in rows.items():
+            #check if already in fileCache
+            if file_path in self.fileCache:
+                file = self.fileCache[file_path][0]
+                if file.length == '...':
+                    file.getLength(self.probes, priority)
+            else:
+                file = self.loadFile(file_path, priority, known.get(file_path))
+            file.index = index
+            files[index] = file
+        return files
             
-    def loadFile(self, file_path, index):
-        file = File(file_path, self.file_queue)
-        file.getLength()
-        file.index = index
+    def loadFile(self, file_path, priority, info=None):
+        file = File(file_path)
+        if info is not None:
+            file.setInfo(info)
+            self.fileProbed(file)
+        else:
+            file.getLength(self.probes, priority)
         self.fileCache[file.path] = [file]
         return file
         
\ No newline at end of file
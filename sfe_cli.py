@@ -0,0 +1,242 @@
+"""
+Command line access to the Sound File Explorer library, without the GUI.
+- scan: adds folders to the library, scanning them together in a pool of
+  --workers processes.
+- rescan: refreshes library folders (all of them by default).
+- watch: keeps library folders (all of them by default) up to date as
+  files are added, removed and renamed, until interrupted or --duration
+  seconds have passed.
+- search: lists the files whose name contains a term.
+- stats: prints totals of the library.
+
+Every command writes JSON lines to stdout, one object per event, each with
+an "event" key. The library modules are only imported once a command runs,
+so starting the tool costs little more than starting Python. --metrics FILE
+writes the counters and timings the command collected to FILE as JSON.
+
+Usage: python sfe_cli.py [--library FILE] [--metadata FILE] scan PATH [PATH ...] [--workers N]
+       python sfe_cli.py rescan [PATH ...]
+       python sfe_cli.py watch [PATH ...] [--poll] [--debounce SECONDS] [--duration SECONDS]
+       python sfe_cli.py search TERM [--limit N]
+       python sfe_cli.py stats
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+#seconds between progress lines while scanning
+REPORT_INTERVAL = 0.25
+
+
+def emit(record, flush=False):
+    sys.stdout.write(json.dumps(record) + '\n')
+    if flush:
+        sys.stdout.flush()
+
+
+def openLibrary(args):
+    from sfe_core import SoundLibrary
+    return SoundLibrary(args.library, args.metadata)
+
+
+def scan(args):
+    from sfe_scan import Directory, scanTree, scanParallel, iterSubtree, setLatency, SCAN_WORKERS
+    library = openLibrary(args)
+    failed = False
+    try:
+        roots = []
+        for path in dict.fromkeys(map(os.path.abspath, args.paths)):
+            error = library.rootError(path)
+            if error is None and any(path.startswith(os.path.join(root.path, ''))
+                                     or root.path.startswith(os.path.join(path, '')) for root in roots):
+                error = 'inside or around another folder being added'
+            if error is None:
+                roots.append(Directory(path, scan=False))
+                continue
+            emit({'event': 'error', 'path': path, 'error': error}, True)
+            failed = True
+        if not roots:
+            return 1 if failed else 0
+        started = time.monotonic()
+        totals = {'folders': 0, 'files': 0, 'reported': 0.0}
+
+        def progress(folders, files):
+            totals['folders'] += folders
+            totals['files'] += files
+            now = time.monotonic()
+            if now - totals['reported'] >= REPORT_INTERVAL:
+                totals['reported'] = now
+                emit({'event': 'progress', 'folders': totals['folders'], 'files': totals['files']}, True)
+
+        setLatency(args.simulate_latency)
+        try:
+            workers = args.workers if args.workers is not None else SCAN_WORKERS
+            if workers > 1:
+                scanParallel(roots, workers, progress)
+            else:
+                for root in roots:
+                    scanTree(root, progress)
+        except OSError as e:
+            emit({'event': 'error', 'path': e.filename, 'error': e.strerror or str(e)}, True)
+            return 1
+        seconds = round(time.monotonic() - started, 3)
+        for root in roots:
+            library.addDirectory(root)
+            emit({'event': 'added', 'path': root.path, 'folders': sum(1 for directory in iterSubtree(root)),
+                  'files': root.file_count, 'seconds': seconds}, True)
+    finally:
+        library.close()
+    return 1 if failed else 0
+
+
+def rescan(args):
+    library = openLibrary(args)
+    failed = False
+    try:
+        paths = [os.path.abspath(path) for path in args.paths] or list(library.directory_map.roots)
+        for path in paths:
+            if path not in library.directory_map:
+                emit({'event': 'error', 'path': path, 'error': 'not in the library'}, True)
+                failed = True
+                continue
+            try:
+                added, removed, renamed = library.rescan(path)
+            except OSError as e:
+                emit({'event': 'error', 'path': path, 'error': str(e)}, True)
+                failed = True
+                continue
+            emitChanges(added, removed, renamed)
+            emit({'event': 'rescanned', 'path': path, 'added': len(added) - len(renamed),
+                  'removed': len(removed) - len(renamed), 'renamed': len(renamed)}, True)
+    finally:
+        library.close()
+    return 1 if failed else 0
+
+
+def emitChanges(added, removed, renamed):
+    moved = set(renamed.values())
+    for old_path, new_path in renamed.items():
+        emit({'event': 'renamed', 'path': new_path, 'from': old_path})
+    for file_path in removed.keys() - renamed.keys():
+        emit({'event': 'removed', 'path': file_path})
+    for file_path in added.keys() - moved:
+        emit({'event': 'added', 'path': file_path})
+
+
+def watch(args):
+    from queue import Queue, Empty
+    from sfe_scan import iterSubtree
+    from sfe_watch import LibraryWatcher
+    library = openLibrary(args)
+    changes = Queue()
+    watcher = LibraryWatcher(lambda event, value: changes.put(value), not args.poll, args.debounce,
+                             poll_interval=args.poll_interval)
+    try:
+        paths = [os.path.abspath(path) for path in args.paths] or list(library.directory_map.roots)
+        for path in paths:
+            if path not in library.directory_map:
+                emit({'event': 'error', 'path': path, 'error': 'not in the library'}, True)
+                return 1
+            watcher.watch(iterSubtree(library.directory_map[path]))
+        watcher.start()
+        emit({'event': 'watching', 'paths': paths, 'mode': watcher.mode}, True)
+        deadline = time.monotonic() + args.duration if args.duration is not None else None
+        while deadline is None or time.monotonic() < deadline:
+            try:
+                folders, rescans = changes.get(timeout=0.5 if deadline is None else
+                                               max(0.0, min(0.5, deadline - time.monotonic())))
+            except Empty:
+                continue
+            started = time.perf_counter()
+            added, removed, renamed = library.refresh(folders)
+            for path in rescans:
+                if path in library.directory_map:
+                    for found, more in zip((added, removed, renamed), library.rescan(path)):
+                        found.update(more)
+                    watcher.watch(iterSubtree(library.directory_map[path]))
+            watcher.follow(library.directory_map, folders)
+            emitChanges(added, removed, renamed)
+            emit({'event': 'refreshed', 'folders': len(folders), 'rescanned': rescans,
+                  'added': len(added) - len(renamed), 'removed': len(removed) - len(renamed),
+                  'renamed': len(renamed), 'seconds': round(time.perf_counter() - started, 4)}, True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+        library.close()
+    return 0
+
+
+def search(args):
+    library = openLibrary(args)
+    try:
+        results = library.searchFiles(args.term)
+        for file_path in results[:args.limit]:
+            emit({'event': 'match', 'path': file_path})
+        emit({'event': 'searched', 'term': args.term, 'matches': len(results), 'records': len(library.index)}, True)
+    finally:
+        library.close()
+    return 0
+
+
+def stats(args):
+    library = openLibrary(args)
+    try:
+        emit(dict(event='stats', **library.stats()), True)
+    finally:
+        library.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--library', default='library.db', help='library database (default: library.db)')
+    parser.add_argument('--metadata', default='metadata.db', help='metadata database (default: metadata.db)')
+    parser.add_argument('--metrics', metavar='FILE', help='write the metrics of the command to FILE as JSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('scan', help='add folders to the library')
+    command.add_argument('paths', nargs='+')
+    command.add_argument('--workers', type=int, default=None,
+                         help='worker processes scanning the folders, 1 to scan them in this process '
+                              '(default: up to 8, one per CPU)')
+    command.add_argument('--simulate-latency', type=float, default=0.0, metavar='SECONDS',
+                         help='delay every folder listing, to try the scan as if on slow storage')
+    command.set_defaults(run=scan)
+    command = commands.add_parser('rescan', help='refresh library folders, all of them by default')
+    command.add_argument('paths', nargs='*')
+    command.set_defaults(run=rescan)
+    command = commands.add_parser('watch', help='keep library folders up to date as their files change')
+    command.add_argument('paths', nargs='*')
+    command.add_argument('--poll', action='store_true', help='stat the folders regularly instead of using inotify')
+    command.add_argument('--poll-interval', type=float, default=5.0, metavar='SECONDS',
+                         help='seconds between stats of every folder when polling (default: 5)')
+    command.add_argument('--debounce', type=float, default=0.5, metavar='SECONDS',
+                         help='quiet time after a change before folders are listed again (default: 0.5)')
+    command.add_argument('--duration', type=float, default=None, metavar='SECONDS',
+                         help='stop after SECONDS, by default watch until interrupted')
+    command.set_defaults(run=watch)
+    command = commands.add_parser('search', help='find files whose name contains a term')
+    command.add_argument('term')
+    command.add_argument('--limit', type=int, default=None, help='most matches to list')
+    command.set_defaults(run=search)
+    command = commands.add_parser('stats', help='print totals of the library')
+    command.set_defaults(run=stats)
+    args = parser.parse_args()
+    if args.metrics:
+        from sfe_metrics import metrics
+        metrics.enable()
+    try:
+        sys.exit(args.run(args))
+    except BrokenPipeError:
+        # the reader went away, e.g. piped into head
+        sys.stderr.close()
+        sys.exit(1)
+    finally:
+        if args.metrics:
+            metrics.dump(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Metadata of the library's files kept column by column.
+
+FileColumns gives every file path a row id and keeps each field in a typed
+array indexed by row: duration in seconds, sample rate, channels, bit
+depth, size in bytes and a code for the file type. A million files take a
+few tens of MB rather than a Python object each. Every column has an index
+of row ids sorted by value, built when first needed after a change, so rows
+can be sorted by any column without comparing them, and a range of values
+is found by binary search.
+
+parseFilter() reads filters such as "duration < 2 s, 48 kHz, stereo".
+"""
+import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain, compress, repeat
+
+#unknown values are stored as -1, which sorts first and is left out of every range unless kept on purpose
+UNKNOWN = -1
+#array type codes of the numeric columns
+COLUMNS = {'duration': 'd', 'sample_rate': 'l', 'channels': 'l', 'bit_depth': 'l', 'size': 'q', 'type': 'l'}
+#other names a filter can use for the columns
+ALIASES = {'length': 'duration', 'rate': 'sample_rate', 'samplerate': 'sample_rate', 'bits': 'bit_depth',
+           'bitdepth': 'bit_depth', 'format': 'type'}
+#multipliers for the units a filter value can have
+UNITS = {'': 1, 's': 1, 'sec': 1, 'ms': 0.001, 'min': 60, 'hz': 1, 'k': 1000, 'khz': 1000,
+         'b': 1, 'kb': 1000, 'mb': 1000 ** 2, 'gb': 1000 ** 3}
+CONDITION = re.compile(r'(?P<column>[a-z_]+)\s*(?P<op><=|>=|<|>|=)\s*(?P<value>[0-9]*\.?[0-9]+|\.?[a-z0-9]+)'
+                       r'\s*(?P<unit>ms|min|sec|s|khz|hz|kb|mb|gb|k|b)?\b'
+                       r'|(?P<rate>[0-9]*\.?[0-9]+)\s*(?P<rate_unit>k?hz)\b'
+                       r'|(?P<word>mono|stereo)\b', re.IGNORECASE)
+
+
+def parseFilter(text):
+    """Read a filter into a list of (column, op, value) conditions.
+
+    Conditions are separated by commas or spaces, e.g. "duration<2s,
+    rate>=44.1k, type=wav". "48 kHz" alone means that sample rate and
+    "mono" and "stereo" a channel count. Raises ValueError for anything
+    that cannot be read.
+    """
+    conditions = []
+    for match in CONDITION.finditer(text):
+        if match['word']:
+            conditions.append(('channels', '=', 1 if match['word'].lower() == 'mono' else 2))
+        elif match['rate']:
+            conditions.append(('sample_rate', '=', round(float(match['rate']) * UNITS[match['rate_unit'].lower()])))
+        else:
+            column = match['column'].lower()
+            column = ALIASES.get(column, column)
+            if column not in COLUMNS:
+                raise ValueError(f"Unknown column: {match['column']}")
+            value = match['value'].lower()
+            if column == 'type':
+                if match['op'] != '=':
+                    raise ValueError("File types can only be compared with =")
+                conditions.append((column, match['op'], value.lstrip('.')))
+                continue
+            try:
+                value = float(value) * UNITS[(match['unit'] or '').lower()]
+            except ValueError:
+                raise ValueError(f"Not a number: {match['value']}") from None
+            conditions.append((column, match['op'], value))
+    leftover = CONDITION.sub('', text).replace(',', ' ').strip()
+    if leftover:
+        raise ValueError(f"Cannot read filter: {leftover}")
+    return conditions
+
+
+class FileColumns:
+    def __init__(self):
+        #row id -> path, and path -> row id
+        self.paths = []
+        self.ids = {}
+        self.columns = {column: array(code) for column, code in COLUMNS.items()}
+        #type code -> file extension without the dot, and back
+        self.types = []
+        self.type_codes = {}
+        #type code -> position of its extension in alphabetical order, as of the last type index
+        self.type_ranks = {}
+        #column -> (row ids sorted by value, the values in that order), dropped when the column changes
+        self.indexes = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def rowId(self, path):
+        row = self.ids.get(path)
+        if row is None:
+            row = self.add([path])[0]
+        return row
+
+    def rowIds(self, paths):
+        rows = list(map(self.ids.get, paths))
+        if None in rows:
+            return [self.rowId(path) for path in paths]
+        return rows
+
+    def add(self, paths):
+        # Give new paths rows with unknown values and return the row ids of all of them
+        new = [path for path in dict.fromkeys(paths) if path not in self.ids]
+        if new:
+            start = len(self.paths)
+            self.paths.extend(new)
+            self.ids.update(zip(new, range(start, start + len(new))))
+            for column, values in self.columns.items():
+                if column != 'type':
+                    values.extend(repeat(UNKNOWN, len(new)))
+            self.columns['type'].extend(self.typeCode(os.path.splitext(path)[-1].lstrip('.').lower()) for path in new)
+            # new rows belong in every index
+            self.indexes.clear()
+        return list(map(self.ids.__getitem__, paths))
+
+    def typeCode(self, file_type):
+        code = self.type_codes.get(file_type)
+        if code is None:
+            code = self.type_codes[file_type] = len(self.types)
+            self.types.append(file_type)
+        return code
+
+    def set(self, path, info=None, size=None):
+        # Record the probed info (a dict with the duration, sample_rate, channels and bit_depth) of a file,
+        # and its size unless that is None
+        row = self.rowId(path)
+        info = info or {}
+        values = [('duration', info.get('duration')), ('sample_rate', info.get('sample_rate')),
+                  ('channels', info.get('channels')), ('bit_depth', info.get('bit_depth'))]
+        if size is not None:
+            values.append(('size', size))
+        for column, value in values:
+            value = UNKNOWN if value is None else value
+            if self.columns[column][row] != value:
+                self.columns[column][row] = value
+                self.indexes.pop(column, None)
+
+    def rename(self, pairs):
+        # Give the new path of each (old path, new path) pair the values of the old one, its type aside
+        moves = [(self.ids[old], self.rowId(new)) for old, new in pairs if old in self.ids]
+        for column, values in self.columns.items():
+            if column == 'type':
+                continue
+            # read every old value first, paths may have been swapped with each other
+            moved = [(new_row, values[row]) for row, new_row in moves]
+            for new_row, value in moved:
+                if values[new_row] != value:
+                    values[new_row] = value
+                    self.indexes.pop(column, None)
+
+    def forget(self, paths):
+        # Make every value of paths unknown again, their type aside
+        rows = [self.ids[path] for path in paths if path in self.ids]
+        for column, values in self.columns.items():
+            if column == 'type':
+                continue
+            for row in rows:
+                if values[row] != UNKNOWN:
+                    values[row] = UNKNOWN
+                    self.indexes.pop(column, None)
+
+    def index(self, column):
+        # Row ids sorted by the values of column, and the values in that order
+        if column not in self.indexes:
+            values = self.columns[column]
+            if column == 'type':
+                # by extension rather than by code, the index holds the rank of each row's extension
+                ranked = sorted(range(len(self.types)), key=self.types.__getitem__)
+                self.type_ranks = {code: rank for rank, code in enumerate(ranked)}
+                values = array('l', map(self.type_ranks.__getitem__, values))
+            order = sorted(range(len(values)), key=values.__getitem__)
+            self.indexes[column] = (array('l', order), array(values.typecode, map(values.__getitem__, order)))
+        return self.indexes[column]
+
+    def span(self, column, op, value):
+        # The positions [low, high) in the index of column whose known values meet the condition
+        order, values = self.index(column)
+        low, high = bisect_left(values, 0), len(values)
+        if op == '<':
+            high = bisect_left(values, value)
+        elif op == '<=':
+            high = bisect_right(values, value)
+        elif op == '>':
+            low = max(low, bisect_right(values, value))
+        elif op == '>=':
+            low = max(low, bisect_left(values, value))
+        else:
+            low, high = max(low, bisect_left(values, value)), bisect_right(values, value)
+        return low, max(low, high)
+
+    def filter(self, paths, conditions, keep_unknown=False):
+        """Return the paths that meet every (column, op, value) condition, in their order.
+
+        The rows of each condition are a slice of its column's index, found by
+        binary search. The slices are intersected smallest first, so the
+        work depends on how many rows the conditions match rather than on
+        comparing every row. With keep_unknown, rows whose value is not known
+        yet for a condition's column are kept, as they might meet it.
+        """
+        rows = self.rowIds(paths)
+        if not conditions:
+            return list(paths)
+        spans = []
+        for column, op, value in conditions:
+            if column == 'type':
+                # types are only compared for equality, by the rank of their extension
+                self.index('type')
+                value = self.type_ranks.get(self.type_codes.get(value), -2)
+            low, high = self.span(column, op, value)
+            # unknown values come first in the index
+            unknown = bisect_left(self.index(column)[1], 0) if keep_unknown else 0
+            spans.append((high - low + unknown, column, low, high, unknown))
+        spans.sort()
+        selected = None
+        for size, column, low, high, unknown in spans:
+            order = self.index(column)[0]
+            rows_met = chain(order[:unknown], order[low:high]) if unknown else order[low:high]
+            if selected is None:
+                selected = set(rows_met)
+            else:
+                selected.intersection_update(rows_met)
+            if not selected:
+                return []
+        return list(compress(paths, map(selected.__contains__, rows)))
+
+    def countUnknown(self, paths, columns):
+        # How many of paths have no known value yet in one or more of columns
+        unknown = set()
+        for column in set(columns):
+            order, values = self.index(column)
+            unknown.update(order[:bisect_left(values, 0)])
+        if not unknown:
+            return 0
+        return sum(map(unknown.__contains__, self.rowIds(paths)))
+
+    def sort(self, paths, column, reverse=False):
+        """Return paths sorted by column, or by name for column 'name'. Unknown values come first.
+
+        Few paths are sorted directly; more are picked out of the column's
+        presorted index in one pass. Either way equal values are in the order
+        of their row ids, which reverse turns around along with the values.
+        """
+        if column == 'name':
+            return sorted(paths, key=lambda path: os.path.basename(path).lower(), reverse=reverse)
+        rows = self.rowIds(paths)
+        if len(rows) * 16 < len(self.paths):
+            values = self.columns[column]
+            # ties broken by row id, as the index has them
+            if column == 'type':
+                rows.sort(key=lambda row: (self.types[values[row]], row), reverse=reverse)
+            else:
+                unknown = sorted(row for row in rows if values[row] == UNKNOWN)
+                if unknown:
+                    rows = [row for row in rows if values[row] != UNKNOWN]
+                rows.sort(key=lambda row: (values[row], row), reverse=reverse)
+                rows = unknown + rows
+        else:
+            order, values = self.index(column)
+            if reverse:
+                # unknown values still first, then the known ones from the largest down
+                known = bisect_left(values, 0)
+                order = chain(order[:known], reversed(order[known:]))
+            rows = filter(set(rows).__contains__, order)
+        return list(map(self.paths.__getitem__, rows))
@@ -0,0 +1,357 @@
+"""
+The sound library without a user interface.
+
+SoundLibrary keeps the library's folders in a DirectoryTrie backed by the
+LibraryStore, the trigram SearchIndex over their files and the
+MetadataStore of probed files, and adds, rescans, removes and searches
+folders. The durations, formats and sizes of the library's files are
+also kept in FileColumns, read when first needed, for sorting and
+filtering results by value. Errors are raised to the caller. The GUI's SoundFileExplorer and
+the sfe_cli command line tool are both built on it.
+
+Nothing here imports a GUI or audio library.
+"""
+import functools
+import os
+import pickle
+import threading
+from sfe_columns import FileColumns
+from sfe_index import SearchIndex
+from sfe_library import LibraryStore
+from sfe_metadata import MetadataStore
+from sfe_metrics import metrics
+from sfe_scan import Directory, DirectoryTrie, listDirectory, loadFiles, iterSubtree
+
+
+class PickledState:
+    # Stands in for the Directory and File classes that libraries pickled by earlier
+    # versions refer to in sfe_classes, keeping only their attributes
+    pass
+
+
+class StateUnpickler(pickle.Unpickler):
+    # Reads explorer.pkl without importing sfe_classes, which would pull in the GUI
+    PICKLED_CLASSES = {('sfe_classes', 'Directory'), ('sfe_classes', 'File')}
+
+    def find_class(self, module, name):
+        if (module, name) in self.PICKLED_CLASSES:
+            return PickledState
+        return super().find_class(module, name)
+
+
+def locked(method):
+    # Run a SoundLibrary method while holding its lock
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class SoundLibrary:
+    def __init__(self, library_path='library.db', metadata_path='metadata.db'):
+        #held while the LibraryStore and the search index change, which storeDirectory() does on scan threads,
+        #and by the LibraryStore while it reads files
+        self.lock = threading.RLock()
+        self.library_path = library_path
+        self.loadState()
+        #durations and formats of files probed in earlier sessions
+        self.metadata = MetadataStore(metadata_path)
+
+    @metrics.timed('library.add')
+    def addDirectory(self, directory, parent=''):
+        self.storeDirectory(directory, parent)
+        self.attachDirectory(directory, parent)
+
+    @metrics.timed('library.store')
+    @locked
+    def storeDirectory(self, directory, parent=''):
+        # Write a scanned directory and its subtree to the LibraryStore and the search index.
+        # This is the slow part of adding a directory, it can run on the scan's thread
+        # before attachDirectory() shows the directory in the library.
+        # read the search index before the library changes under it
+        index = self.index
+        self.library.saveTree(iterSubtree(directory), self.folderId(parent))
+        index.addAll(directory.subtreeFiles())
+
+    def attachDirectory(self, directory, parent=''):
+        # attach the directory and its subtree to the trie, below parent if given
+        self.directory_map.insert(directory, parent)
+
+    def rootError(self, path):
+        # Why the folder at path cannot be added as a top folder of the library, None if it can
+        if path in self.directory_map:
+            return 'already in the library, use rescan'
+        if self.directory_map.chain(path):
+            return 'inside a library folder, rescan that folder instead'
+        if any(root.startswith(os.path.join(path, '')) for root in self.directory_map.roots):
+            return 'contains library folders, remove them first'
+        if not os.path.isdir(path):
+            return 'not a folder'
+        return None
+
+    def folderId(self, path):
+        # The LibraryStore id of a library folder, None for no folder
+        directory = self.directory_map.get(path)
+        return directory.folder_id if directory is not None else None
+
+    @metrics.timed('library.rescan')
+    @locked
+    def rescan(self, path):
+        # Refresh a library directory in place. Every known folder is stat'ed,
+        # but only folders whose mtime or link count changed are listed again.
+        # Returns the added and removed files, each mapped to its inode, and
+        # {old path: new path} for the files among them that were renamed.
+        root = self.directory_map[path]
+        os.stat(root.path)
+        # read the search index before the library changes under it
+        self.index
+        added = {}   # file path -> inode
+        removed = {} # file path -> inode, None if unknown
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                stat = os.stat(directory.path)
+            except OSError:
+                # the folder is gone, which the listing of its parent picks up
+                continue
+            if (stat.st_mtime_ns, stat.st_nlink) != (directory.mtime, directory.nlink):
+                self.relistDirectory(directory, added, removed)
+            stack.extend(directory.subdirectories.values())
+        return self.settleChanges(added, removed)
+
+    @metrics.timed('library.refresh')
+    @locked
+    def refresh(self, paths):
+        # List the library folders at paths again, whatever their mtime, e.g. when a
+        # LibraryWatcher reports them changed. Folders no longer in the library are
+        # skipped. Returns the same as rescan().
+        self.index
+        added = {}
+        removed = {}
+        # parents first, a folder whose parent dropped it is no longer found
+        for path in sorted(set(paths)):
+            directory = self.directory_map.get(path)
+            if directory is not None:
+                self.relistDirectory(directory, added, removed)
+        return self.settleChanges(added, removed)
+
+    def settleChanges(self, added, removed):
+        # Pair up renamed files and bring the search index and metadata up to date
+        # with the files added and removed by relistDirectory().
+        # A file that disappeared and reappeared with the same inode may have been renamed or moved
+        moved = {inode: file_path for file_path, inode in removed.items() if inode is not None}
+        pairs = {}
+        for file_path, inode in added.items():
+            old_path = moved.pop(inode, None)
+            if old_path is not None:
+                pairs[old_path] = file_path
+        # but inodes of deleted files are soon reused, it only counts as a rename if the file
+        # still has the size and mtime of the old path's record. Anything else is probed again.
+        stamps = self.metadata.stamps(pairs)
+        renamed = {old_path: file_path for old_path, file_path in pairs.items()
+                   if old_path in stamps and self.metadata.current(file_path, *stamps[old_path])}
+
+        self.index.removeAll(removed)
+        self.index.addAll(added)
+        self.metadata.remove(removed.keys() - renamed.keys())
+        self.metadata.rename(renamed.items())
+        if self._columns is not None:
+            self._columns.forget(removed.keys() - renamed.keys())
+            self._columns.rename(renamed.items())
+        return added, removed, renamed
+
+    def relistDirectory(self, directory, added, removed):
+        # List a changed folder again and record the difference to its last listing
+        try:
+            stat, files, folders = listDirectory(directory.path)
+        except OSError:
+            return
+        gone_duration = 0.0
+        for file_path in directory.inodes.keys() - files.keys():
+            removed[file_path] = directory.inodes[file_path]
+            gone_duration += directory.durations.pop(file_path, 0.0)
+        for file_path in files.keys() - directory.inodes.keys():
+            added[file_path] = files[file_path]
+        for file_path in files.keys() & directory.inodes.keys():
+            # another file under a known name, e.g. files that swapped names
+            if directory.inodes[file_path] not in (None, files[file_path]):
+                removed[file_path] = directory.inodes[file_path]
+                added[file_path] = files[file_path]
+        self.directory_map.adjust(directory.path, len(files) - len(directory.inodes), -gone_duration)
+        directory.mtime = stat.st_mtime_ns
+        directory.nlink = stat.st_nlink
+        directory.inodes = files
+        self.library.saveFolder(directory, self.folderId(directory.parent))
+
+        folders = {os.path.basename(folder): folder for folder in folders}
+        for name in directory.subdirectories.keys() - folders.keys():
+            gone = list(iterSubtree(self.directory_map.remove(directory.subdirectories[name].path)))
+            loadFiles(gone)
+            for subdirectory in gone:
+                removed.update(subdirectory.inodes)
+            self.library.removeFolders(subdirectory.folder_id for subdirectory in gone)
+        for name in folders.keys() - directory.subdirectories.keys():
+            # new folders are scanned completely
+            subdirectory = Directory(folders[name])
+            self.addDirectory(subdirectory, directory.path)
+            for new in iterSubtree(subdirectory):
+                added.update(new.inodes)
+
+    def addDuration(self, file_path, duration):
+        # Count the probed duration of a file in the totals of its folder and the folders above it
+        directory = self.directory_map.get(os.path.dirname(file_path))
+        if duration is None or directory is None or file_path not in directory.inodes:
+            return
+        change = duration - directory.durations.get(file_path, 0.0)
+        directory.durations[file_path] = duration
+        self.directory_map.adjust(directory.path, 0, change)
+
+    @metrics.timed('library.remove')
+    @locked
+    def removeFolder(self, path):
+        # Remove a library folder with its subtree and return its Directory, raises KeyError if it is not in the library
+        removed = self.directory_map.remove(path)
+        if removed is None:
+            raise KeyError(path)
+        # only the removed subtree is visited, never the rest of the library
+        self.index.removeAll(removed.subtreeFiles())
+        self.library.removeFolders([directory.folder_id for directory in iterSubtree(removed)])
+        return removed
+
+    def searchFiles(self, term):
+        # The paths of all files whose name contains term, the best ranked matches first
+        ranked, others = [], []
+        for ranked, batch in self.index.searchRanked(term):
+            others.extend(batch)
+        return ranked + others
+
+    def stats(self):
+        # Totals of the whole library and of the files probed so far
+        roots = self.directory_map.roots.values()
+        probed, duration = self.metadata.totals()
+        return {'roots': len(roots),
+                'folders': sum(1 for directory in self.directory_map.values()),
+                'files': sum(root.file_count for root in roots),
+                'probed_files': probed,
+                'probed_duration': duration}
+
+    @metrics.timed('state.save')
+    @locked
+    def saveState(self):
+        # Folders and files are written to the LibraryStore as they change,
+        # only the search index is cached at exit
+        if self._index is not None and self.index_changes != self.library.changes():
+            self.library.saveIndex(self._index)
+        self.metadata.flush()
+
+    @metrics.timed('state.load')
+    def loadState(self):
+        # Read the library's folders; their files and the search index are read when first needed
+        self.library = LibraryStore(self.library_path, self.lock)
+        if self.library.isEmpty() and os.path.exists('explorer.pkl'):
+            self.importState('explorer.pkl')
+        self.directory_map = DirectoryTrie()
+        self._index = None
+        self._columns = None
+        folders = {}
+        children = []
+        counts = self.library.fileCounts()
+        for folder_id, path, parent_id, mtime, nlink in self.library.folders():
+            directory = Directory.stored(path, folder_id, self.library, mtime, nlink)
+            directory.file_count = counts.get(folder_id, 0)
+            folders[folder_id] = directory
+            parent = folders.get(parent_id)
+            if parent is not None:
+                directory.parent = parent.path
+                parent.subdirectories[directory.name] = directory
+                children.append((directory, parent))
+            else:
+                self.directory_map.insert(directory)
+        # total the file counts, children come after their parents in path order
+        for directory, parent in reversed(children):
+            parent.file_count += directory.file_count
+
+    def importState(self, path):
+        # Move a library pickled by earlier versions into the LibraryStore
+        try:
+            with open(path, 'rb') as f:
+                old_map = StateUnpickler(f).load()
+        except Exception as e:
+            print(f"Failed to import {path}: {e}")
+            return
+        directories = {}
+        for folder, old in old_map.items():
+            # read the pickled attributes directly, Directory now has properties in their place
+            state = vars(old)
+            directory = Directory(folder, scan=False)
+            directory.mtime = state.get('mtime')
+            directory.nlink = state.get('nlink')
+            inodes = state.get('inodes')
+            if inodes is None:
+                # saved before folders kept their own files; the first rescan lists them again
+                inodes = {f: None for f in state.get('audio_files', ()) if os.path.dirname(f) == folder}
+            directory.inodes = dict(inodes)
+            directory.parent = state.get('parent', '')
+            directories[folder] = directory
+        roots = []
+        for directory in directories.values():
+            parent = directories.get(directory.parent)
+            if parent is None:
+                directory.parent = ''
+                roots.append(directory)
+            else:
+                parent.subdirectories[directory.name] = directory
+        for root in roots:
+            self.library.saveTree(iterSubtree(root))
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self.lock:
+                if self._index is None:
+                    with metrics.span('index.load'):
+                        index = self.library.loadIndex()
+                    self.index_changes = self.library.changes()
+                    if index is None:
+                        index = self.buildIndex()
+                        self.index_changes = None
+                    self._index = index
+        return self._index
+
+    @property
+    def columns(self):
+        # FileColumns of the library's files, filled in from the current records of the files probed so far
+        if self._columns is None:
+            with self.lock:
+                if self._columns is None:
+                    with metrics.span('columns.load'):
+                        columns = FileColumns()
+                        columns.add(self.library.allFiles())
+                        # records of files changed since they were probed are left unknown, as lookup() does
+                        for file_path, size, mtime, info in self.metadata.records():
+                            if file_path in columns.ids and self.metadata.current(file_path, size, mtime):
+                                columns.set(file_path, info, size)
+                    self._columns = columns
+        return self._columns
+
+    @metrics.timed('index.build')
+    def buildIndex(self):
+        index = SearchIndex()
+        index.addAll(self.library.allFiles())
+        return index
+
+    @locked
+    def clearState(self):
+        # Clear the state of the library
+        self.library.clear()
+        self.directory_map = DirectoryTrie()
+        self._index = SearchIndex()
+        self.index_changes = None
+        self._columns = None
+
+    def close(self):
+        self.saveState()
+        self.metadata.close()
+        self.library.close()
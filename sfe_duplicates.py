@@ -0,0 +1,159 @@
+"""
+Finding audio files with the same content.
+
+findDuplicates() narrows the candidates down in passes so that most files
+are never read: files are grouped by size, files whose size is shared are
+hashed over their first and last few KB, and only those whose partial
+hashes still collide are hashed in full. Hashing runs in a pool of threads,
+which overlap their reads since hashlib releases the GIL on large buffers.
+Both hashes are kept in the MetadataStore with the size and mtime they were
+taken at, so a later search only reads files that are new or changed.
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sfe_metrics import metrics
+
+#bytes hashed at each end of a file for its partial hash
+EDGE_SIZE = 4096
+#bytes read at a time for a full hash
+CHUNK_SIZE = 1 << 20
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+def partialHash(path, size):
+    # Hash the first and last EDGE_SIZE bytes of a file of the given size
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(EDGE_SIZE))
+        if size > EDGE_SIZE:
+            f.seek(max(EDGE_SIZE, size - EDGE_SIZE))
+            digest.update(f.read(EDGE_SIZE))
+    return digest.digest()
+
+
+def fullHash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+@metrics.timed('duplicates.find')
+def findDuplicates(paths, metadata=None, workers=4, progress=None, cancel=None):
+    """Return the groups of files among paths that have the same content.
+
+    Each group is a sorted list of at least two paths. Groups are sorted by
+    the space their extra copies take, largest first. Empty files are left
+    out. Hashes are read from and written to metadata, a MetadataStore, if
+    one is given.
+
+    progress(stage, done, total) is called for every file hashed in the
+    'partial' and 'full' stages. Setting the cancel Event stops the search
+    with SearchCancelled.
+    """
+    stats = {}
+    sizes = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if stat.st_size:
+            stats[path] = stat
+            sizes.setdefault(stat.st_size, []).append(path)
+    # a file with a size of its own has no duplicates
+    candidates = [path for group in sizes.values() if len(group) > 1 for path in group]
+    known = metadata.hashes({path: stats[path] for path in candidates}) if metadata is not None else {}
+
+    pool = ThreadPoolExecutor(workers)
+    try:
+        partial = hashFiles(pool, candidates, lambda path: partialHash(path, stats[path].st_size),
+                            {path: hashes[0] for path, hashes in known.items() if hashes[0]}, 'partial', progress, cancel)
+        if metadata is not None:
+            metadata.putHashes((path, stats[path], partial[path], None)
+                               for path in partial if path not in known or known[path][0] != partial[path])
+        candidates = [path for group in groupBy(partial, stats) for path in group]
+        full = hashFiles(pool, candidates, fullHash,
+                         {path: known[path][1] for path in candidates if path in known and known[path][1]},
+                         'full', progress, cancel)
+        if metadata is not None:
+            metadata.putHashes((path, stats[path], partial[path], full[path])
+                               for path in full if path not in known or known[path][1] != full[path])
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    groups = [sorted(group) for group in groupBy(full, stats)]
+    groups.sort(key=lambda group: (-stats[group[0]].st_size * (len(group) - 1), group[0]))
+    return groups
+
+
+def hashFiles(pool, paths, hasher, known, stage, progress, cancel):
+    # Return {path: hash} for the paths that could be read, hashing those not in known in the pool
+    hashes = {path: known[path] for path in paths if path in known}
+    missing = [path for path in paths if path not in hashes]
+    metrics.count(f'duplicates.{stage}_cached', len(hashes))
+    metrics.count(f'duplicates.{stage}_hashed', len(missing))
+    futures = [(path, pool.submit(hasher, path)) for path in missing]
+    for done, (path, future) in enumerate(futures, 1):
+        if cancel is not None and cancel.is_set():
+            raise SearchCancelled()
+        try:
+            hashes[path] = future.result()
+        except OSError as e:
+            print(f"Failed to hash {path}: {e}")
+        if progress is not None:
+            progress(stage, done, len(missing))
+    return hashes
+
+
+def groupBy(hashes, stats):
+    # The groups of two or more paths with the same size and hash
+    groups = {}
+    for path, digest in hashes.items():
+        groups.setdefault((stats[path].st_size, digest), []).append(path)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+class DuplicateSearch:
+    # Looks for duplicates among paths on a background thread. The results
+    # are posted through post(event, value), which must be thread-safe:
+    #   '-DUPES-PROGRESS-'  (stage, files hashed, files to hash), a few times a second
+    #   '-DUPES-DONE-'      the list of duplicate groups, or None if it was cancelled
+    #   '-DUPES-FAILED-'    an error message
+    REPORT_INTERVAL = 0.25
+
+    def __init__(self, paths, metadata, post, workers=4):
+        self.paths = paths
+        self.metadata = metadata
+        self.post = post
+        self.workers = workers
+        self.cancelled = threading.Event()
+        self.last_report = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def progress(self, stage, done, total):
+        now = time.monotonic()
+        if now - self.last_report >= self.REPORT_INTERVAL or done == total:
+            self.last_report = now
+            self.post('-DUPES-PROGRESS-', (stage, done, total))
+
+    def run(self):
+        try:
+            groups = findDuplicates(self.paths, self.metadata, self.workers, self.progress, self.cancelled)
+            self.post('-DUPES-DONE-', groups)
+        except SearchCancelled:
+            self.post('-DUPES-DONE-', None)
+        except Exception as e:
+            self.post('-DUPES-FAILED-', f"{type(e).__name__}: {e}")
@@ -1,27 +1,96 @@
 import PySimpleGUI as sg
 import os
-from sfe_classes import Directory
+from queue import Empty
+from sfe_classes import formatLength
+from sfe_scan import BackgroundScan, iterSubtree
+from sfe_watch import LibraryWatcher
+from sfe_peaks import resample
+from sfe_metrics import metrics
+
+#the FileColumns column each heading of the results table sorts by
+TABLE_SORT_COLUMNS = {0: 'name', 1: 'type', 2: 'duration'}
+#spans the metrics window offers to profile
+PROFILED_SPANS = ['table.tree', 'table.build', 'table.page', 'table.filter', 'table.sort', 'search.step',
+                  'library.add', 'library.rescan', 'library.refresh', 'library.remove', 'state.save', 'index.build', 'columns.load',
+                  'scan.tree', 'probe.file', 'playback.start']
 
 
 def addDir(directory_path, sfe, g):
+    # Start scanning directory_path in the background and return the BackgroundScan,
+    # None if the folder cannot be added. The scan's thread also saves the folder
+    # to the library, scanDone() only attaches it.
+    directory_path = os.path.abspath(directory_path)
+    error = sfe.rootError(directory_path)
+    if error is not None:
+        g.window['-STATUS-'].Update(f"Cannot add {directory_path}: {error}.")
+        return None
+    scan = BackgroundScan(directory_path, g.window.write_event_value, sfe.scan_workers, sfe.storeDirectory)
+    # show the top folder straight away, its subfolders appear as they are scanned
+    g.treeData.Insert('', directory_path, os.path.basename(directory_path), ())
+    g.window['-TREE-'].Update(g.treeData)
+    g.window['-CANCEL-'].Update(visible=True)
+    scan.start()
+    return scan
+
+
+def scanProgress(g, directory_path, progress):
+    folders, files, rate = progress
+    g.window['-STATUS-'].Update(f"Adding {directory_path}: {folders} folders, {files} files ({rate:.0f} files/s)...")
+
+
+def scanStoring(g, directory_path, files):
+    g.window['-STATUS-'].Update(f"Adding the {files} files of {directory_path} to the library...")
+
+
+def scanSubtree(g, directory):
+    # Show a subtree of a folder being added as soon as it is scanned
+    toTreeData(g, directory)
+    g.window['-TREE-'].Update(g.treeData)
+
+
+def scanDone(sfe, g, directory_path, newDirectory, error=None):
+    g.window['-CANCEL-'].Update(visible=False)
     try:
-        newDirectory = Directory(directory_path)            
-        sfe.addDirectory(newDirectory)
-        newDirectory.toTreeData(g)
-        g.window['-TREE-'].Update(g.treeData)
-        return f"Added {directory_path} to the library."
+        if error is not None:
+            print(f"Failed to scan {directory_path}: {error}")
+            return f"Failed to add {directory_path} to the library."
+        if newDirectory is None:
+            return f"Cancelled adding {directory_path}."
+        sfe.attachDirectory(newDirectory)
+        return f"Added {directory_path} to the library ({newDirectory.file_count} files)."
     except Exception as e:
         # Log the exception details for debugging
         print(f"Exception type: {type(e)}")
         print(f"Exception args: {e.args}")
         return f"Failed to add {directory_path} to the library."
+    finally:
+        #rebuild the tree from the library, dropping what a cancelled scan showed
+        g.treeData = sg.TreeData()
+        updateTree(sfe, g)
+
+
+def toTreeData(g, directory):
+    # Use the full path as the key
+    key = directory.path
+    
+    # Create a list of subdirectory names
+    subdirectory_names = []
+    for subdirectory in directory.subdirectories.values():
+        subdirectory_names.append(subdirectory.name)
+    
+    # Insert the current directory into the tree
+    g.treeData.Insert(directory.parent, key, directory.name, tuple(subdirectory_names))
+    if directory.subdirectories:
+        # Recursively generate the tree data for subdirectories
+        for subdirectory in directory.subdirectories.values():
+            toTreeData(g, subdirectory)
+
 
 #Update tree with directories 
 def updateTree(sfe, g):
-    for directory in sfe.directory_map.values():
-        #if directory is at the root, add it to the tree
-        if directory.parent == '':
-            directory.toTreeData(g)
+    #the top folders add their subtrees
+    for directory in sfe.directory_map.roots.values():
+        toTreeData(g, directory)
     g.window['-TREE-'].Update(g.treeData) 
 
     
@@ -30,36 +99,161 @@ def deleteTreeItem(sfe, g, values):
     #clear tree and table
     g.treeData = sg.TreeData()
     g.window['-TREE-'].Update(g.treeData)
-    g.tableData = []
+    g.tableData = sfe.showFiles([])
     g.window['-TABLE-'].Update(values=g.tableData)
+    updateScroll(sfe, g)
     #update tree to display remaining directories
-    for directory in sfe.directory_map.values():
-        directory.toTreeData(g)
-    g.window['-TREE-'].Update(g.treeData)
+    updateTree(sfe, g)
+
+
+def rescanTreeItem(sfe, g, values):
+    directory_path = values['-TREE-'][0]
+    try:
+        added, removed, renamed = sfe.rescanDirectory(directory_path)
+    except FileNotFoundError:
+        return f"{directory_path} no longer exists."
+    except Exception as e:
+        print(f"Exception type: {type(e)}")
+        print(f"Exception args: {e.args}")
+        return f"Failed to rescan {directory_path}."
+    #rebuild the tree so new and removed folders show up
+    g.treeData = sg.TreeData()
+    updateTree(sfe, g)
+    return f"Rescanned {directory_path}: {added} added, {removed} removed, {renamed} renamed."
+
+
+def toggleWatch(sfe, g, watcher, values):
+    # Start or stop watching the library's folders for changes and return the LibraryWatcher, if any
+    if watcher is not None:
+        watcher.stop()
+        g.window['-STATUS-'].Update("Stopped watching the library for changes.")
+    if not values['-WATCH-']:
+        return None
+    watcher = LibraryWatcher(g.window.write_event_value)
+    for root in sfe.directory_map.roots.values():
+        watcher.watch(iterSubtree(root))
+    watcher.start()
+    g.window['-STATUS-'].Update(f"Watching the library for changes ({watcher.mode}).")
+    return watcher
+
+
+def subfolderNames(sfe, paths):
+    # The names of the subfolders of the library folders at paths
+    names = {}
+    for path in paths:
+        directory = sfe.directory_map.get(path)
+        names[path] = set(directory.subdirectories) if directory is not None else None
+    return names
+
+
+def watchChanges(sfe, g, watcher, changes):
+    # Apply the folder changes a LibraryWatcher posted and return a status message
+    folders, rescans = changes
+    before = subfolderNames(sfe, folders)
+    try:
+        (added, removed, renamed), rows = sfe.refreshDirectories(folders, rescans)
+    except Exception as e:
+        print(f"Exception type: {type(e)}")
+        print(f"Exception args: {e.args}")
+        return f"Failed to update the library with changes in {len(folders) + len(rescans)} folders."
+    watcher.follow(sfe.directory_map, folders)
+    for path in rescans:
+        if path in sfe.directory_map:
+            watcher.watch(iterSubtree(sfe.directory_map[path]))
+    #rebuild the tree only when folders came or went
+    if rescans or subfolderNames(sfe, folders) != before:
+        g.treeData = sg.TreeData()
+        updateTree(sfe, g)
+    if rows is not None:
+        g.tableData = rows
+        g.window['-TABLE-'].Update(values=g.tableData)
+        g.window['-SCROLL-'].Update(range=(0, max(len(sfe.view) - sfe.page_size, 0)))
+    return f"Library changed: {added} added, {removed} removed, {renamed} renamed."
 
 
 def search(sfe, g, file_queue, values):
-    sfe.table_update = True
+    # Start searching, updateSearch() fills the table in as matches are found
     file_queue.queue.clear()
     g.window['-STATUS-'].Update(f"Searching for {values['-TERM-']}...")
-    sfe.search(values)
+    try:
+        g.tableData = sfe.startSearch(values['-TERM-'])
+    except Exception as e:
+        sg.popup_error(f"Failed to search for {values['-TERM-']}: {e}")
+        return
     g.window['-TERM-'].Update('')
-    g.tableData = sfe.updateAudioTable(values)
     g.window['-TABLE-'].Update(values=g.tableData)
-    sfe.table_update = True
-    g.window['-STATUS-'].Update(f"Showing {sfe.matches} matches for {values['-TERM-']} out of {sfe.records} records.")
+    updateScroll(sfe, g)
+    updateSearch(sfe, g)
+
+
+def updateSearch(sfe, g):
+    # Show the matches the running search found since the last call
+    if sfe.searching is None:
+        return
+    try:
+        g.tableData = sfe.continueSearch()
+    except Exception as e:
+        sfe.stopSearch()
+        sg.popup_error(f"Failed to search for {sfe.term}: {e}")
+        return
+    g.window['-TABLE-'].Update(values=g.tableData)
+    g.window['-SCROLL-'].Update(range=(0, max(len(sfe.view) - sfe.page_size, 0)))
+    if sfe.searching is not None:
+        g.window['-STATUS-'].Update(f"Searching for {sfe.term}: {sfe.matches} matches so far...")
+    else:
+        g.window['-STATUS-'].Update(f"Showing {sfe.matches} matches for {sfe.term} out of {sfe.records} records"
+                                    f"{unprobedNote(sfe)}.")
+
+
+def stopSearch(sfe, g):
+    # Stop the running search when a new term is typed
+    if sfe.searching is not None:
+        sfe.stopSearch()
+        g.window['-STATUS-'].Update(f"Stopped searching for {sfe.term}: {sfe.matches} matches.")
+
+def applyFilter(sfe, g, values):
+    # Filter the results table by the conditions typed in the filter box
+    try:
+        g.tableData = sfe.setFilter(values['-FILTER-'])
+    except ValueError as e:
+        sg.popup_error(f"Invalid filter: {e}")
+        return
+    g.window['-TABLE-'].Update(values=g.tableData)
+    updateScroll(sfe, g)
+    if sfe.conditions:
+        g.window['-STATUS-'].Update(f"Showing {len(sfe.view)} of {len(sfe.shown) or sfe.matches} files that match the filter"
+                                    f"{unprobedNote(sfe)}.")
+    else:
+        g.window['-STATUS-'].Update(f"Showing {len(sfe.view)} files.")
+
+
+def unprobedNote(sfe):
+    # Tell how many rows a filter kept only because they are not probed yet
+    unprobed = sfe.unprobed()
+    return f", {unprobed} not yet probed" if unprobed else ''
+
+
+def sortTable(sfe, g, heading):
+    # Sort the results table by the column of the clicked heading
+    column = TABLE_SORT_COLUMNS.get(heading)
+    if column is None:
+        return
+    g.tableData = sfe.sortBy(column)
+    g.window['-TABLE-'].Update(values=g.tableData)
+    updateScroll(sfe, g)
+
 
 def treeEvent(sfe, g, values, ignore):
     try:
         print("Selected: ", values["-TREE-"][0])
-        if len(sfe.directory_map[values['-TREE-'][0]].audio_files) > 2000:
-            g.window['-STATUS-'].Update(f"{values['-TREE-'][0]} has to many items to display at once.")
-        else:
-            g.window['-STATUS-'].Update(f"Loading {values['-TREE-'][0]}...")
-            g.tableData = sfe.handleTreeEvent(values)    
-            g.window['-TABLE-'].Update(values=g.tableData)
-            g.window['-STATUS-'].Update(f"Showing results from {values['-TREE-'][0]}.")
-            return True
+        g.window['-STATUS-'].Update(f"Loading {values['-TREE-'][0]}...")
+        g.tableData = sfe.handleTreeEvent(values)    
+        g.window['-TABLE-'].Update(values=g.tableData)
+        updateScroll(sfe, g)
+        directory = sfe.directory_map[values['-TREE-'][0]]
+        g.window['-STATUS-'].Update(f"Showing {len(sfe.view)} of {directory.file_count} files from {directory.path}"
+                                    f" ({formatLength(directory.duration)} probed so far{unprobedNote(sfe)}).")
+        return True
         
     except KeyError:
         #print the specific value that caused the error
@@ -71,12 +265,175 @@ def treeEvent(sfe, g, values, ignore):
     finally:
         return True
     
-def play(sfe, g, values, channel, audio, path):
-    print("path: ", path, "channel: ", channel, "audio: ", audio)
-    if channel and not channel.get_busy():
-        g.window['-STATUS-'].Update(f"Stopped {os.path.basename(path)}")
+def updateLengths(sfe, g, limit=5000):
+    # Apply up to limit probed lengths from file_queue and refresh the table once
+    changed = False
+    for _ in range(limit):
+        try:
+            generation, file_path, length = sfe.file_queue.get_nowait()
+        except Empty:
+            break
+        # results probed for a table that is no longer shown
+        if generation != sfe.probes.generation:
+            continue
+        files = sfe.fileCache.get(file_path, ())
+        for file in files:
+            file.length = length
+            changed = sfe.view.setLength(file) or changed
+        if files:
+            sfe.fileProbed(files[0])
+    if changed:
+        g.tableData = sfe.view.page()
+        g.window['-TABLE-'].Update(values=g.tableData)
+
+
+def updateScroll(sfe, g):
+    # Fit the scroll bar to the rows of a new results table
+    g.window['-SCROLL-'].Update(value=0, range=(0, max(len(sfe.view) - sfe.page_size, 0)))
+
+
+def scrollTable(sfe, g, offset):
+    # Show the page of the results table starting at row offset
+    g.tableData = sfe.view.scrollTo(int(offset))
+    g.window['-TABLE-'].Update(values=g.tableData)
+    g.window['-SCROLL-'].Update(value=sfe.view.offset)
+
+
+def selectFile(sfe, g, player, row, neighbours=3):
+    # Select the file in row of the table and return its path
+    file = sfe.view.fileAt(row)
+    if file is None:
+        g.window['-STATUS-'].Update(f"Row {row} is not loaded.")
+        return None
+    if file.path == player.path:
+        return file.path
+    playing = player.isPlaying()
+    player.select(file.path)
+    # decode the selection and the rows around it ahead of time
+    if player.cache is not None:
+        player.cache.preload([file] + sfe.view.neighbours(row, neighbours))
+    if playing:
+        # keep auditioning while stepping through the rows
+        play(g, player)
+    else:
+        g.window['-STATUS-'].Update(f"Selected: {os.path.basename(file.path)}")
+    return file.path
+
+
+def play(g, player):
+    path = player.path
     if not path or not os.path.exists(path):
         print("No file selected or file does not exist.")
         return
-    g.window['-STATUS-'].Update(f"Playing {os.path.basename(path)}")  
-    channel.play(audio) 
\ No newline at end of file
+    try:
+        player.play()
+    except Exception as e:
+        g.window['-STATUS-'].Update(f"Failed to play {os.path.basename(path)}: {e}")
+        return
+    g.window['-STATUS-'].Update(f"Playing {os.path.basename(path)}")
+
+
+def buildPeaks(sfe, g, peaks, values):
+    # Queue waveform overviews for every file under the selected directory
+    directory_path = values['-TREE-'][0]
+    directory = sfe.directory_map.get(directory_path)
+    if directory is None:
+        return f"Directory not found: {directory_path}"
+    peaks.request(sorted(directory.subtreeFiles()))
+    return f"Building waveforms for {directory.file_count} files in {directory_path}..."
+
+
+def peaksBuilt(sfe, g, peaks, player, progress):
+    # A waveform overview was stored, show it if its file is selected
+    path, done, total = progress
+    if path == player.path:
+        showWaveform(sfe, g, peaks, path)
+    if total > 1:
+        if done < total:
+            g.window['-STATUS-'].Update(f"Building waveforms: {done} of {total} files...")
+        else:
+            g.window['-STATUS-'].Update(f"Built waveforms for {total} files.")
+
+
+def showWaveform(sfe, g, peaks, path):
+    # Draw the stored overview of path, asking for one first if there is none
+    data = sfe.metadata.peaks(path)
+    graph = g.window['-WAVEFORM-']
+    graph.erase()
+    width, height = g.waveformSize
+    if data is None:
+        peaks.request([path], priority=0)
+        graph.draw_text('Building waveform...', (width // 2, 0), color='gray')
+    elif not data:
+        graph.draw_text('No waveform', (width // 2, 0), color='gray')
+    else:
+        drawWaveform(graph, resample(data, width))
+
+
+def drawWaveform(graph, columns):
+    # Draw (min, max, rms) columns, the peaks with the RMS level on top
+    for x, (low, high, rms) in enumerate(columns):
+        graph.draw_line((x, low), (x, high), color='#3a7bd5')
+        if rms:
+            graph.draw_line((x, -rms), (x, rms), color='#9cc3ff')
+
+
+def findDuplicates(sfe, g, values):
+    # Start looking for duplicates in the selected directory, or the whole library, and return the DuplicateSearch
+    path = values['-TREE-'][0] if values['-TREE-'] else None
+    g.window['-STATUS-'].Update(f"Looking for duplicates in {path or 'the library'}...")
+    return sfe.findDuplicates(path, g.window.write_event_value)
+
+
+def duplicatesProgress(g, progress):
+    stage, done, total = progress
+    g.window['-STATUS-'].Update(f"Looking for duplicates: {stage} hashes of {done} of {total} files...")
+
+
+def duplicatesDone(sfe, g, groups, error=None):
+    if error is not None:
+        print(f"Failed to find duplicates: {error}")
+        return "Failed to find duplicates."
+    if groups is None:
+        return "Cancelled looking for duplicates."
+    g.tableData = sfe.showDuplicates(groups)
+    g.window['-TABLE-'].Update(values=g.tableData)
+    updateScroll(sfe, g)
+    copies = sum(len(group) - 1 for group in groups)
+    wasted = sum(os.path.getsize(group[0]) * (len(group) - 1) for group in groups if os.path.exists(group[0]))
+    return f"Found {len(groups)} groups of duplicates, {copies} extra copies taking {wasted / 2**20:.1f} MB."
+
+
+def showMetrics():
+    # Show the metrics collected so far in a window of their own, which holds up the main window until it is closed
+    layout = [[sg.Checkbox('Collect metrics', default=metrics.enabled, key='-ENABLED-', enable_events=True),
+               sg.Text('Profile the next:'),
+               sg.Combo(PROFILED_SPANS, key='-SPAN-', readonly=True, size=(16, 1)),
+               sg.Button('Capture', key='-CAPTURE-')],
+              [sg.Multiline(metrics.report(), size=(110, 30), key='-REPORT-', font=('Courier', 9), disabled=True)],
+              [sg.Button('Refresh', key='-REFRESH-'), sg.Button('Reset', key='-RESET-'),
+               sg.Button('Save JSON', key='-SAVE-'), sg.Button('Close', key='-CLOSE-'),
+               sg.Text('', key='-NOTE-', size=(50, 1))]]
+    window = sg.Window('Metrics', layout, modal=True, finalize=True)
+    while True:
+        event, values = window.read()
+        if event in (sg.WIN_CLOSED, '-CLOSE-'):
+            break
+        if event == '-ENABLED-':
+            metrics.enable(values['-ENABLED-'])
+        if event == '-RESET-':
+            metrics.reset()
+        if event == '-CAPTURE-' and values['-SPAN-']:
+            metrics.capture(values['-SPAN-'])
+            window['-NOTE-'].Update(f"The next {values['-SPAN-']} will be profiled.")
+        if event == '-SAVE-':
+            path = sg.popup_get_file('Save metrics as', save_as=True, default_extension='.json',
+                                     file_types=(('JSON', '*.json'),))
+            if path:
+                try:
+                    metrics.dump(path)
+                    window['-NOTE-'].Update(f"Saved {path}")
+                except OSError as e:
+                    sg.popup_error(f"Failed to save metrics: {e}")
+        window['-REPORT-'].Update(metrics.report())
+    window.close()
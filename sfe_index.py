@@ -0,0 +1,187 @@
+import heapq
+import operator
+import os
+import re
+import zlib
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, chain
+
+#what separates the words of a file name
+WORD_BREAK = re.compile(r'[^0-9a-z]+')
+
+
+def rankMatch(term, name):
+    # How well a file name containing term matches it, lower is better:
+    # 0 if the name without its extension is term, 1 if it starts with term,
+    # 2 if term is one of its words and 3 for any other match. Case is ignored.
+    stem = os.path.splitext(name)[0].lower()
+    term = term.lower()
+    if stem == term:
+        return 0
+    if stem.startswith(term):
+        return 1
+    if term in WORD_BREAK.split(stem):
+        return 2
+    return 3
+
+
+class SearchIndex:
+    """Trigram index over the basenames of the files in the library.
+
+    Every file gets a small integer id. Each lowercased trigram of a
+    basename maps to the ids whose names contain it, so a substring query
+    only has to check the files that contain every trigram of the term
+    instead of every file in the library. The ids of a trigram are kept in
+    ascending order in an array of 32-bit ints, which new files append to.
+    Removed files are left in the arrays and skipped by queries until the
+    index is compacted.
+    """
+
+    def __init__(self):
+        #file id -> path and basename, None once the file is removed
+        self.paths = []
+        self.names = []
+        #path -> file id
+        self.ids = {}
+        #trigram -> ascending array('I') of file ids, including removed ones
+        self.trigrams = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, path):
+        return path in self.ids
+
+    @staticmethod
+    def grams(text):
+        text = text.lower()
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, path):
+        if path in self.ids:
+            return
+        file_id = len(self.paths)
+        name = os.path.basename(path)
+        self.paths.append(path)
+        self.names.append(name)
+        self.ids[path] = file_id
+        for gram in self.grams(name):
+            postings = self.trigrams.get(gram)
+            if postings is None:
+                self.trigrams[gram] = array('I', (file_id,))
+            else:
+                # ids only grow, so the array stays sorted
+                postings.append(file_id)
+
+    def remove(self, path):
+        file_id = self.ids.pop(path, None)
+        if file_id is None:
+            return
+        # the id stays in its trigrams' arrays, queries skip it
+        self.paths[file_id] = None
+        self.names[file_id] = None
+        # drop the tombstones once they make up half of the id space
+        if len(self.paths) > 1024 and len(self.ids) < len(self.paths) // 2:
+            self.compact()
+
+    def addAll(self, paths):
+        for path in paths:
+            self.add(path)
+
+    def removeAll(self, paths):
+        for path in paths:
+            self.remove(path)
+
+    def compact(self):
+        paths = [path for path in self.paths if path is not None]
+        self.__init__()
+        self.addAll(paths)
+
+    def __getstate__(self):
+        # The cached index holds the paths and, for each trigram, the gaps between
+        # its ascending ids compressed with zlib; the rest is read from the paths again
+        trigrams = {}
+        for gram, ids in self.trigrams.items():
+            gaps = array('I', map(operator.sub, ids, chain((0,), ids)))
+            trigrams[gram] = zlib.compress(gaps.tobytes(), 1)
+        return {'paths': self.paths, 'gaps': trigrams}
+
+    def __setstate__(self, state):
+        self.paths = state['paths']
+        self.names = [os.path.basename(path) if path is not None else None for path in self.paths]
+        self.ids = {path: file_id for file_id, path in enumerate(self.paths) if path is not None}
+        self.trigrams = {}
+        if 'gaps' in state:
+            for gram, data in state['gaps'].items():
+                gaps = array('I')
+                gaps.frombytes(zlib.decompress(data))
+                self.trigrams[gram] = array('I', accumulate(gaps))
+        else:
+            # indexes cached by earlier versions kept their ids in sets
+            for gram, ids in state['trigrams'].items():
+                self.trigrams[gram] = array('I', sorted(ids))
+
+    def candidates(self, term):
+        # The sorted ids of the files whose names have every trigram of term
+        if not term:
+            return []
+        grams = self.grams(term)
+        if not grams:
+            # too short for trigrams, check every name
+            return sorted(self.ids.values())
+        postings = []
+        for gram in grams:
+            ids = self.trigrams.get(gram)
+            if not ids:
+                return []
+            postings.append(ids)
+        postings.sort(key=len)
+        found = postings[0]
+        for ids in postings[1:]:
+            if len(found) * 32 < len(ids):
+                # few ids left, look each of them up in the much longer array
+                found = [file_id for file_id in found if self.contains(ids, file_id)]
+            else:
+                found = sorted(set(found).intersection(ids))
+            if not found:
+                return []
+        paths = self.paths
+        return [file_id for file_id in found if paths[file_id] is not None]
+
+    @staticmethod
+    def contains(ids, file_id):
+        # Whether the sorted array ids holds file_id
+        position = bisect_left(ids, file_id)
+        return position < len(ids) and ids[position] == file_id
+
+    def search(self, term):
+        # Return the paths of all files whose basename contains term, in the order they were added
+        names = self.names
+        return [self.paths[file_id] for file_id in self.candidates(term) if term in names[file_id]]
+
+    def searchRanked(self, term, top=200, batch=2000):
+        """Search like search(), yielding matches as batches of candidates are checked.
+
+        Each yield is (ranked, others). ranked is the best top matches found
+        so far, best first by rankMatch() and then in the order the files
+        were added. others is the matches found since the last yield that
+        are not in ranked, including those pushed out of it. The others of
+        every yield together with the last ranked hold each match once.
+        """
+        names = self.names
+        candidates = self.candidates(term)
+        #(-rank, -file id) of the ranked matches, the worst at the top of the heap
+        heap = []
+        for start in range(0, len(candidates), batch):
+            others = []
+            for file_id in candidates[start:start + batch]:
+                name = names[file_id]
+                if term not in name:
+                    continue
+                entry = (-rankMatch(term, name), -file_id)
+                if len(heap) < top:
+                    heapq.heappush(heap, entry)
+                else:
+                    others.append(self.paths[-heapq.heappushpop(heap, entry)[1]])
+            yield [self.paths[-file_id] for rank, file_id in sorted(heap, reverse=True)], others
@@ -0,0 +1,162 @@
+import os
+import pickle
+import sqlite3
+import threading
+
+
+class LibraryStore:
+    """The library's folders and files, kept in a versioned sqlite database.
+
+    Every folder is stored once with its parent, mtime and link count, and
+    every audio file once as a name within its folder, so no path prefix is
+    repeated. Changes are written as they happen rather than at exit.
+    Reading is lazy: folders() is enough to build the tree, and the files
+    of a folder are only read when folderFiles() asks for them.
+
+    The search index is derived from the files and is cached as a blob
+    tagged with the change counter it was built at.
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path='library.db', lock=None):
+        self.path = path
+        #held while reading files that may be read lazily while a scan thread writes,
+        #the SoundLibrary's own lock so that they wait for what it is writing
+        self.lock = lock if lock is not None else threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+        version = self.getMeta('schema_version')
+        if version is None:
+            self.createSchema()
+        elif int(version) > self.SCHEMA_VERSION:
+            raise RuntimeError(f"{path} was written by a newer version (schema {version})")
+
+    def createSchema(self):
+        with self.connection:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS folders (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    parent INTEGER REFERENCES folders(id),
+                    mtime INTEGER,
+                    nlink INTEGER);
+                CREATE TABLE IF NOT EXISTS files (
+                    folder INTEGER NOT NULL REFERENCES folders(id),
+                    name TEXT NOT NULL,
+                    inode INTEGER,
+                    PRIMARY KEY (folder, name)) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS search_index (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    changes INTEGER,
+                    data BLOB);''')
+            self.setMeta('schema_version', self.SCHEMA_VERSION)
+            self.setMeta('changes', 0)
+
+    def getMeta(self, key):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def setMeta(self, key, value):
+        self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def changed(self):
+        # callers are inside a transaction
+        self.connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'changes'")
+
+    def changes(self):
+        # A counter that goes up with every write to the folders and files
+        return int(self.getMeta('changes'))
+
+    def isEmpty(self):
+        return self.connection.execute('SELECT 1 FROM folders LIMIT 1').fetchone() is None
+
+    def folders(self):
+        # Rows of (id, path, parent id, mtime, nlink), parents before their children
+        return self.connection.execute('SELECT id, path, parent, mtime, nlink FROM folders ORDER BY path').fetchall()
+
+    def folderFiles(self, folders):
+        # Return {folder id: {file path: inode}} for a {folder id: folder path} dict
+        files = {folder_id: {} for folder_id in folders}
+        ids = list(folders)
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT folder, name, inode FROM files WHERE folder IN ({','.join('?' * len(chunk))})", chunk)
+                for folder_id, name, inode in rows:
+                    files[folder_id][os.path.join(folders[folder_id], name)] = inode
+        return files
+
+    def fileCounts(self):
+        # Return {folder id: number of files} for the folders that have files
+        return dict(self.connection.execute('SELECT folder, COUNT(*) FROM files GROUP BY folder'))
+
+    def allFiles(self):
+        # Every file path in the library
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT folders.path, files.name FROM files JOIN folders ON files.folder = folders.id').fetchall()
+        return [os.path.join(folder, name) for folder, name in rows]
+
+    def saveTree(self, directories, parent_id=None):
+        # Insert or update directories with their files. directories is a Directory
+        # and its descendants, parents first; parent_id is the folder id of the first one's parent.
+        ids = {}
+        with self.connection:
+            for directory in directories:
+                self.writeFolder(directory, ids.get(directory.parent, parent_id))
+                ids[directory.path] = directory.folder_id
+            self.changed()
+
+    def saveFolder(self, directory, parent_id):
+        # Update a folder's mtime, link count and files after it was listed again
+        with self.connection:
+            self.writeFolder(directory, parent_id)
+            self.changed()
+
+    def writeFolder(self, directory, parent_id):
+        self.connection.execute(
+            '''INSERT INTO folders (path, parent, mtime, nlink) VALUES (?, ?, ?, ?)
+               ON CONFLICT (path) DO UPDATE SET parent = excluded.parent, mtime = excluded.mtime, nlink = excluded.nlink''',
+            (directory.path, parent_id, directory.mtime, directory.nlink))
+        directory.folder_id = self.connection.execute('SELECT id FROM folders WHERE path = ?', (directory.path,)).fetchone()[0]
+        self.connection.execute('DELETE FROM files WHERE folder = ?', (directory.folder_id,))
+        self.connection.executemany('INSERT INTO files VALUES (?, ?, ?)',
+                                    ((directory.folder_id, os.path.basename(path), inode)
+                                     for path, inode in directory.inodes.items()))
+
+    def removeFolders(self, folder_ids):
+        folder_ids = [folder_id for folder_id in folder_ids if folder_id is not None]
+        with self.connection:
+            for start in range(0, len(folder_ids), 500):
+                chunk = folder_ids[start:start + 500]
+                marks = ','.join('?' * len(chunk))
+                self.connection.execute(f'DELETE FROM files WHERE folder IN ({marks})', chunk)
+                self.connection.execute(f'DELETE FROM folders WHERE id IN ({marks})', chunk)
+            self.changed()
+
+    def loadIndex(self):
+        # The cached search index, or None if it is missing or older than the files
+        row = self.connection.execute('SELECT changes, data FROM search_index').fetchone()
+        if row is None or row[0] != self.changes():
+            return None
+        try:
+            return pickle.loads(row[1])
+        except Exception:
+            return None
+
+    def saveIndex(self, index):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO search_index VALUES (0, ?, ?)',
+                                    (self.changes(), pickle.dumps(index, pickle.HIGHEST_PROTOCOL)))
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM files')
+            self.connection.execute('DELETE FROM folders')
+            self.connection.execute('DELETE FROM search_index')
+            self.changed()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class MetadataStore:
+    """Technical metadata of audio files, kept on disk between sessions.
+
+    There is one record per path holding the size and mtime the file had
+    when it was probed, along with its duration, sample rate, channels and
+    bit depth. A record only counts while the file's size and mtime still
+    match. Records can be written from the probe threads; they are committed
+    in batches and by flush().
+
+    Waveform overviews built by sfe_peaks and the content hashes taken by
+    sfe_duplicates are kept in tables of their own, checked against the
+    file's size and mtime the same way.
+    """
+
+    FIELDS = ('duration', 'sample_rate', 'channels', 'bit_depth')
+    COMMIT_EVERY = 200
+    COMMIT_INTERVAL = 2.0
+
+    def __init__(self, path='metadata.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS files (
+                                     path TEXT PRIMARY KEY,
+                                     size INTEGER,
+                                     mtime INTEGER,
+                                     duration REAL,
+                                     sample_rate INTEGER,
+                                     channels INTEGER,
+                                     bit_depth INTEGER)''')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS peaks (
+                                     path TEXT PRIMARY KEY,
+                                     size INTEGER,
+                                     mtime INTEGER,
+                                     data BLOB)''')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS hashes (
+                                     path TEXT PRIMARY KEY,
+                                     size INTEGER,
+                                     mtime INTEGER,
+                                     partial BLOB,
+                                     full BLOB)''')
+        self.connection.commit()
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def lookup(self, paths):
+        # Return {path: record} for the paths whose record still matches the file on disk
+        records = {}
+        paths = list(paths)
+        with self.lock:
+            # stay well below sqlite's limit on query parameters
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT * FROM files WHERE path IN ({','.join('?' * len(chunk))})", chunk)
+                for row in rows:
+                    records[row[0]] = row
+        return {path: dict(zip(self.FIELDS, row[3:])) for path, row in records.items()
+                if self.current(path, row[1], row[2])}
+
+    def stamps(self, paths):
+        # Return {path: (size, mtime)} of the records kept for paths, whether or not they are still current
+        stamps = {}
+        paths = list(paths)
+        with self.lock:
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT path, size, mtime FROM files WHERE path IN ({','.join('?' * len(chunk))})", chunk)
+                stamps.update((path, (size, mtime)) for path, size, mtime in rows)
+        return stamps
+
+    @staticmethod
+    def current(path, size, mtime):
+        # Whether the file at path still has the size and mtime a record was taken at
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (size, mtime)
+
+    def put(self, path, stat, info):
+        # Record info (a dict with the FIELDS, or None if probing failed) for a file with the given stat
+        info = info or {}
+        row = (path, stat.st_size, stat.st_mtime_ns) + tuple(info.get(field) for field in self.FIELDS)
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+            self.written()
+
+    def records(self):
+        # Every (path, size, mtime, record) kept, whether or not it is still current
+        with self.lock:
+            rows = self.connection.execute('SELECT * FROM files').fetchall()
+        return [(row[0], row[1], row[2], dict(zip(self.FIELDS, row[3:]))) for row in rows]
+
+    def totals(self):
+        # The number of files with a known duration and their total duration, whether or not they are still current
+        with self.lock:
+            count, duration = self.connection.execute(
+                'SELECT COUNT(*), SUM(duration) FROM files WHERE duration IS NOT NULL').fetchone()
+        return count, duration or 0.0
+
+    def peaks(self, path):
+        # The waveform overview of path (empty if it could not be built), None if there is none for the file on disk
+        with self.lock:
+            row = self.connection.execute('SELECT size, mtime, data FROM peaks WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (row[0], row[1]):
+            return None
+        return row[2]
+
+    def putPeaks(self, path, stat, data):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO peaks VALUES (?, ?, ?, ?)',
+                                    (path, stat.st_size, stat.st_mtime_ns, data))
+            self.written()
+
+    def hashes(self, stats):
+        # Return {path: (partial hash, full hash or None)} for a {path: stat} dict, for the records that match the stat
+        paths = list(stats)
+        hashes = {}
+        with self.lock:
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT * FROM hashes WHERE path IN ({','.join('?' * len(chunk))})", chunk)
+                for path, size, mtime, partial, full in rows:
+                    if (stats[path].st_size, stats[path].st_mtime_ns) == (size, mtime):
+                        hashes[path] = (partial, full)
+        return hashes
+
+    def putHashes(self, rows):
+        # Record (path, stat, partial hash, full hash or None) rows
+        rows = [(path, stat.st_size, stat.st_mtime_ns, partial, full) for path, stat, partial, full in rows]
+        with self.lock:
+            self.connection.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)', rows)
+            self.commit()
+
+    def written(self):
+        # callers hold self.lock
+        self.pending += 1
+        if (self.pending >= self.COMMIT_EVERY
+                or time.monotonic() - self.last_commit > self.COMMIT_INTERVAL):
+            self.commit()
+
+    def remove(self, paths):
+        paths = [(path,) for path in paths]
+        with self.lock:
+            self.connection.executemany('DELETE FROM files WHERE path = ?', paths)
+            self.connection.executemany('DELETE FROM peaks WHERE path = ?', paths)
+            self.connection.executemany('DELETE FROM hashes WHERE path = ?', paths)
+            self.commit()
+
+    def rename(self, pairs):
+        # Move the records of renamed files to their new paths, for (old path, new path) pairs.
+        # A rename keeps a file's size and mtime, so the records stay current.
+        pairs = list(pairs)
+        with self.lock:
+            for table in ('files', 'peaks', 'hashes'):
+                # through a placeholder path first, so that paths swapped with each other do not collide
+                self.connection.executemany(f"UPDATE OR REPLACE {table} SET path = ? WHERE path = ?",
+                                            [('\0' + old, old) for old, new in pairs])
+                self.connection.executemany(f"UPDATE OR REPLACE {table} SET path = ? WHERE path = ?",
+                                            [(new, '\0' + old) for old, new in pairs])
+            self.commit()
+
+    def flush(self):
+        with self.lock:
+            self.commit()
+
+    def commit(self):
+        # callers hold self.lock
+        self.connection.commit()
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,190 @@
+"""
+Counters, histograms and timed spans for measuring the Sound File Explorer.
+
+The shared `metrics` instance is off by default, which leaves every call a
+single attribute test: span() hands back a shared do-nothing context
+manager and count() and observe() return at once. Once enabled, counters
+add up, observe() records values into histograms and span() times its
+block into the histogram of its name, in seconds. All of it is
+thread-safe, so the probe and scan threads record into the same metrics.
+
+capture(name) profiles the next span of that name with cProfile, whether or
+not metrics are enabled. snapshot() returns everything as a dict and dump()
+writes it to a JSON file.
+
+Set SFE_METRICS=1 in the environment to enable metrics from the start.
+"""
+import functools
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+
+#values each histogram keeps for its percentiles
+SAMPLES = 1024
+#functions listed for a captured profile
+PROFILE_LINES = 30
+
+
+class Histogram:
+    # The count, total, smallest and largest of all values observed, and the
+    # last SAMPLES values for percentiles
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.samples = deque(maxlen=SAMPLES)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.samples.append(value)
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        def percentile(fraction):
+            return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+        return {'count': self.count, 'total': self.total, 'mean': self.total / self.count if self.count else None,
+                'min': self.min, 'max': self.max,
+                'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99)}
+
+
+class NullSpan:
+    # The span handed out while metrics are off and nothing is being captured
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, metrics, name, profiler=None):
+        self.metrics = metrics
+        self.name = name
+        self.profiler = profiler
+
+    def __enter__(self):
+        if self.profiler is not None:
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.metrics.profiled(self.name, self.profiler, elapsed)
+        if self.metrics.enabled:
+            self.metrics.observe(self.name, elapsed)
+        return False
+
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        #span names whose next run is profiled, and the profiles taken
+        self.captures = set()
+        self.profiles = {}
+        self.started = time.time()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        # Add value, a time in seconds, to the histogram of name
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    def span(self, name):
+        # A context manager timing its block into the histogram of name
+        if self.captures and name in self.captures:
+            with self.lock:
+                if name in self.captures:
+                    self.captures.discard(name)
+                    # imported only when profiling, they cost every start of the program some 30ms
+                    import cProfile
+                    return Span(self, name, cProfile.Profile())
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def timed(self, name):
+        # Decorate a function to run in a span of name
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def capture(self, name):
+        # Profile the next span of name with cProfile
+        with self.lock:
+            self.captures.add(name)
+
+    def profiled(self, name, profiler, elapsed):
+        import pstats
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        with self.lock:
+            self.profiles[name] = {'seconds': elapsed, 'taken': time.time(), 'stats': out.getvalue()}
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.profiles.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            return {'enabled': self.enabled,
+                    'since': self.started,
+                    'counters': dict(sorted(self.counters.items())),
+                    'histograms': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+                    'profiles': dict(self.profiles)}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def report(self):
+        # The snapshot as lines of text, spans in milliseconds
+        snapshot = self.snapshot()
+        lines = [f"{'counter':<32} {'value':>12}"]
+        lines += [f"{name:<32} {value:>12}" for name, value in snapshot['counters'].items()]
+        lines += ['', f"{'span':<32} {'count':>7} {'total':>10} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}"]
+        for name, summary in snapshot['histograms'].items():
+            ms = {key: summary[key] * 1000 for key in ('total', 'mean', 'p50', 'p90', 'p99', 'max')}
+            lines.append(f"{name:<32} {summary['count']:>7} {ms['total']:>8.1f}ms {ms['mean']:>7.2f}ms"
+                         f" {ms['p50']:>7.2f}ms {ms['p90']:>7.2f}ms {ms['p99']:>7.2f}ms {ms['max']:>7.2f}ms")
+        for name, profile in snapshot['profiles'].items():
+            lines += ['', f"profile of {name} ({profile['seconds'] * 1000:.1f}ms)", profile['stats']]
+        return '\n'.join(lines)
+
+
+metrics = Metrics(enabled=os.environ.get('SFE_METRICS', '') not in ('', '0'))
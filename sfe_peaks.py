@@ -0,0 +1,238 @@
+"""
+Waveform overviews of audio files.
+
+computePeaks() reduces a file to a fixed number of buckets, each holding
+the minimum, maximum and RMS of its samples over all channels. The sample
+data of uncompressed WAV and AIFF files is read from the file in blocks and
+reduced with NumPy, a block at a time; other formats are decoded with
+pygame first. An overview is stored as int8 values scaled to -127..127,
+three bytes per bucket, so a thousand buckets take 3 KB.
+
+PeakGenerator builds overviews in a pool of worker processes and keeps
+them in the MetadataStore, where they stay valid while the file's size and
+mtime do not change.
+"""
+import itertools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from queue import PriorityQueue
+import numpy as np
+from sfe_probe import pcmLayout, ProbeError
+from sfe_metrics import metrics
+
+BUCKETS = 1000
+#frames read from a file at a time
+BLOCK_FRAMES = 1 << 18
+#sample widths in bytes that can be read without decoding, by sample kind
+PCM_WIDTHS = {'int': (1, 2, 3, 4), 'uint': (1,), 'float': (4, 8)}
+
+
+def computePeaks(path, buckets=BUCKETS):
+    """Return the waveform overview of the file at path.
+
+    The overview is bytes of int8 (min, max, rms) triples, one per bucket,
+    or empty bytes if the file holds no samples. There are at most buckets
+    triples, fewer for files with fewer frames than that.
+    """
+    try:
+        layout = pcmLayout(path)
+    except ProbeError:
+        layout = None
+    if layout is not None and layout['width'] in PCM_WIDTHS[layout['kind']]:
+        frames = layout['size'] // (layout['channels'] * layout['width'])
+        per = -(-frames // buckets) or 1
+        blocks = readPcm(path, layout, per * max(1, BLOCK_FRAMES // per))
+    else:
+        samples = decodeAudio(path)
+        frames = len(samples)
+        per = -(-frames // buckets) or 1
+        step = per * max(1, BLOCK_FRAMES // per)
+        blocks = (samples[start:start + step] for start in range(0, frames, step))
+    peaks = [reduceBlock(block, per) for block in blocks]
+    if not peaks:
+        return b''
+    peaks = np.concatenate(peaks)
+    return np.round(np.clip(peaks, -1, 1) * 127).astype(np.int8).tobytes()
+
+
+def readPcm(path, layout, step):
+    # Yield the sample data of an uncompressed file as float32 (frames, channels) arrays of step frames
+    frame_size = layout['channels'] * layout['width']
+    with open(path, 'rb') as f:
+        f.seek(layout['offset'])
+        remaining = layout['size'] // frame_size * frame_size
+        while remaining > 0:
+            data = f.read(min(step * frame_size, remaining))
+            usable = len(data) // frame_size * frame_size
+            if not usable:
+                break
+            remaining -= len(data)
+            yield pcmSamples(data[:usable], layout).reshape(-1, layout['channels'])
+
+
+def pcmSamples(data, layout):
+    # Convert raw sample data to float32 values between -1 and 1
+    width, endian, kind = layout['width'], layout['endian'], layout['kind']
+    if kind == 'float':
+        return np.frombuffer(data, f'{endian}f{width}').astype(np.float32)
+    if kind == 'uint':
+        return (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+    if width == 3:
+        # there is no 24-bit dtype, so assemble the samples from their bytes
+        raw = np.frombuffer(data, np.uint8).reshape(-1, 3).astype(np.int32)
+        if endian == '>':
+            raw = raw[:, ::-1]
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        # shift the sign bit into place and back to sign-extend
+        values = (values << 8) >> 8
+        return values.astype(np.float32) / 2 ** 23
+    return np.frombuffer(data, f'{endian}i{width}').astype(np.float32) / 2 ** (8 * width - 1)
+
+
+def decodeAudio(path):
+    # Decode a compressed file with pygame into a float32 (frames, channels) array
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    import pygame as pg
+    if not pg.mixer.get_init():
+        pg.mixer.init()
+    samples = pg.sndarray.array(pg.mixer.Sound(path))
+    if samples.ndim == 1:
+        samples = samples[:, np.newaxis]
+    if samples.dtype.kind == 'f':
+        return samples.astype(np.float32)
+    scale = 2 ** (samples.dtype.itemsize * 8 - 1)
+    if samples.dtype.kind == 'u':
+        return (samples.astype(np.float32) - scale) / scale
+    return samples.astype(np.float32) / scale
+
+
+def reduceBlock(block, per):
+    # Reduce a (frames, channels) block to (min, max, rms) rows of per frames each, the last may be shorter
+    lows = block.min(axis=1)
+    highs = block.max(axis=1)
+    squares = np.square(block).mean(axis=1)
+    starts = np.arange(0, len(block), per)
+    counts = np.diff(np.append(starts, len(block)))
+    return np.column_stack((np.minimum.reduceat(lows, starts),
+                            np.maximum.reduceat(highs, starts),
+                            np.sqrt(np.add.reduceat(squares, starts) / counts)))
+
+
+def resample(data, width):
+    """Combine an overview into at most width (min, max, rms) columns for drawing.
+
+    The values are ints between -127 and 127.
+    """
+    peaks = np.frombuffer(data, np.int8).reshape(-1, 3).astype(np.int32)
+    if len(peaks) <= width:
+        return peaks.tolist()
+    starts = np.linspace(0, len(peaks), width, endpoint=False).astype(np.intp)
+    counts = np.diff(np.append(starts, len(peaks)))
+    rms = np.sqrt(np.add.reduceat(np.square(peaks[:, 2]), starts) / counts)
+    return np.column_stack((np.minimum.reduceat(peaks[:, 0], starts),
+                            np.maximum.reduceat(peaks[:, 1], starts),
+                            np.round(rms).astype(np.int32))).tolist()
+
+
+class PeakGenerator:
+    # Builds waveform overviews in a pool of worker processes and stores them
+    # in a MetadataStore. Paths are taken in priority order, so the file just
+    # selected (priority 0) goes before a directory being built (priority 1),
+    # and only a couple of files per process are handed to the pool at a time
+    # so a new request never waits behind a whole directory. Each finished file
+    # is announced through post('-PEAKS-', (path, done, total)), which must be
+    # thread-safe; done and total count the files since the queue was last empty.
+    def __init__(self, metadata, post, workers=None, buckets=BUCKETS):
+        self.metadata = metadata
+        self.post = post
+        self.workers = workers or os.cpu_count() or 2
+        self.buckets = buckets
+        self.jobs = PriorityQueue()
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+        #paths queued or being built, and the ones being built
+        self.pending = set()
+        self.running = set()
+        self.done = 0
+        self.total = 0
+        self.slots = threading.Semaphore(self.workers * 2)
+        self.executor = None
+        threading.Thread(target=self.feed, daemon=True).start()
+
+    def request(self, paths, priority=1):
+        # Queue overviews for paths, those that are already up to date are skipped by the feeder
+        with self.lock:
+            for path in paths:
+                if path not in self.pending:
+                    self.pending.add(path)
+                    self.total += 1
+                # a queued path asked for again at a higher priority is queued again, its old job is skipped
+                self.jobs.put((priority, next(self.order), path))
+
+    def feed(self):
+        while True:
+            priority, order, path = self.jobs.get()
+            with self.lock:
+                if path not in self.pending or path in self.running:
+                    continue
+                self.running.add(path)
+            try:
+                stat = os.stat(path)
+                data = self.metadata.peaks(path)
+            except OSError as e:
+                print(f"Failed to build waveform of {path}: {e}")
+                self.finish(path)
+                continue
+            if data is not None:
+                # already up to date, only worth announcing once the queue is empty
+                self.finish(path, announce=False)
+                continue
+            self.slots.acquire()
+            try:
+                future = self.pool().submit(computePeaks, path, self.buckets)
+            except BrokenProcessPool:
+                # a worker died and took the pool with it, start a new one
+                self.executor = None
+                future = self.pool().submit(computePeaks, path, self.buckets)
+            future.add_done_callback(lambda future, path=path, stat=stat: self.built(path, stat, future))
+
+    def pool(self):
+        if self.executor is None:
+            # spawned workers start clean instead of inheriting the GUI's threads and handles
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=get_context('spawn'))
+        return self.executor
+
+    def built(self, path, stat, future):
+        self.slots.release()
+        if future.cancelled():
+            return
+        try:
+            data = future.result()
+        except Exception as e:
+            print(f"Failed to build waveform of {path}: {e}")
+            metrics.count('peaks.failed')
+            # remember the failure so the file is not tried again until it changes
+            data = b''
+        metrics.count('peaks.built')
+        self.metadata.putPeaks(path, stat, data)
+        self.finish(path)
+
+    def finish(self, path, announce=True):
+        with self.lock:
+            self.pending.discard(path)
+            self.running.discard(path)
+            self.done += 1
+            progress = (path, self.done, self.total)
+            if not self.pending:
+                self.done = self.total = 0
+                announce = True
+        if announce:
+            self.post('-PEAKS-', progress)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
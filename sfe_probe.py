@@ -0,0 +1,367 @@
+"""
+Header-only probing of audio files.
+
+probe() reads just the container headers of a file: the RIFF/RF64 and
+FORM chunk headers of WAV and AIFF files, the STREAMINFO block of FLAC
+files, the first and last pages of Ogg files and the first frame of MP3
+files with its Xing/Info or VBRI header. Each file is opened once and only
+a few KB are read, whatever its length.
+
+The result is a dict with the format, duration in seconds, sample rate,
+channels and bit depth (None for lossy formats), or None for a file whose
+headers are cut short, corrupt or of no known format.
+
+pcmLayout() walks the same chunks of uncompressed WAV and AIFF files to
+find where their sample data lies and how it is encoded.
+"""
+import os
+import struct
+
+HEAD_SIZE = 4096
+#how far into an MP3 file or back from the end of an Ogg file to look
+SEARCH_SIZE = 65536
+
+
+class ProbeError(ValueError):
+    pass
+
+
+def probe(path):
+    with open(path, 'rb') as f:
+        try:
+            return probeHeaders(f)
+        except (ProbeError, struct.error, IndexError, OverflowError):
+            # fields missing from a cut short header, or values no file can have
+            return None
+
+
+def probeHeaders(f):
+    size = os.fstat(f.fileno()).st_size
+    head = f.read(HEAD_SIZE)
+    if head[:4] in (b'RIFF', b'RIFX', b'RF64') and head[8:12] == b'WAVE':
+        return probeWave(f, head, size)
+    if head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+        return probeAiff(f, head, size)
+    # an ID3v2 tag may come before FLAC or MPEG data
+    offset = id3Size(head)
+    if offset:
+        f.seek(offset)
+        head = f.read(HEAD_SIZE)
+    if head[:4] == b'fLaC':
+        return probeFlac(head)
+    if head[:4] == b'OggS':
+        return probeOgg(f, head, size)
+    return probeMpeg(f, head, size, offset)
+
+
+def readAt(f, head, position, count, base=0):
+    # Read count bytes at position in head, which was read from the file at base, from head when possible
+    if position + count <= len(head):
+        return head[position:position + count]
+    f.seek(base + position)
+    return f.read(count)
+
+
+def info(file_format, duration, sample_rate, channels, bit_depth=None):
+    return {'format': file_format, 'duration': duration, 'sample_rate': sample_rate,
+            'channels': channels, 'bit_depth': bit_depth}
+
+
+def probeWave(f, head, size):
+    endian = '>' if head[:4] == b'RIFX' else '<'
+    fmt = fact = data_size = ds64_size = None
+    position = 12
+    while position + 8 <= size:
+        header = readAt(f, head, position, 8)
+        if len(header) < 8:
+            break
+        chunk_id = header[:4]
+        chunk_size = struct.unpack(endian + 'I', header[4:])[0]
+        if chunk_id == b'ds64':
+            # RF64 keeps the real 64-bit sizes here
+            ds64_size = struct.unpack('<Q', readAt(f, head, position + 16, 8))[0]
+        elif chunk_id == b'fmt ':
+            fmt = struct.unpack(endian + 'HHIIHH', readAt(f, head, position + 8, 16))
+        elif chunk_id == b'fact':
+            fact = struct.unpack(endian + 'I', readAt(f, head, position + 8, 4))[0]
+        elif chunk_id == b'data':
+            if chunk_size == 0xFFFFFFFF and ds64_size is not None:
+                chunk_size = ds64_size
+            # files that are still being written or were cut short claim more than they hold
+            data_size = min(chunk_size, size - position - 8)
+            if fmt is not None:
+                break
+        position += 8 + chunk_size + (chunk_size & 1)
+    if fmt is None or data_size is None:
+        raise ProbeError("no fmt or data chunk")
+    tag, channels, rate, byte_rate, block_align, bits = fmt
+    if not rate:
+        raise ProbeError("sample rate is 0")
+    if tag in (1, 3, 0xFFFE) and block_align:
+        # PCM, float and extensible formats have a fixed frame size
+        duration = (data_size // block_align) / rate
+    elif fact is not None:
+        duration = fact / rate
+    elif byte_rate:
+        duration = data_size / byte_rate
+    else:
+        raise ProbeError("cannot work out the length")
+    return info('wav', duration, rate, channels, bits or None)
+
+
+def extendedFloat(data):
+    # Decode the 80-bit IEEE extended float AIFF uses for its sample rate
+    exponent = ((data[0] & 0x7F) << 8) | data[1]
+    mantissa = int.from_bytes(data[2:10], 'big')
+    if exponent == 0 and mantissa == 0:
+        return 0.0
+    value = mantissa * 2.0 ** (exponent - 16383 - 63)
+    return -value if data[0] & 0x80 else value
+
+
+def probeAiff(f, head, size):
+    position = 12
+    while position + 8 <= size:
+        header = readAt(f, head, position, 8)
+        if len(header) < 8:
+            break
+        chunk_size = struct.unpack('>I', header[4:])[0]
+        if header[:4] == b'COMM':
+            body = readAt(f, head, position + 8, 18)
+            if len(body) < 18:
+                break
+            channels, frames, bits = struct.unpack('>hIh', body[:8])
+            rate = extendedFloat(body[8:18])
+            if rate <= 0:
+                raise ProbeError("sample rate is 0")
+            return info('aiff', frames / rate, int(rate), channels, bits)
+        position += 8 + chunk_size + (chunk_size & 1)
+    raise ProbeError("no COMM chunk")
+
+
+def streamInfo(data):
+    # Decode the sample rate, channels, bit depth and sample count of a FLAC STREAMINFO block
+    if len(data) < 18:
+        raise ProbeError("STREAMINFO is cut short")
+    bits = int.from_bytes(data[10:18], 'big')
+    rate = bits >> 44
+    channels = ((bits >> 41) & 0x7) + 1
+    bit_depth = ((bits >> 36) & 0x1F) + 1
+    samples = bits & 0xFFFFFFFFF
+    if not rate:
+        raise ProbeError("sample rate is 0")
+    return rate, channels, bit_depth, samples
+
+
+def probeFlac(head):
+    # STREAMINFO is always the first metadata block
+    if head[4] & 0x7F != 0:
+        raise ProbeError("first block is not STREAMINFO")
+    rate, channels, bit_depth, samples = streamInfo(head[8:42])
+    return info('flac', samples / rate, rate, channels, bit_depth)
+
+
+def probeOgg(f, head, size):
+    if len(head) < 28:
+        raise ProbeError("Ogg page is cut short")
+    serial = struct.unpack('<I', head[14:18])[0]
+    packet = head[27 + head[26]:]
+    skip = 0
+    bit_depth = None
+    if packet[:7] == b'\x01vorbis':
+        channels = packet[11]
+        rate = struct.unpack('<I', packet[12:16])[0]
+        granule_rate = rate
+    elif packet[:8] == b'OpusHead':
+        channels = packet[9]
+        skip = struct.unpack('<H', packet[10:12])[0]
+        rate = struct.unpack('<I', packet[12:16])[0]
+        # Opus granule positions always count at 48 kHz
+        granule_rate = 48000
+    elif packet[:5] == b'\x7fFLAC' and packet[9:13] == b'fLaC':
+        rate, channels, bit_depth, samples = streamInfo(packet[17:35])
+        granule_rate = rate
+    else:
+        raise ProbeError("unknown Ogg codec")
+    if not granule_rate:
+        raise ProbeError("sample rate is 0")
+    granule = lastGranule(f, size, serial)
+    return info('ogg', max(granule - skip, 0) / granule_rate, rate, channels, bit_depth)
+
+
+def lastGranule(f, size, serial):
+    # Find the granule position of the last page of the stream, reading back from the end
+    count = min(HEAD_SIZE * 2, size)
+    while True:
+        f.seek(size - count)
+        tail = f.read(count)
+        position = tail.rfind(b'OggS')
+        while position >= 0:
+            page = tail[position:position + 18]
+            if len(page) == 18 and struct.unpack('<I', page[14:18])[0] == serial:
+                granule = struct.unpack('<q', page[6:14])[0]
+                # header pages have granule 0, a stream that ends with one was cut short
+                if granule > 0:
+                    return granule
+            position = tail.rfind(b'OggS', 0, position)
+        if count >= min(SEARCH_SIZE, size):
+            raise ProbeError("no final Ogg page")
+        count = min(SEARCH_SIZE, size)
+
+
+def id3Size(head):
+    # Size of an ID3v2 tag at the start of the file, 0 if there is none
+    if head[:3] != b'ID3' or len(head) < 10:
+        return 0
+    size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+    # a footer adds another 10 bytes
+    return 10 + size + (10 if head[5] & 0x10 else 0)
+
+
+MPEG_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+#sample rates by the version bits of the frame header: MPEG 2.5, reserved, MPEG 2, MPEG 1
+MPEG_SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+
+
+def mpegFrame(data):
+    # Decode a 4-byte MPEG audio frame header, None if it is not one
+    if len(data) < 4:
+        return None
+    header = int.from_bytes(data[:4], 'big')
+    version = (header >> 19) & 0x3
+    layer = 4 - ((header >> 17) & 0x3)
+    bitrate_index = (header >> 12) & 0xF
+    rate_index = (header >> 10) & 0x3
+    if (header >> 21) != 0x7FF or version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    lsf = version != 3
+    bitrate = MPEG_BITRATES[(2 if lsf else 1, layer)][bitrate_index] * 1000
+    rate = MPEG_SAMPLE_RATES[version][rate_index]
+    padding = (header >> 9) & 0x1
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // rate + padding) * 4
+    else:
+        samples = 576 if layer == 3 and lsf else 1152
+        length = samples // 8 * bitrate // rate + padding
+    return {'layer': layer, 'lsf': lsf, 'bitrate': bitrate, 'rate': rate, 'samples': samples,
+            'length': length, 'channels': 1 if (header >> 6) & 0x3 == 3 else 2}
+
+
+def probeMpeg(f, head, size, offset):
+    frame, start = findFrame(head)
+    if frame is None:
+        f.seek(offset)
+        head = f.read(SEARCH_SIZE)
+        frame, start = findFrame(head)
+        if frame is None:
+            raise ProbeError("no MPEG frame found")
+    if offset + start + frame['length'] > size:
+        raise ProbeError("MPEG frame is cut short")
+    rate, samples = frame['rate'], frame['samples']
+    file_format = 'mp3' if frame['layer'] == 3 else f"mp{frame['layer']}"
+
+    # a Xing/Info or VBRI header in the first frame holds the frame count
+    side = (17 if frame['channels'] == 1 else 32) if not frame['lsf'] else (9 if frame['channels'] == 1 else 17)
+    xing = readAt(f, head, start + 4 + side, 12, offset)
+    if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 0x1:
+        frames = struct.unpack('>I', xing[8:12])[0]
+        return info(file_format, frames * samples / rate, rate, frame['channels'])
+    vbri = readAt(f, head, start + 36, 18, offset)
+    if vbri[:4] == b'VBRI':
+        frames = struct.unpack('>I', vbri[14:18])[0]
+        return info(file_format, frames * samples / rate, rate, frame['channels'])
+
+    # otherwise assume a constant bitrate over the rest of the file
+    audio_bytes = size - (offset + start)
+    if size >= 128:
+        f.seek(size - 128)
+        if f.read(3) == b'TAG':
+            audio_bytes -= 128
+    return info(file_format, audio_bytes * 8 / frame['bitrate'], rate, frame['channels'])
+
+
+def findFrame(data):
+    # Find the first frame header that is followed by another one (or the end of data)
+    position = data.find(b'\xff')
+    while 0 <= position < len(data) - 3:
+        frame = mpegFrame(data[position:position + 4])
+        if frame is not None:
+            following = position + frame['length']
+            if following + 4 > len(data) or mpegFrame(data[following:following + 4]) is not None:
+                return frame, position
+        position = data.find(b'\xff', position + 1)
+    return None, None
+
+
+def pcmLayout(path):
+    """Find the sample data of an uncompressed WAV or AIFF file.
+
+    Returns a dict with the offset and size of the sample data, channels,
+    sample rate, sample width in bytes, byte order ('<' or '>') and sample
+    kind ('int', 'uint' or 'float'). Raises ProbeError for anything else.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(HEAD_SIZE)
+        wav = head[:4] in (b'RIFF', b'RIFX', b'RF64') and head[8:12] == b'WAVE'
+        aiff = head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC')
+        if not (wav or aiff):
+            raise ProbeError("not a WAV or AIFF file")
+        endian = '>' if head[:4] in (b'RIFX', b'FORM') else '<'
+        layout = {'endian': endian}
+        data = ds64_size = None
+        position = 12
+        while position + 8 <= size and (data is None or 'kind' not in layout):
+            header = readAt(f, head, position, 8)
+            if len(header) < 8:
+                break
+            chunk_id = header[:4]
+            chunk_size = struct.unpack(endian + 'I', header[4:])[0]
+            if chunk_id == b'ds64':
+                ds64_size = struct.unpack('<Q', readAt(f, head, position + 16, 8))[0]
+            elif chunk_id == b'fmt ':
+                body = readAt(f, head, position + 8, 26)
+                tag, channels, rate, byte_rate, block_align, bits = struct.unpack(endian + 'HHIIHH', body[:16])
+                if tag == 0xFFFE and len(body) >= 26:
+                    # the extensible format keeps the real format tag in its sub-format GUID
+                    tag = struct.unpack(endian + 'H', body[24:26])[0]
+                if tag not in (1, 3):
+                    raise ProbeError("compressed WAV data")
+                layout.update(channels=channels, rate=rate, width=(bits + 7) // 8,
+                              kind='float' if tag == 3 else 'uint' if bits <= 8 else 'int')
+            elif chunk_id == b'data':
+                if chunk_size == 0xFFFFFFFF and ds64_size is not None:
+                    chunk_size = ds64_size
+                data = (position + 8, min(chunk_size, size - position - 8))
+            elif chunk_id == b'COMM':
+                body = readAt(f, head, position + 8, 22)
+                channels, frames, bits = struct.unpack('>hIh', body[:8])
+                compression = body[18:22] if head[8:12] == b'AIFC' else b'NONE'
+                if compression in (b'NONE', b'twos'):
+                    kind = 'int'
+                elif compression == b'sowt':
+                    kind = 'int'
+                    layout['endian'] = '<'
+                elif compression in (b'fl32', b'FL32', b'fl64', b'FL64'):
+                    kind = 'float'
+                else:
+                    raise ProbeError("compressed AIFF data")
+                layout.update(channels=channels, rate=int(extendedFloat(body[8:18])),
+                              width=(bits + 7) // 8, kind=kind)
+            elif chunk_id == b'SSND':
+                offset = struct.unpack('>I', readAt(f, head, position + 8, 4))[0]
+                start = position + 16 + offset
+                data = (start, min(chunk_size - 8 - offset, size - start))
+            position += 8 + chunk_size + (chunk_size & 1)
+        if data is None or 'kind' not in layout or not layout['channels']:
+            raise ProbeError("no sample data found")
+        layout['offset'], layout['size'] = data
+        return layout
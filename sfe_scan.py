@@ -0,0 +1,469 @@
+"""
+Scanning folders for audio files and keeping them as a tree.
+
+A Directory is one folder of the library with its own audio files and
+its subfolders. scanTree() builds the Directories of a whole subtree,
+listing every folder once. scanParallel() does the same for one or more
+top folders with a pool of worker processes, which keeps slow network
+storage busy with several listings at a time, and BackgroundScan runs
+either on a thread for the GUI. DirectoryTrie holds the library's
+Directories so that any folder can be found by its path.
+
+Nothing here imports a GUI or audio library.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import get_context
+from sfe_metrics import metrics
+
+#worker processes of a parallel scan
+SCAN_WORKERS = min(8, os.cpu_count() or 1)
+#folders a worker lists before handing the rest of its subtree back to be shared out
+CHUNK_FOLDERS = 64
+#seconds added to every folder listing, to try parallel scanning as if on slow network storage
+LATENCY = 0.0
+
+
+class Directory:
+    
+    FILE_TYPES = ('.mp3', '.wav', '.aiff', '.aif', '.flac', '.ogg')
+    
+    def __init__(self, path, scan=True):
+        self.path = path
+        #child Directories by folder name, the edges of the DirectoryTrie
+        self.subdirectories = {}
+        self.name = os.path.basename(path)
+        self.parent = ''
+        #modification time and inode link count of the folder when it was last listed
+        self.mtime = None
+        self.nlink = None
+        #row id of the folder in the LibraryStore, and the store its files are read from
+        self.folder_id = None
+        self.store = None
+        #the folder's own audio files (not its descendants') mapped to their inode numbers
+        self._inodes = {}
+        #number of audio files and their total probed duration in the whole subtree
+        self.file_count = 0
+        self.duration = 0.0
+        #durations of the folder's own files that are counted in self.duration
+        self.durations = {}
+        if scan:
+            self.getFiles()
+
+    @classmethod
+    def stored(cls, path, folder_id, store, mtime, nlink):
+        # A Directory read from a LibraryStore, whose files are read when first needed
+        directory = cls(path, scan=False)
+        directory.folder_id = folder_id
+        directory.store = store
+        directory.mtime = mtime
+        directory.nlink = nlink
+        directory._inodes = None
+        return directory
+
+    @property
+    def inodes(self):
+        if self._inodes is None:
+            loadFiles([self])
+        return self._inodes
+
+    @inodes.setter
+    def inodes(self, inodes):
+        self._inodes = inodes
+
+    def subtreeFiles(self):
+        # Every audio file in the subtree, reading the own files of its folders in one batch
+        subtree = list(iterSubtree(self))
+        loadFiles(subtree)
+        return [file_path for directory in subtree for file_path in directory._inodes]
+
+    def countFiles(self):
+        # Total the file count and duration of the subtree from the folder's own files and its children's totals
+        self.file_count = len(self.inodes) + sum(child.file_count for child in self.subdirectories.values())
+        self.duration = sum(self.durations.values()) + sum(child.duration for child in self.subdirectories.values())
+
+    def getFiles(self):
+        # Walk the whole subtree once and build the subdirectories from that walk
+        self.subdirectories = {}
+        scanTree(self)
+        return self.subtreeFiles()
+
+    def rename(self, new_name):
+        # Rename the directory
+        pass
+
+    def delete(self):
+        # Delete the directory
+        pass
+
+
+def listDirectory(path):
+    """List a single folder.
+
+    Returns the folder's stat result, its audio files mapped to their inode
+    numbers and the paths of its subfolders. Symlinked folders are left out,
+    as os.walk does. Raises OSError if the folder cannot be read.
+    """
+    if LATENCY:
+        time.sleep(LATENCY)
+    # stat before listing so that changes made during the listing show up on the next rescan
+    stat = os.stat(path)
+    files = {}
+    folders = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    folders.append(entry.path)
+            elif os.path.splitext(entry.name)[-1] in Directory.FILE_TYPES:
+                files[entry.path] = entry.inode()
+    return stat, files, folders
+
+
+def readFolder(directory):
+    """List the folder of directory and fill in its own files and scan details.
+
+    Returns the new Directory objects for its subfolders, which are not
+    scanned yet. Raises OSError if the folder cannot be read.
+    """
+    stat, files, folders = listDirectory(directory.path)
+    directory.mtime = stat.st_mtime_ns
+    directory.nlink = stat.st_nlink
+    directory.inodes = files
+    subdirectories = []
+    for folder in folders:
+        subdirectory = Directory(folder, scan=False)
+        subdirectory.parent = directory.path
+        directory.subdirectories[subdirectory.name] = subdirectory
+        subdirectories.append(subdirectory)
+    return subdirectories
+
+
+class ScanCancelled(Exception):
+    pass
+
+
+def scanTree(root, progress=None, cancel=None):
+    """Scan the subtree under root in a single pass.
+
+    Every folder is listed exactly once with os.scandir. Subdirectories are
+    built as Directory objects without scanning them again; each directory
+    holds only its own files, and its file_count the number in its subtree.
+    Returns a list of every Directory in the subtree, parents first.
+
+    progress(folders, files) is called after each folder with the number of
+    folders and files it added. Setting the cancel Event stops the scan
+    with ScanCancelled.
+    """
+    order = []
+    stack = [root]
+    with metrics.span('scan.tree'):
+        while stack:
+            if cancel is not None and cancel.is_set():
+                raise ScanCancelled(root.path)
+            current = stack.pop()
+            order.append(current)
+            try:
+                subdirectories = readFolder(current)
+            except OSError:
+                # unreadable folders are skipped, as os.walk does
+                metrics.count('scan.unreadable')
+                continue
+            stack.extend(subdirectories)
+            if progress is not None:
+                progress(1, len(current.inodes))
+
+        # total the file counts, deepest first
+        for directory in reversed(order):
+            directory.countFiles()
+    metrics.count('scan.folders', len(order))
+    metrics.count('scan.files', root.file_count)
+    return order
+
+
+def setLatency(latency):
+    # Set the simulated latency of folder listings, also used to set it in worker processes
+    global LATENCY
+    LATENCY = latency
+
+
+def scanChunk(path, budget=CHUNK_FOLDERS):
+    """List the subtree under path in a worker process, up to budget folders.
+
+    Returns the listed folders as (path, mtime, nlink, files, subfolder
+    paths) records, parents before their children, and the paths of the
+    folders found but not listed, each the top of a subtree still to scan.
+    An unreadable folder gets a record without mtime, files or subfolders.
+    """
+    records = []
+    stack = [path]
+    while stack and len(records) < budget:
+        current = stack.pop()
+        try:
+            stat, files, folders = listDirectory(current)
+        except OSError:
+            records.append((current, None, None, {}, []))
+            continue
+        records.append((current, stat.st_mtime_ns, stat.st_nlink, files, folders))
+        stack.extend(folders)
+    return records, stack
+
+
+def scanParallel(roots, workers=SCAN_WORKERS, progress=None, cancel=None, finished=None, budget=CHUNK_FOLDERS):
+    """Scan the subtrees under several Directories at once in a pool of worker processes.
+
+    The top folders and the first budget folders below them are listed
+    here, so small trees need no worker processes at all. The rest is
+    scanned by the workers a chunk of at most budget folders at a time, and
+    whatever a chunk leaves unlisted is queued again, so idle workers take
+    over parts of large subtrees. At most twice as many chunks as workers are queued
+    in the pool at a time. The records the workers send back are merged
+    into the Directories of roots, which end up as scanTree() leaves them.
+
+    progress(folders, files) is called for every chunk. finished(directory)
+    is called with each subfolder of a top folder once its subtree is
+    complete and counted. Setting the cancel Event stops the scan with
+    ScanCancelled. Raises OSError if a top folder cannot be read.
+    """
+    directories = {}
+    queue = deque()
+    # the subtrees below the top folders that still have chunks queued or running, by top subfolder
+    outstanding = {}
+    for root in roots:
+        for subdirectory in readFolder(root):
+            directories[subdirectory.path] = subdirectory
+            queue.append((subdirectory.path, subdirectory.path))
+            outstanding[subdirectory.path] = 1
+        if progress is not None:
+            progress(1, len(root.inodes))
+
+    def merge(top, records, unlisted):
+        # Take in a finished chunk of the subtree under top
+        files = mergeRecords(directories, records)
+        for path in unlisted:
+            queue.append((path, top))
+        outstanding[top] += len(unlisted) - 1
+        if progress is not None:
+            progress(len(records), files)
+        if not outstanding[top]:
+            del outstanding[top]
+            for directory in reversed(list(iterSubtree(directories[top]))):
+                directory.countFiles()
+            if finished is not None:
+                finished(directories[top])
+
+    with metrics.span('scan.parallel'):
+        listed = 0
+        while queue and listed < budget:
+            if cancel is not None and cancel.is_set():
+                raise ScanCancelled(roots[0].path)
+            path, top = queue.popleft()
+            records, unlisted = scanChunk(path, budget - listed)
+            listed += len(records)
+            merge(top, records, unlisted)
+        if queue:
+            pool = ProcessPoolExecutor(workers, mp_context=get_context('spawn'),
+                                       initializer=setLatency, initargs=(LATENCY,))
+            running = {}
+            try:
+                while queue or running:
+                    if cancel is not None and cancel.is_set():
+                        raise ScanCancelled(roots[0].path)
+                    while queue and len(running) < workers * 2:
+                        path, top = queue.popleft()
+                        running[pool.submit(scanChunk, path, budget)] = top
+                    done, _ = wait(running, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        metrics.count('scan.chunks')
+                        merge(running.pop(future), *future.result())
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+    for root in roots:
+        root.countFiles()
+    metrics.count('scan.folders', len(directories) + len(roots))
+    metrics.count('scan.files', sum(root.file_count for root in roots))
+
+
+def mergeRecords(directories, records):
+    # Fill in the Directories of records from scanChunk() and create their subfolders, returns the number of files
+    files = 0
+    for path, mtime, nlink, inodes, folders in records:
+        directory = directories[path]
+        directory.mtime = mtime
+        directory.nlink = nlink
+        directory.inodes = inodes
+        files += len(inodes)
+        for folder in folders:
+            subdirectory = Directory(folder, scan=False)
+            subdirectory.parent = path
+            directory.subdirectories[subdirectory.name] = subdirectory
+            directories[folder] = subdirectory
+    return files
+
+
+class BackgroundScan:
+    # Scans a folder for the library on a background thread. Each subfolder
+    # of the top folder is scanned as a separate subtree, and the results are
+    # posted through post(event, value), which must be thread-safe:
+    #   '-SCAN-PROGRESS-'  (folders, files, files per second), a few times a second
+    #   '-SCAN-SUBTREE-'   a finished Directory below the top folder
+    #   '-SCAN-STORING-'   the number of files found, once the scan is done and store() runs
+    #   '-SCAN-DONE-'      the finished top Directory, or None if it was cancelled before store() ran
+    #   '-SCAN-FAILED-'    an error message
+    # With more than one worker the subtrees are scanned by scanParallel().
+    # store(directory), if given, is called with the finished top Directory on
+    # the scan's thread, to save it before '-SCAN-DONE-' is posted.
+    REPORT_INTERVAL = 0.25
+
+    def __init__(self, path, post, workers=SCAN_WORKERS, store=None):
+        self.path = path
+        self.post = post
+        self.workers = workers
+        self.store = store
+        self.cancelled = threading.Event()
+        self.folders = 0
+        self.files = 0
+        self.started = None
+        self.last_report = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.started = time.monotonic()
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def progress(self, folders, files):
+        self.folders += folders
+        self.files += files
+        now = time.monotonic()
+        if now - self.last_report >= self.REPORT_INTERVAL:
+            self.last_report = now
+            self.post('-SCAN-PROGRESS-', (self.folders, self.files, self.files / max(now - self.started, 1e-6)))
+
+    @metrics.timed('scan.background')
+    def run(self):
+        try:
+            root = Directory(self.path, scan=False)
+            if self.workers > 1:
+                scanParallel([root], self.workers, self.progress, self.cancelled,
+                             lambda subdirectory: self.post('-SCAN-SUBTREE-', subdirectory))
+            else:
+                subdirectories = readFolder(root)
+                self.progress(1, len(root.inodes))
+                for subdirectory in subdirectories:
+                    scanTree(subdirectory, self.progress, self.cancelled)
+                    self.post('-SCAN-SUBTREE-', subdirectory)
+                root.countFiles()
+            # a cancel may come after the last folder was listed
+            if self.cancelled.is_set():
+                raise ScanCancelled()
+            if self.store is not None:
+                # once saved the folder is in the library, a later cancel is too late
+                self.post('-SCAN-STORING-', root.file_count)
+                self.store(root)
+            self.post('-SCAN-DONE-', root)
+        except ScanCancelled:
+            self.post('-SCAN-DONE-', None)
+        except Exception as e:
+            self.post('-SCAN-FAILED-', f"{type(e).__name__}: {e}")
+
+
+def loadFiles(directories):
+    # Read the own files of the directories that were left in their LibraryStore
+    pending = [directory for directory in directories if directory._inodes is None]
+    if pending:
+        files = pending[0].store.folderFiles({directory.folder_id: directory.path for directory in pending})
+        for directory in pending:
+            directory._inodes = files[directory.folder_id]
+
+
+def iterSubtree(directory):
+    # Yield a directory and all of its descendants
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        yield current
+        stack.extend(current.subdirectories.values())
+
+
+class DirectoryTrie:
+    # The library's directories as a trie of path components. The top folders
+    # of the library are kept by path and below them every Directory's
+    # subdirectories are its children by name, so finding a folder costs one
+    # step per component of its path, and a subtree can be walked or dropped
+    # without looking at the rest of the library.
+    def __init__(self):
+        self.roots = {}
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def __getitem__(self, path):
+        directory = self.get(path)
+        if directory is None:
+            raise KeyError(path)
+        return directory
+
+    def get(self, path, default=None):
+        chain = self.chain(path)
+        return chain[-1] if chain and chain[-1].path == path else default
+
+    def chain(self, path):
+        # The Directories from the top folder down to path, or to its nearest ancestor in the library
+        folder = path
+        names = []
+        while folder not in self.roots:
+            parent = os.path.dirname(folder)
+            if parent == folder:
+                return []
+            names.append(os.path.basename(folder))
+            folder = parent
+        directory = self.roots[folder]
+        chain = [directory]
+        for name in reversed(names):
+            directory = directory.subdirectories.get(name)
+            if directory is None:
+                break
+            chain.append(directory)
+        return chain
+
+    def values(self):
+        # Every Directory in the library, parents before their children
+        for root in list(self.roots.values()):
+            yield from iterSubtree(root)
+
+    def insert(self, directory, parent=''):
+        # Attach directory and its subtree below the folder parent, or as a top folder
+        directory.parent = parent
+        if not parent:
+            self.roots[directory.path] = directory
+            return
+        self[parent].subdirectories[directory.name] = directory
+        self.adjust(parent, directory.file_count, directory.duration)
+
+    def remove(self, path):
+        # Detach the Directory at path with its subtree and return it, None if it is not in the library
+        directory = self.get(path)
+        if directory is None:
+            return None
+        if path in self.roots:
+            del self.roots[path]
+        else:
+            self[directory.parent].subdirectories.pop(directory.name, None)
+            self.adjust(directory.parent, -directory.file_count, -directory.duration)
+        return directory
+
+    def adjust(self, path, files, duration=0.0):
+        # Add to the totals of the folder at path and of every folder above it
+        for directory in self.chain(path):
+            directory.file_count += files
+            directory.duration += duration
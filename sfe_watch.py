@@ -0,0 +1,328 @@
+"""
+Watching the library's folders for changes while the application runs.
+
+A LibraryWatcher follows library folders on a background thread and posts
+the folders whose audio files or subfolders changed, so that only those
+are listed again with SoundLibrary.refresh() rather than rescanning whole
+top folders. On Linux the kernel reports changes through inotify, which is
+called with ctypes. Elsewhere, or once inotify runs out of watches, every
+folder is stat'ed each POLL_INTERVAL seconds and its mtime and link count
+compared with its last listing, as rescan() does. Bursts of changes, like
+a render writing many files, are gathered until the folders have been
+quiet for DEBOUNCE seconds, but for no longer than MAX_DELAY, and posted
+together.
+
+Nothing here imports a GUI or audio library.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+from queue import Queue, Empty
+from sfe_metrics import metrics
+from sfe_scan import Directory
+
+#seconds without changes before the changed folders are posted
+DEBOUNCE = 0.5
+#seconds the first change of a burst waits at most while more keep coming
+MAX_DELAY = 5.0
+#seconds between stats of every folder when polling
+POLL_INTERVAL = 5.0
+#seconds the thread waits at most before taking new folders to watch
+WAKE_INTERVAL = 0.25
+
+#inotify flags, from <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+#a folder is watched for its own entries coming and going, not for reads and writes of its files
+WATCH_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+              | IN_ONLYDIR | IN_DONT_FOLLOW)
+#struct inotify_event without its name: wd, mask, cookie and the length of the name
+EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    # The Linux inotify calls through ctypes. Raises OSError where they fail,
+    # and AttributeError where the C library has no inotify.
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.rm_watch = libc.inotify_rm_watch
+        self.rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self.check(libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC))
+
+    @staticmethod
+    def check(result, path=None):
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return result
+
+    def add(self, path):
+        # Watch the folder at path and return its watch descriptor, the same one if it is already watched
+        return self.check(self.add_watch(self.fd, os.fsencode(path), WATCH_MASK), path)
+
+    def remove(self, wd):
+        # fails harmlessly if the kernel already dropped the watch of a deleted folder
+        self.rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        # Wait up to timeout seconds for events and return them as (wd, mask, cookie, name) tuples
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            events.append((wd, mask, cookie, os.fsdecode(data[offset:offset + length].rstrip(b'\0'))))
+            offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher:
+    # Watches library folders on a background thread and posts the changes
+    # through post(event, value), which must be thread-safe:
+    #   '-WATCH-CHANGES-'  (paths of changed folders, paths of top folders to rescan)
+    # Top folders are only to be rescanned when inotify lost events because its
+    # queue overflowed. Folders are added with watch() and dropped with
+    # unwatch(); after the changed folders are listed again, follow() takes
+    # their new listing and watches the folders that appeared below them.
+    def __init__(self, post, inotify=True, debounce=DEBOUNCE, max_delay=MAX_DELAY, poll_interval=POLL_INTERVAL):
+        self.post = post
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        #folder path -> (mtime, nlink) of its last listing, (None, None) if it was never listed
+        self.folders = {}
+        #inotify watch descriptor -> folder path, and back
+        self.watches = {}
+        self.descriptors = {}
+        self.inotify = None
+        if inotify:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                print(f"Watching folders by polling, inotify is not available: {e}")
+        #('watch', [(path, mtime, nlink), ...]) and ('unwatch', path) requests for the thread
+        self.requests = Queue()
+        #folders changed and top folders to rescan since the last post, and when the first and last change came
+        self.changed = set()
+        self.rescans = set()
+        self.first = None
+        self.last = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @property
+    def mode(self):
+        return 'inotify' if self.inotify is not None else 'polling'
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def watch(self, directories):
+        # Watch the folders of Directories. Each is stat'ed once and posted as changed
+        # if it no longer matches its last listing, which catches changes made while
+        # it was not watched.
+        self.requests.put(('watch', [(directory.path, directory.mtime, directory.nlink) for directory in directories]))
+
+    def unwatch(self, path):
+        # Stop watching the folder at path and every folder below it
+        self.requests.put(('unwatch', path))
+
+    def follow(self, directory_map, paths):
+        # After the folders at paths were listed again, watch them with their new
+        # listing, along with the subtrees of subfolders that are new to the watcher
+        directories = []
+        for path in paths:
+            directory = directory_map.get(path)
+            if directory is None:
+                continue
+            directories.append(directory)
+            for subdirectory in directory.subdirectories.values():
+                if self.folders.get(subdirectory.path, (None,))[0] is None:
+                    stack = [subdirectory]
+                    while stack:
+                        current = stack.pop()
+                        directories.append(current)
+                        stack.extend(current.subdirectories.values())
+        if directories:
+            self.watch(directories)
+
+    def run(self):
+        next_poll = time.monotonic() + self.poll_interval
+        try:
+            while not self.stopped.is_set():
+                self.takeRequests()
+                now = time.monotonic()
+                timeout = WAKE_INTERVAL
+                if self.first is not None:
+                    timeout = min(timeout, self.last + self.debounce - now, self.first + self.max_delay - now)
+                if self.inotify is not None:
+                    self.handleEvents(self.inotify.read(max(timeout, 0)))
+                else:
+                    self.stopped.wait(max(min(timeout, next_poll - now), 0))
+                    if time.monotonic() >= next_poll:
+                        with metrics.span('watch.poll'):
+                            self.check(list(self.folders.items()))
+                        next_poll = time.monotonic() + self.poll_interval
+                self.flush()
+        finally:
+            if self.inotify is not None:
+                self.inotify.close()
+
+    def takeRequests(self):
+        while True:
+            try:
+                action, value = self.requests.get_nowait()
+            except Empty:
+                return
+            if action == 'watch':
+                for path, mtime, nlink in value:
+                    self.track(path, mtime, nlink)
+                self.check([(path, (mtime, nlink)) for path, mtime, nlink in value])
+            else:
+                self.untrack(value)
+
+    def track(self, path, mtime=None, nlink=None):
+        self.folders[path] = (mtime, nlink)
+        if self.inotify is None or path in self.descriptors:
+            return
+        try:
+            wd = self.inotify.add(path)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                # out of watches (fs.inotify.max_user_watches), poll every folder instead
+                self.fallBack(e)
+            # a folder that is gone or unreadable is picked up by the listing of its parent
+            return
+        self.watches[wd] = path
+        self.descriptors[path] = wd
+
+    def untrack(self, path):
+        prefix = path + os.sep
+        for folder in [folder for folder in self.folders if folder == path or folder.startswith(prefix)]:
+            del self.folders[folder]
+            wd = self.descriptors.pop(folder, None)
+            if wd is not None and self.watches.get(wd) == folder:
+                del self.watches[wd]
+                self.inotify.remove(wd)
+
+    def fallBack(self, error):
+        print(f"Watching folders by polling: {error}")
+        metrics.count('watch.fallback')
+        self.inotify.close()
+        self.inotify = None
+        self.watches.clear()
+        self.descriptors.clear()
+
+    def check(self, folders):
+        # Note the folders whose mtime or link count differ from the (mtime, nlink) given with them
+        for path, state in folders:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # gone, which the listing of its parent picks up
+                self.folders.pop(path, None)
+                continue
+            current = (stat.st_mtime_ns, stat.st_nlink)
+            if current != state:
+                if path in self.folders:
+                    self.folders[path] = current
+                self.changed.add(path)
+                self.touch()
+
+    def handleEvents(self, events):
+        for wd, mask, cookie, name in events:
+            metrics.count('watch.events')
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, the top folders are rescanned
+                self.rescans.update(path for path in self.folders if os.path.dirname(path) not in self.folders)
+                self.touch()
+                continue
+            folder = self.watches.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                # the folder was deleted and the kernel dropped its watch
+                del self.watches[wd]
+                if self.descriptors.get(folder) == wd:
+                    del self.descriptors[folder]
+                    self.folders.pop(folder, None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # the folder above reports these
+                continue
+            path = os.path.join(folder, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.trackNew(path)
+                else:
+                    self.untrack(path)
+            elif os.path.splitext(name)[-1] not in Directory.FILE_TYPES:
+                continue
+            self.changed.add(folder)
+            self.touch()
+
+    def trackNew(self, path):
+        # Watch a folder that was just created or moved in, with what is already below it.
+        # Files that came before their folder's watch are found when its parent is listed again.
+        stack = [path]
+        while stack:
+            folder = stack.pop()
+            self.track(folder)
+            try:
+                with os.scandir(folder) as entries:
+                    stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+
+    def touch(self):
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+        self.last = now
+
+    def flush(self):
+        # Post the changes once they have settled
+        if self.first is None:
+            return
+        now = time.monotonic()
+        if now - self.last < self.debounce and now - self.first < self.max_delay:
+            return
+        changes = (sorted(self.changed), sorted(self.rescans))
+        self.changed = set()
+        self.rescans = set()
+        self.first = self.last = None
+        if changes[0] or changes[1]:
+            metrics.count('watch.posts')
+            metrics.count('watch.folders', len(changes[0]))
+            self.post('-WATCH-CHANGES-', changes)
@@ -4,15 +4,30 @@ A Python script to explore sound files in a library.
 - The user can search for sound files by keyword.
 - The user can play and delete sound files.
 - The user can add and remove directories from the library.
+- Library folders can be watched so that changes on disk show up without a rescan.
 - Users can choose to open the file in its orginal location.
 - When certain directories are selected, the user will be able to view the files in the table.
-- Library information is stored in a pickled file.
+- Library information is stored in a SQLite database (library.db).
 """
 import sys
-from sfe_classes import *
-from sfe_functions import *
+# the scan and waveform worker processes are started with spawn, which imports this module
+# again as __mp_main__. They only need sfe_scan and sfe_peaks, not PySimpleGUI and pygame.
+if __name__ == '__main__':
+    from sfe_classes import *
+    from sfe_functions import *
+    from sfe_peaks import PeakGenerator
     
 
+#milliseconds between batched table refreshes while lengths are probed
+REFRESH_INTERVAL = 100
+#milliseconds to wait for events while a search is still finding matches
+SEARCH_INTERVAL = 10
+
+#events bound on the table that move its page, with the number of rows they move by
+TABLE_SCROLL_EVENTS = {'-TABLE-+WHEEL': 0, '-TABLE-+UP': -5, '-TABLE-+DOWN': 5,
+                       '-TABLE-+PAGEUP': -50, '-TABLE-+PAGEDOWN': 50}
+
+
 def main():
     sg.set_options(suppress_raise_key_errors=False, suppress_error_popups=False, suppress_key_guessing=False)
     
@@ -20,95 +35,157 @@ def main():
     file_queue = Queue()
     #create explorer object
     sfe = SoundFileExplorer(file_queue) 
-    sfe.loadState()
 
     #Create object for music player
     pg.mixer.init()
-    is_playing = False
+    player = Player(cache=PreloadCache())
     path = None
     
     g = Gui()      
+    #builds waveform overviews in worker processes, posting '-PEAKS-' as they are stored
+    peaks = PeakGenerator(sfe.metadata, g.window.write_event_value)
         
     #Update tree with directories 
     updateTree(sfe, g)     
     
     #Flag to ignore repeated events
     ignore = False
+    #the folder being added in the background, if any
+    scan = None
+    #the duplicate search running in the background, if any
+    dupes = None
+    #watches the library's folders for changes while "Watch Folders" is ticked
+    watcher = None
     
     #main event loop    
     while True:
-        event, values = g.window.Read()
-        print("<<", event)
-        print("<<", values)
-        print("ignore: ", ignore)
-        #debugging
+        # wake up regularly so probed lengths reach the table in batches
+        event, values = g.window.Read(timeout=SEARCH_INTERVAL if sfe.searching is not None else REFRESH_INTERVAL)
+        # time spent handling each event, timeouts included
+        started = time.perf_counter() if metrics.enabled else None
         if event in (sg.WIN_CLOSED, 'Exit'):
             break
         
         if event == '-ADD-' and not ignore:
-            ignore = True
-            file_queue.queue.clear()
-            directory_path = values['-ADD-']
-            g.window['-STATUS-'].Update(f"Adding {directory_path} to the library...")
-            status_message = addDir(directory_path, sfe, g)
-            g.window['-STATUS-'].Update(status_message)
-            ignore = False
+            if scan is not None:
+                g.window['-STATUS-'].Update(f"Still adding {scan.path}, please wait or cancel it first.")
+            elif values['-ADD-']:
+                directory_path = values['-ADD-']
+                g.window['-STATUS-'].Update(f"Adding {directory_path} to the library...")
+                scan = addDir(directory_path, sfe, g)
+
+        # progress of the folder being scanned in the background
+        if event == '-SCAN-PROGRESS-':
+            scanProgress(g, scan.path, values[event])
+        if event == '-SCAN-SUBTREE-':
+            scanSubtree(g, values[event])
+        if event == '-SCAN-STORING-':
+            scanStoring(g, scan.path, values[event])
+        if event == '-SCAN-DONE-':
+            g.window['-STATUS-'].Update(scanDone(sfe, g, scan.path, values[event]))
+            if watcher is not None and values[event] is not None and scan.path in sfe.directory_map:
+                watcher.watch(iterSubtree(values[event]))
+            scan = None
+        if event == '-SCAN-FAILED-':
+            g.window['-STATUS-'].Update(scanDone(sfe, g, scan.path, None, values[event]))
+            scan = None
+        if event == '-CANCEL-' and scan is not None:
+            g.window['-STATUS-'].Update(f"Cancelling {scan.path}...")
+            scan.cancel()
             
         if event == '-DELETE-' and not ignore:
             try:    
                 if not values['-TREE-']:
                     g.window['-STATUS-'].Update(f"Please select a directory to delete.")         
                 else:
+                    if watcher is not None:
+                        watcher.unwatch(values['-TREE-'][0])
                     deleteTreeItem(sfe, g, values)
             except Exception as e:
                 sg.popup_error(f"Failed to delete directory: {e}")
                 ignore = False
             
+        if event == '-RESCAN-' and not ignore:
+            if not values['-TREE-']:
+                g.window['-STATUS-'].Update("Please select a directory to rescan.")
+            else:
+                ignore = True
+                g.window['-STATUS-'].Update(f"Rescanning {values['-TREE-'][0]}...")
+                status_message = rescanTreeItem(sfe, g, values)
+                g.window['-STATUS-'].Update(status_message)
+                ignore = False
+
+        if event == '-WATCH-':
+            watcher = toggleWatch(sfe, g, watcher, values)
+        if event == '-WATCH-CHANGES-' and watcher is not None:
+            g.window['-STATUS-'].Update(watchChanges(sfe, g, watcher, values[event]))
+
+        if event == '-BUILD-PEAKS-':
+            if not values['-TREE-']:
+                g.window['-STATUS-'].Update("Please select a directory to build waveforms for.")
+            else:
+                g.window['-STATUS-'].Update(buildPeaks(sfe, g, peaks, values))
+        if event == '-PEAKS-':
+            peaksBuilt(sfe, g, peaks, player, values[event])
+
+        if event == '-DUPES-':
+            if dupes is not None:
+                # a second press stops the search
+                dupes.cancel()
+            else:
+                dupes = findDuplicates(sfe, g, values)
+        if event == '-DUPES-PROGRESS-':
+            duplicatesProgress(g, values[event])
+        if event == '-DUPES-DONE-':
+            g.window['-STATUS-'].Update(duplicatesDone(sfe, g, values[event]))
+            dupes = None
+        if event == '-DUPES-FAILED-':
+            g.window['-STATUS-'].Update(duplicatesDone(sfe, g, None, values[event]))
+            dupes = None
+
         if event == "-SEARCH-" and values["-TERM-"] != "" and not ignore:
-            sfe.table_update = True
             ignore = True
             search(sfe, g, file_queue, values)
             ignore = False
+        # typing a new term stops the search that is still running
+        if event == '-TERM-':
+            stopSearch(sfe, g)
                         
         if event == "-TREE-" and values["-TREE-"] and not ignore:
             ignore = True
-            sfe.table_update = True
             file_queue.queue.clear()
-            try:
-                print("Selected: ", values["-TREE-"][0])
-                if len(sfe.directory_map[values['-TREE-'][0]].audio_files) > 2000:
-                    g.window['-STATUS-'].Update(f"{values['-TREE-'][0]} has to many items to display at once.")
-                else:
-                    g.window['-STATUS-'].Update(f"Loading {values['-TREE-'][0]}...")
-                    g.tableData = sfe.handleTreeEvent(values)    
-                    g.window['-TABLE-'].Update(values=g.tableData)
-                    g.window['-STATUS-'].Update(f"Showing results from {values['-TREE-'][0]}.")
-            #get specific error message
-            except KeyError:
-                #print the specific value that caused the error
-                print(f"KeyError: {values['-TREE-'][0]}")
-            except IndexError:
-                sg.popup_error(f"IndexError: {values['-TREE-'][0]}")
-            except Exception as e:
-                sg.popup_error(f"Failed to update table: {e}")
-            finally:
-                ignore = False
-        
+            treeEvent(sfe, g, values, ignore)
+            ignore = False
         
-        if '-TABLE-' in event and not ignore:
+        # moving through the pages of the results table
+        if event in TABLE_SCROLL_EVENTS or event == '-SCROLL-':
+            if event == '-SCROLL-':
+                offset = values['-SCROLL-']
+            elif event == '-TABLE-+WHEEL':
+                step = -5 if g.window['-TABLE-'].user_bind_event.delta > 0 else 5
+                offset = sfe.view.offset + step
+            else:
+                offset = sfe.view.offset + TABLE_SCROLL_EVENTS[event] 
+            scrollTable(sfe, g, offset)
+
+        if event == '-METRICS-':
+            showMetrics()
+
+        if event == '-APPLY-FILTER-':
+            applyFilter(sfe, g, values)
+        # a click on a heading of the table sorts by its column
+        heading = isinstance(event, tuple) and event[0] == '-TABLE-' and event[2][0] == -1
+        if heading:
+            sortTable(sfe, g, event[2][1])
+
+        if '-TABLE-' in event and event not in TABLE_SCROLL_EVENTS and not heading and not ignore:
             try:
                 # Check if the index exists in g.tableData
-                if values["-TABLE-"][0] < len(g.tableData):
-                    lyst = g.tableData[values["-TABLE-"][0]]
-                    file = sfe.fileCache.get(''.join(map(str, lyst[3:])), None)
-                    if not file:
-                        g.window['-STATUS-'].Update(f"File not found in cache: {lyst[3:]}")
-                        print(f"File not found in cache: {lyst[3:]}")
-                    else:
-                        path = file[0].path
-                        g.window['-STATUS-'].Update(f"Selected: {os.path.basename(path)}")
-                        audio = pg.mixer.Sound(path) if path else None
-                        channel = pg.mixer.Channel(1)                                 
+                if values["-TABLE-"] and values["-TABLE-"][0] < len(g.tableData):
+                    selected = selectFile(sfe, g, player, values["-TABLE-"][0])
+                    if selected and selected != path:
+                        showWaveform(sfe, g, peaks, selected)
+                    path = selected or path
                 else:
                     print(f"Index {values['-TABLE-'][0]} does not exist in g.tableData.")
             except Exception as e:
@@ -117,39 +194,25 @@ def main():
         if event == "-PLAY-" and not path:
             g.window['-STATUS-'].Update(f'Select a file first.')
         if event == "-PLAY-" and path:
-            play(sfe, g, values, channel, audio, path)
+            play(g, player)
             
         if event == "-STOP-" and path:
-            if channel.get_busy():
+            if player.stop():
                 g.window['-STATUS-'].Update(f"Stopped {os.path.basename(path)}")  
-                sfe.is_playing = False
-                channel.stop()    
         if event == '-VOLUME-':
             volume = values['-VOLUME-'] / 100
-            channel.set_volume(volume)
+            player.setVolume(volume)
                                  
-        # Update the lengths of the audio files in the table
-        while sfe.table_update and not sfe.file_queue.empty():
-            ignore = True
-            g.window['-STATUS-'].Update(f"Updating table... please wait. (You won't have to wait next time you load this directory.)")
-            try:
-                path, length = sfe.file_queue.get_nowait()
-                for file in sfe.fileCache[path]:
-                    file.length = length
-                    g.tableData[file.index][2] = file.length
-                    g.window['-TABLE-'].Update(values=g.tableData)
-                    g.window.read(timeout=0)
-            except Exception as e:
-                sg.popup_error(f"Failed to update table: {e}")
-                
-        # Periodically update the table GUI with the updated file lengths
-        if sfe.table_update:
-            g.window['-TABLE-'].Update(values=g.tableData)
-            g.window['-STATUS-'].Update(f"Table updated.")
-            sfe.table_update = False
-            ignore = False 
+        # Show the matches found and the lengths probed since the last pass
+        updateSearch(sfe, g)
+        updateLengths(sfe, g)
+        if started is not None:
+            metrics.observe('gui.idle' if event == sg.TIMEOUT_KEY else 'gui.event', time.perf_counter() - started)
 
     g.window.close()
+    if watcher is not None:
+        watcher.stop()
+    peaks.close()
     sfe.saveState()
 
 
@@ -0,0 +1,81 @@
+import pytest
+
+from sfe_columns import FileColumns, parseFilter
+
+
+def testParseFilter():
+    assert parseFilter('duration<2s, 48 kHz, stereo') == [
+        ('duration', '<', 2.0), ('sample_rate', '=', 48000), ('channels', '=', 2)]
+    assert parseFilter('length>=1.5min rate=44.1k bits=24 mono') == [
+        ('duration', '>=', 90.0), ('sample_rate', '=', 44100.0), ('bit_depth', '=', 24.0), ('channels', '=', 1)]
+    assert parseFilter('size>10mb, type=.WAV') == [('size', '>', 10000000.0), ('type', '=', 'wav')]
+    assert parseFilter('') == []
+
+
+@pytest.mark.parametrize('text', ['colour=red', 'type>wav', 'duration<fast', 'loud'])
+def testParseFilterRejects(text):
+    with pytest.raises(ValueError):
+        parseFilter(text)
+
+
+def makeColumns():
+    columns = FileColumns()
+    columns.set('/a.wav', {'duration': 1.0, 'sample_rate': 48000, 'channels': 2}, 100)
+    columns.set('/b.wav', {'duration': 3.0, 'sample_rate': 44100, 'channels': 1}, 300)
+    columns.set('/c.mp3', {'duration': 0.5, 'sample_rate': 48000, 'channels': 2}, 50)
+    # not probed yet
+    columns.add(['/d.wav', '/e.aif'])
+    return columns
+
+
+def testFilter():
+    columns = makeColumns()
+    paths = ['/e.aif', '/d.wav', '/c.mp3', '/b.wav', '/a.wav']
+    assert columns.filter(paths, parseFilter('duration<2s, 48kHz')) == ['/c.mp3', '/a.wav']
+    assert columns.filter(paths, parseFilter('type=wav')) == ['/d.wav', '/b.wav', '/a.wav']
+    assert columns.filter(paths, parseFilter('size>=100, mono')) == ['/b.wav']
+    assert columns.filter(paths, parseFilter('type=flac')) == []
+
+
+def testFilterKeepsUnknownRows():
+    columns = makeColumns()
+    paths = ['/a.wav', '/b.wav', '/c.mp3', '/d.wav', '/e.aif']
+    conditions = parseFilter('duration<2s, type=wav')
+    assert columns.filter(paths, conditions, keep_unknown=True) == ['/a.wav', '/d.wav']
+    assert columns.countUnknown(['/a.wav', '/d.wav'], ['duration', 'type']) == 1
+    columns.set('/d.wav', {'duration': 5.0})
+    assert columns.filter(paths, conditions, keep_unknown=True) == ['/a.wav']
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def testSortPutsUnknownFirstOnBothPaths(reverse):
+    columns = makeColumns()
+    for i in range(200):
+        columns.set(f"/pad/{i}.wav", {'duration': 100.0 + i})
+    few = ['/a.wav', '/d.wav', '/b.wav', '/c.mp3']
+    expected = ['/d.wav'] + (['/b.wav', '/a.wav', '/c.mp3'] if reverse else ['/c.mp3', '/a.wav', '/b.wav'])
+    # few rows are sorted directly, all of them through the index
+    assert columns.sort(few, 'duration', reverse) == expected
+    everything = columns.sort(list(columns.paths), 'duration', reverse)
+    assert everything[:2] == ['/d.wav', '/e.aif']
+    assert [path for path in everything if path in few] == expected
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('column', ['duration', 'type'])
+def testSortBreaksTiesTheSameOnBothPaths(column, reverse):
+    columns = FileColumns()
+    paths = [f"/lib/{i}.{('wav', 'mp3', 'aif')[i % 3]}" for i in range(400)]
+    for i, path in enumerate(paths):
+        # a few values shared by many rows, and some unknown
+        columns.set(path, {'duration': float(i % 4) if i % 7 else None})
+    # a handful out of order, sorted directly, against the same rows picked from the index
+    few = paths[390:380:-1] + paths[:10:3]
+    everything = columns.sort(paths, column, reverse)
+    assert columns.sort(few, column, reverse) == [path for path in everything if path in few]
+
+
+def testRenameCopiesValues():
+    columns = makeColumns()
+    columns.rename([('/a.wav', '/b.wav'), ('/b.wav', '/a.wav')])
+    assert columns.filter(['/a.wav', '/b.wav'], parseFilter('mono')) == ['/a.wav']
@@ -0,0 +1,248 @@
+import os
+import pickle
+import sys
+import threading
+import time
+import types
+
+from sfe_core import SoundLibrary
+from sfe_scan import BackgroundScan, Directory
+
+
+def baselineModule():
+    # sfe_classes as the first versions pickled it: Directory held every audio file of its subtree
+    module = types.ModuleType('sfe_classes')
+
+    class Directory:
+        def __init__(self, path, audio_files, subdirectories=None, parent=''):
+            self.path = path
+            self.subdirectories = subdirectories or {}
+            self.name = os.path.basename(path)
+            self.audio_files = set(audio_files)
+            self.parent = parent
+
+    Directory.__module__ = 'sfe_classes'
+    Directory.__qualname__ = 'Directory'
+    module.Directory = Directory
+    return module
+
+
+def testImportBaselinePickle(tmp_path, monkeypatch):
+    root = tmp_path / 'samples'
+    (root / 'drums').mkdir(parents=True)
+    kick = str(root / 'drums' / 'kick.wav')
+    pad = str(root / 'pad.wav')
+    module = baselineModule()
+    drums = module.Directory(str(root / 'drums'), [kick], parent=str(root))
+    top = module.Directory(str(root), [kick, pad], {drums.path: drums})
+    monkeypatch.setitem(sys.modules, 'sfe_classes', module)
+    with open(tmp_path / 'explorer.pkl', 'wb') as f:
+        pickle.dump({top.path: top, drums.path: drums}, f)
+    # importing must not need the GUI module
+    monkeypatch.setitem(sys.modules, 'sfe_classes', None)
+    monkeypatch.chdir(tmp_path)
+
+    library = SoundLibrary(str(tmp_path / 'library.db'), str(tmp_path / 'metadata.db'))
+    try:
+        assert list(library.directory_map.roots) == [str(root)]
+        assert library.directory_map[str(root)].inodes.keys() == {pad}
+        assert library.directory_map[drums.path].inodes.keys() == {kick}
+        assert library.directory_map[str(root)].file_count == 2
+        assert sorted(library.searchFiles('.wav')) == sorted([kick, pad])
+    finally:
+        library.close()
+
+
+def testRescanMovesMetadataOfRenamedFiles(tmp_path):
+    root = tmp_path / 'samples'
+    (root / 'drums').mkdir(parents=True)
+    kick = root / 'drums' / 'kick.wav'
+    kick.write_bytes(b'x' * 100)
+    library = SoundLibrary(str(tmp_path / 'library.db'), str(tmp_path / 'metadata.db'))
+    try:
+        library.addDirectory(Directory(str(root)))
+        info = {'duration': 1.5, 'sample_rate': 48000, 'channels': 2, 'bit_depth': 24}
+        library.metadata.put(str(kick), os.stat(kick), info)
+        library.metadata.putPeaks(str(kick), os.stat(kick), b'peaks')
+        columns = library.columns
+        moved = root / 'kick_01.wav'
+        os.rename(kick, moved)
+
+        added, removed, renamed = library.rescan(str(root))
+
+        assert renamed == {str(kick): str(moved)}
+        assert library.metadata.lookup([str(kick), str(moved)]) == {str(moved): info}
+        assert library.metadata.peaks(str(moved)) == b'peaks'
+        assert columns.filter([str(moved)], [('sample_rate', '=', 48000)]) == [str(moved)]
+        assert library.searchFiles('kick') == [str(moved)]
+    finally:
+        library.close()
+
+
+def testRescanDoesNotPairNewFileWithDeletedOne(tmp_path):
+    root = tmp_path / 'samples'
+    root.mkdir()
+    old, new = root / 'old.wav', root / 'new_take.wav'
+    old.write_bytes(b'x' * 100)
+    library = SoundLibrary(str(tmp_path / 'library.db'), str(tmp_path / 'metadata.db'))
+    try:
+        library.addDirectory(Directory(str(root)))
+        library.metadata.put(str(old), os.stat(old), {'duration': 99.0})
+        columns = library.columns
+        os.remove(old)
+        new.write_bytes(b'y' * 300)
+        # the deleted file's inode is usually reused at once, make sure it was
+        library.directory_map[str(root)].inodes[str(old)] = os.stat(new).st_ino
+
+        added, removed, renamed = library.rescan(str(root))
+
+        assert renamed == {}
+        assert (list(added), list(removed)) == ([str(new)], [str(old)])
+        assert library.metadata.lookup([str(old), str(new)]) == {}
+        assert columns.filter([str(new)], [('duration', '=', 99.0)]) == []
+        assert columns.countUnknown([str(new)], ['duration']) == 1
+    finally:
+        library.close()
+
+
+def testRootError(tmp_path):
+    root = tmp_path / 'samples'
+    (root / 'drums').mkdir(parents=True)
+    (tmp_path / 'other').mkdir()
+    library = SoundLibrary(str(tmp_path / 'library.db'), str(tmp_path / 'metadata.db'))
+    try:
+        library.addDirectory(Directory(str(root)))
+        assert library.rootError(str(root)) == 'already in the library, use rescan'
+        assert library.rootError(str(root / 'drums')) == 'already in the library, use rescan'
+        assert library.rootError(str(root / 'drums' / 'new')) == 'inside a library folder, rescan that folder instead'
+        assert library.rootError(str(tmp_path)) == 'contains library folders, remove them first'
+        assert library.rootError(str(tmp_path / 'missing')) == 'not a folder'
+        assert library.rootError(str(tmp_path / 'other')) is None
+    finally:
+        library.close()
+
+
+def testBackgroundScanStoresOnItsThread(tmp_path):
+    root = tmp_path / 'samples'
+    (root / 'drums').mkdir(parents=True)
+    (root / 'drums' / 'kick.wav').write_bytes(b'')
+    library = SoundLibrary(str(tmp_path / 'library.db'), str(tmp_path / 'metadata.db'))
+    posted = []
+    try:
+        scan = BackgroundScan(str(root), lambda event, value: posted.append((event, value)), 1,
+                              library.storeDirectory)
+        scan.start()
+        scan.thread.join()
+        events = [event for event, value in posted]
+        assert events[-2:] == ['-SCAN-STORING-', '-SCAN-DONE-']
+        # stored and searchable, but only attached to the trie by the caller
+        assert library.searchFiles('kick') == [str(root / 'drums' / 'kick.wav')]
+        assert str(root) not in library.directory_map
+        library.attachDirectory(posted[-1][1])
+        assert library.directory_map[str(root)].file_count == 1
+    finally:
+        library.close()
+
+
+def testBackgroundScanCancelledAfterTheLastFolder(tmp_path):
+    root = tmp_path / 'samples'
+    (root / 'drums').mkdir(parents=True)
+    posted = []
+
+    def post(event, value):
+        posted.append((event, value))
+        # the only subfolder is done, nothing is left to be listed
+        if event == '-SCAN-SUBTREE-':
+            scan.cancel()
+
+    scan = BackgroundScan(str(root), post, 1)
+    scan.start()
+    scan.thread.join()
+    assert posted[-1] == ('-SCAN-DONE-', None)
+
+
+def testLazyFilesWaitForTheScanThread(tmp_path):
+    root = tmp_path / 'samples'
+    root.mkdir()
+    (root / 'kick.wav').write_bytes(b'')
+    library = SoundLibrary(str(tmp_path / 'library.db'), str(tmp_path / 'metadata.db'))
+    library.addDirectory(Directory(str(root)))
+    library.close()
+    library = SoundLibrary(str(tmp_path / 'library.db'), str(tmp_path / 'metadata.db'))
+    held = threading.Event()
+    released = []
+
+    def store():
+        # as storeDirectory() does on a scan thread
+        with library.lock:
+            held.set()
+            time.sleep(0.1)
+            released.append(time.monotonic())
+
+    try:
+        thread = threading.Thread(target=store)
+        thread.start()
+        held.wait()
+        assert library.directory_map[str(root)].inodes.keys() == {str(root / 'kick.wav')}
+        assert released and time.monotonic() >= released[0]
+        thread.join()
+    finally:
+        library.close()
+
+
+def testColumnsSkipStaleRecords(tmp_path):
+    root = tmp_path / 'samples'
+    root.mkdir()
+    kick, snare = root / 'kick.wav', root / 'snare.wav'
+    kick.write_bytes(b'x')
+    snare.write_bytes(b'x')
+    library = SoundLibrary(str(tmp_path / 'library.db'), str(tmp_path / 'metadata.db'))
+    try:
+        library.addDirectory(Directory(str(root)))
+        for path in (kick, snare):
+            library.metadata.put(str(path), os.stat(path), {'duration': 1.0})
+        # changed since it was probed
+        snare.write_bytes(b'longer')
+        paths = [str(kick), str(snare)]
+        assert library.columns.filter(paths, [('duration', '=', 1.0)]) == [str(kick)]
+        assert library.columns.countUnknown(paths, ['duration']) == 1
+    finally:
+        library.close()
+
+
+def testRescanPairsRenamedFiles(tmp_path):
+    root = tmp_path / 'samples'
+    (root / 'drums').mkdir(parents=True)
+    (root / 'keys').mkdir()
+    for name in ('drums/kick.wav', 'drums/snare.wav', 'drums/hat.wav', 'keys/pad.wav', 'keys/old.wav'):
+        (root / name).write_bytes(b'')
+    library = SoundLibrary(str(tmp_path / 'library.db'), str(tmp_path / 'metadata.db'))
+    try:
+        library.addDirectory(Directory(str(root)))
+        # only files with a record can be told apart from new files that took a deleted file's inode
+        for name, duration in (('drums/kick', 1.0), ('drums/snare', 2.0), ('keys/pad', 3.0)):
+            library.metadata.put(str(root / f"{name}.wav"), os.stat(root / f"{name}.wav"), {'duration': duration})
+        # a move to another folder, two files swapping names, a deletion and a new file
+        os.rename(root / 'keys' / 'pad.wav', root / 'drums' / 'pad.wav')
+        os.rename(root / 'drums' / 'kick.wav', root / 'drums' / 'swap')
+        os.rename(root / 'drums' / 'snare.wav', root / 'drums' / 'kick.wav')
+        os.rename(root / 'drums' / 'swap', root / 'drums' / 'snare.wav')
+        # created before the deletion, so it cannot reuse the deleted file's inode
+        (root / 'keys' / 'new.wav').write_bytes(b'')
+        os.remove(root / 'keys' / 'old.wav')
+
+        added, removed, renamed = library.rescan(str(root))
+
+        drums, keys = str(root / 'drums'), str(root / 'keys')
+        assert renamed == {f"{keys}/pad.wav": f"{drums}/pad.wav", f"{drums}/kick.wav": f"{drums}/snare.wav",
+                           f"{drums}/snare.wav": f"{drums}/kick.wav"}
+        assert added.keys() - renamed.values() == {f"{keys}/new.wav"}
+        assert removed.keys() - renamed.keys() == {f"{keys}/old.wav"}
+        # the records went with the files
+        assert library.metadata.lookup([f"{drums}/kick.wav"])[f"{drums}/kick.wav"]['duration'] == 2.0
+        assert library.directory_map[drums].inodes.keys() == {f"{drums}/{name}.wav"
+                                                              for name in ('kick', 'snare', 'hat', 'pad')}
+        assert sorted(library.searchFiles('.wav')) == sorted(
+            [f"{drums}/{name}.wav" for name in ('hat', 'kick', 'pad', 'snare')] + [f"{keys}/new.wav"])
+    finally:
+        library.close()
@@ -0,0 +1,73 @@
+import os
+import pickle
+import random
+
+from sfe_index import SearchIndex, rankMatch
+
+WORDS = ['kick', 'snare', 'hat', 'clap', 'pad', 'vox', 'fx', 'riser']
+
+
+def makePaths(count, seed=0):
+    rng = random.Random(seed)
+    return [f"/lib/pack_{i // 50}/{rng.choice(WORDS)}_{rng.choice(WORDS)}_{i}.wav" for i in range(count)]
+
+
+def linearSearch(paths, term):
+    return [path for path in paths if term in os.path.basename(path)]
+
+
+def testSearchMatchesLinearScanAfterRemovals():
+    paths = makePaths(3000)
+    index = SearchIndex()
+    index.addAll(paths)
+    # enough removals to compact the index on the way
+    removed = set(paths[::2]) | set(paths[:1200])
+    index.removeAll(removed)
+    kept = [path for path in paths if path not in removed]
+    index.add(paths[0])
+    kept.append(paths[0])
+    assert len(index) == len(kept)
+    for term in ['kick', 'ap_v', 'x_', '_12', 'ri', 'wav', 'nothing']:
+        assert sorted(index.search(term)) == sorted(linearSearch(kept, term))
+
+
+def testSearchRankedHoldsEveryMatchOnce():
+    paths = makePaths(5000) + ['/lib/kick.wav', '/lib/kick_hard.wav']
+    index = SearchIndex()
+    index.addAll(paths)
+    ranked, others = [], []
+    for ranked, batch in index.searchRanked('kick', top=20, batch=500):
+        others.extend(batch)
+    assert ranked[0] == '/lib/kick.wav'
+    assert sorted(ranked + others) == sorted(linearSearch(paths, 'kick'))
+    assert [rankMatch('kick', os.path.basename(path)) for path in ranked] == \
+        sorted(rankMatch('kick', os.path.basename(path)) for path in ranked)
+
+
+def testPickledIndexSearchesTheSame():
+    paths = makePaths(2000)
+    index = SearchIndex()
+    index.addAll(paths)
+    index.removeAll(paths[:100])
+    loaded = pickle.loads(pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+    assert len(loaded) == len(index)
+    assert loaded.trigrams == index.trigrams
+    for term in ['snare', 'pad_fx', '_19']:
+        assert loaded.search(term) == index.search(term)
+    loaded.add('/lib/new_snare.wav')
+    assert '/lib/new_snare.wav' in loaded.search('snare')
+
+
+def testIndexCachedWithSetsLoads():
+    # the state earlier versions pickled, with a set of ids per trigram
+    paths = ['/lib/kick.wav', None, '/lib/snare.wav']
+    names = ['kick.wav', None, 'snare.wav']
+    trigrams = {}
+    for file_id, name in enumerate(names):
+        for gram in SearchIndex.grams(name or ''):
+            trigrams.setdefault(gram, set()).add(file_id)
+    index = SearchIndex.__new__(SearchIndex)
+    index.__setstate__({'paths': paths, 'names': names, 'ids': {'/lib/kick.wav': 0, '/lib/snare.wav': 2},
+                        'trigrams': trigrams})
+    assert index.search('.wav') == ['/lib/kick.wav', '/lib/snare.wav']
+    assert index.search('sna') == ['/lib/snare.wav']
@@ -0,0 +1,42 @@
+import os
+
+from sfe_metadata import MetadataStore
+
+
+def testRenameSwappedPaths(tmp_path):
+    a, b = tmp_path / 'a.wav', tmp_path / 'b.wav'
+    a.write_bytes(b'a')
+    b.write_bytes(b'bb')
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    try:
+        store.put(str(a), os.stat(a), {'duration': 1.0})
+        store.put(str(b), os.stat(b), {'duration': 2.0})
+        os.rename(a, tmp_path / 'c.wav')
+        os.rename(b, a)
+        os.rename(tmp_path / 'c.wav', b)
+
+        store.rename([(str(a), str(b)), (str(b), str(a))])
+
+        found = store.lookup([str(a), str(b)])
+        assert found[str(a)]['duration'] == 2.0
+        assert found[str(b)]['duration'] == 1.0
+    finally:
+        store.close()
+
+
+def testRenameDropsStaleRecordOfTheNewPath(tmp_path):
+    old, new = tmp_path / 'old.wav', tmp_path / 'new.wav'
+    old.write_bytes(b'old')
+    new.write_bytes(b'stale')
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    try:
+        store.put(str(old), os.stat(old), {'duration': 1.0})
+        store.put(str(new), os.stat(new), {'duration': 9.0})
+        os.replace(old, new)
+
+        store.rename([(str(old), str(new))])
+
+        assert store.lookup([str(old), str(new)]) == {str(new): {'duration': 1.0, 'sample_rate': None,
+                                                                 'channels': None, 'bit_depth': None}}
+    finally:
+        store.close()
@@ -0,0 +1,197 @@
+import random
+import struct
+
+import pytest
+
+from sfe_probe import probe
+
+
+def chunk(chunk_id, body, endian='<'):
+    return chunk_id + struct.pack(endian + 'I', len(body)) + body + b'\0' * (len(body) & 1)
+
+
+def wave(form=b'RIFF', tag=1, channels=2, rate=44100, bits=16, frames=44100, extra=b''):
+    endian = '>' if form == b'RIFX' else '<'
+    block_align = channels * bits // 8
+    fmt = chunk(b'fmt ', struct.pack(endian + 'HHIIHH', tag, channels, rate, rate * block_align, block_align, bits),
+                endian)
+    data = b'\0' * (frames * block_align)
+    if form == b'RF64':
+        # the sizes are in the ds64 chunk, the 32-bit ones are all ones
+        ds64 = chunk(b'ds64', struct.pack('<QQQI', 0, len(data), frames, 0))
+        body = b'WAVE' + ds64 + fmt + extra + b'data' + b'\xff' * 4 + data
+        return b'RF64' + b'\xff' * 4 + body
+    body = b'WAVE' + fmt + extra + chunk(b'data', data, endian)
+    return form + struct.pack(endian + 'I', len(body)) + body
+
+
+def extended(value):
+    # an integer as the 80-bit extended float of AIFF
+    exponent = 16383 + value.bit_length() - 1
+    return struct.pack('>H', exponent) + (value << (64 - value.bit_length())).to_bytes(8, 'big')
+
+
+def aiff(form=b'AIFF', channels=2, rate=48000, bits=24, frames=96000):
+    comm = struct.pack('>hIh', channels, frames, bits) + extended(rate)
+    chunks = b''
+    if form == b'AIFC':
+        comm += b'NONE' + b'\0\0'
+        chunks += chunk(b'FVER', struct.pack('>I', 0xA2805140), '>')
+    chunks += chunk(b'COMM', comm, '>') + chunk(b'SSND', b'\0' * 8 + b'\0' * (frames * channels * bits // 8), '>')
+    return b'FORM' + struct.pack('>I', len(chunks) + 4) + form + chunks
+
+
+def streamInfo(rate=44100, channels=2, bits=16, samples=441000):
+    packed = (rate << 44) | ((channels - 1) << 41) | ((bits - 1) << 36) | samples
+    return struct.pack('>HH', 4096, 4096) + b'\0' * 6 + packed.to_bytes(8, 'big') + b'\0' * 16
+
+
+def flac(**kwargs):
+    # STREAMINFO as the last metadata block, then a frame's worth of bytes
+    return b'fLaC' + b'\x80' + (34).to_bytes(3, 'big') + streamInfo(**kwargs) + b'\xff\xf8' + b'\0' * 100
+
+
+def oggPage(packet, granule=0, serial=1, sequence=0, header_type=0):
+    segments = [255] * (len(packet) // 255) + [len(packet) % 255]
+    return (b'OggS' + struct.pack('<BBqIII', 0, header_type, granule, serial, sequence, 0)
+            + bytes([len(segments)]) + bytes(segments) + packet)
+
+
+def ogg(packet, granule, other_stream=False):
+    pages = oggPage(packet, header_type=2) + oggPage(b'\0' * 300, granule=granule // 2, sequence=1)
+    pages += oggPage(b'\0' * 300, granule=granule, sequence=2, header_type=4)
+    if other_stream:
+        # a page of another stream after the last one, which does not count
+        pages += oggPage(b'\0' * 10, granule=granule * 10, serial=2)
+    return pages
+
+
+def vorbisHead(channels=2, rate=44100):
+    return b'\x01vorbis' + struct.pack('<IBIiiiBB', 0, channels, rate, 0, 128000, 0, 0xB8, 1)
+
+
+def opusHead(channels=2, skip=312, rate=44100):
+    return b'OpusHead' + struct.pack('<BBHIhB', 1, channels, skip, rate, 0, 0)
+
+
+def oggFlacHead(**kwargs):
+    return b'\x7fFLAC' + b'\x01\x00' + struct.pack('>H', 1) + b'fLaC' + b'\x80' + (34).to_bytes(3, 'big') \
+        + streamInfo(**kwargs)
+
+
+#MPEG 1 layer III at 128 kbit/s and 44.1 kHz (417 byte frames), and MPEG 2 layer III at 64 kbit/s and 22.05 kHz
+#(208 byte frames), with their channel mode bits for stereo and mono
+MPEG1 = (b'\xff\xfb\x90', 417, 1152, 44100, 32)
+MPEG2_MONO = (b'\xff\xf3\x80', 208, 576, 22050, 9)
+
+
+def mpeg(kind=MPEG1, frames=20, mono=False, tag=None, id3=b'', padding=0, id3v1=False):
+    header, length, samples, rate, side = kind
+    header += b'\xc0' if mono else b'\x00'
+    first = bytearray(header + b'\0' * (length - 4))
+    if tag == b'VBRI':
+        first[36:54] = b'VBRI' + struct.pack('>HHHII', 1, 0, 75, 0, frames)
+    elif tag:
+        first[4 + side:4 + side + 12] = tag + struct.pack('>II', 0x1, frames)
+    data = bytes(first) + (header + b'\0' * (length - 4)) * (frames - 1)
+    if id3:
+        # padding some taggers leave after the tag rather than count in it
+        data = b'ID3\x03\x00\x00' + bytes([0, 0, 0, len(id3)]) + id3 + b'\0' * padding + data
+    if id3v1:
+        data += b'TAG' + b'\0' * 125
+    return data
+
+
+CASES = [
+    ('riff', wave(), ('wav', 1.0, 44100, 2, 16)),
+    ('rifx', wave(b'RIFX', channels=1, rate=22050, bits=8, frames=11025), ('wav', 0.5, 22050, 1, 8)),
+    ('rf64', wave(b'RF64', rate=96000, bits=24, frames=48000), ('wav', 0.5, 96000, 2, 24)),
+    ('float', wave(tag=3, bits=32, rate=48000, frames=24000), ('wav', 0.5, 48000, 2, 32)),
+    # a compressed format is timed by its fact chunk
+    ('fact', wave(tag=2, bits=4, frames=1000, extra=chunk(b'fact', struct.pack('<I', 88200))),
+     ('wav', 2.0, 44100, 2, 4)),
+    ('list before data', wave(extra=chunk(b'LIST', b'INFOtext!')), ('wav', 1.0, 44100, 2, 16)),
+    ('aiff', aiff(), ('aiff', 2.0, 48000, 2, 24)),
+    ('aifc', aiff(b'AIFC', channels=1, rate=44100, bits=16, frames=22050), ('aiff', 0.5, 44100, 1, 16)),
+    ('flac', flac(rate=96000, channels=6, bits=24, samples=192000), ('flac', 2.0, 96000, 6, 24)),
+    ('flac after id3', b'ID3\x04\x00\x00\x00\x00\x00\x05hello' + flac(), ('flac', 10.0, 44100, 2, 16)),
+    ('vorbis', ogg(vorbisHead(), 88200), ('ogg', 2.0, 44100, 2, None)),
+    ('vorbis with another stream', ogg(vorbisHead(channels=1, rate=22050), 22050, other_stream=True),
+     ('ogg', 1.0, 22050, 1, None)),
+    # Opus counts at 48 kHz whatever rate the input had, less the pre-skip
+    ('opus', ogg(opusHead(), 96312), ('ogg', 2.0, 44100, 2, None)),
+    ('ogg flac', ogg(oggFlacHead(rate=48000, bits=24, samples=48000), 48000), ('ogg', 1.0, 48000, 2, 24)),
+    ('xing', mpeg(tag=b'Xing', frames=100), ('mp3', 100 * 1152 / 44100, 44100, 2, None)),
+    ('info mono mpeg 2', mpeg(MPEG2_MONO, tag=b'Info', frames=50, mono=True),
+     ('mp3', 50 * 576 / 22050, 22050, 1, None)),
+    ('vbri', mpeg(tag=b'VBRI', frames=30), ('mp3', 30 * 1152 / 44100, 44100, 2, None)),
+    # the first frame starts near the end of the bytes read after the tag, its Xing header lies beyond them
+    ('xing past the head after id3', mpeg(tag=b'Xing', frames=100, id3=b'x' * 20, padding=4070),
+     ('mp3', 100 * 1152 / 44100, 44100, 2, None)),
+    ('vbri past the head after id3', mpeg(tag=b'VBRI', frames=30, id3=b'x' * 20, padding=4080),
+     ('mp3', 30 * 1152 / 44100, 44100, 2, None)),
+    # without a header the bitrate and the size give the length, tags aside
+    ('cbr with tags', mpeg(frames=10, id3=b'x' * 20, id3v1=True), ('mp3', 10 * 417 * 8 / 128000, 44100, 2, None)),
+]
+
+
+@pytest.mark.parametrize('name, data, expected', CASES, ids=[case[0] for case in CASES])
+def testProbe(tmp_path, name, data, expected):
+    path = tmp_path / 'sound'
+    path.write_bytes(data)
+    info = probe(str(path))
+    assert info is not None
+    file_format, duration, rate, channels, bits = expected
+    assert info['format'] == file_format
+    assert info['duration'] == pytest.approx(duration)
+    assert (info['sample_rate'], info['channels'], info['bit_depth']) == (rate, channels, bits)
+
+
+#how much of each file its headers take: anything cut shorter cannot be probed. An Ogg file also needs the
+#granule position of a page after its header page.
+HEADER_SIZES = {'riff': 12 + 24 + 8, 'rf64': 12 + 36 + 24 + 8, 'aifc': 12 + 12 + 8 + 18, 'flac': 8 + 18,
+                'vorbis': len(oggPage(vorbisHead())) + 18, 'opus': len(oggPage(opusHead())) + 18,
+                'ogg flac': len(oggPage(oggFlacHead())) + 18, 'xing': 417, 'vbri': 417}
+
+
+@pytest.mark.parametrize('name', HEADER_SIZES)
+def testCutShortHeadersGiveNone(tmp_path, name):
+    data = {case[0]: case[1] for case in CASES}[name]
+    path = tmp_path / 'sound'
+    for length in range(HEADER_SIZES[name]):
+        path.write_bytes(data[:length])
+        assert probe(str(path)) is None, length
+    path.write_bytes(data[:HEADER_SIZES[name]])
+    assert probe(str(path)) is not None
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'not a sound file at all' * 50,
+    wave(rate=0),
+    wave()[:36] + chunk(b'LIST', b'no data'),
+    aiff(rate=0),
+    b'fLaC\x01' + b'\0' * 60,
+    flac(rate=0),
+    ogg(b'\x01theora' + b'\0' * 40, 1000),
+    ogg(vorbisHead(rate=0), 1000),
+    mpeg(frames=1)[:-1],
+], ids=['empty', 'text', 'rate 0', 'no data chunk', 'aiff rate 0', 'no streaminfo', 'flac rate 0', 'theora',
+        'vorbis rate 0', 'mp3 frame cut short'])
+def testCorruptFilesGiveNone(tmp_path, data):
+    path = tmp_path / 'sound'
+    path.write_bytes(data)
+    assert probe(str(path)) is None
+
+
+def testDamagedHeadersDoNotRaise(tmp_path):
+    rng = random.Random(6)
+    path = tmp_path / 'sound'
+    for name, data, expected in CASES:
+        for _ in range(100):
+            damaged = bytearray(data)
+            for _ in range(rng.randint(1, 4)):
+                damaged[rng.randrange(min(len(data), 120))] = rng.randrange(256)
+            path.write_bytes(bytes(damaged))
+            info = probe(str(path))
+            assert info is None or isinstance(info, dict)
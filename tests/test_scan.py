@@ -0,0 +1,67 @@
+import os
+import runpy
+import sys
+
+from sfe_scan import Directory, DirectoryTrie
+
+
+def makeTree(root, files):
+    for name in files:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'')
+
+
+def testTrieFindsFoldersByPath(tmp_path):
+    makeTree(tmp_path, ['samples/drums/kick.wav', 'samples/drums/acoustic/snare.wav', 'samples/pad.wav',
+                        'samples_2/vox.wav'])
+    trie = DirectoryTrie()
+    samples = Directory(str(tmp_path / 'samples'))
+    trie.insert(samples)
+    drums = str(tmp_path / 'samples' / 'drums')
+    acoustic = os.path.join(drums, 'acoustic')
+
+    assert trie[acoustic].inodes.keys() == {os.path.join(acoustic, 'snare.wav')}
+    assert drums in trie and str(tmp_path / 'samples') in trie
+    # a sibling that shares the name's start, a missing child and a folder above the library
+    assert str(tmp_path / 'samples_2') not in trie
+    assert os.path.join(drums, 'missing') not in trie
+    assert trie.get(str(tmp_path)) is None
+    assert [directory.path for directory in trie.chain(os.path.join(acoustic, 'deeper', 'still'))] == \
+        [samples.path, drums, acoustic]
+    assert trie.chain(str(tmp_path / 'samples_2')) == []
+    paths = [directory.path for directory in trie.values()]
+    assert sorted(paths) == sorted([samples.path, drums, acoustic])
+    assert paths.index(drums) < paths.index(acoustic)
+
+
+def testTrieKeepsTotalsWhenSubtreesComeAndGo(tmp_path):
+    makeTree(tmp_path, ['samples/pad.wav', 'samples/drums/kick.wav'])
+    trie = DirectoryTrie()
+    trie.insert(Directory(str(tmp_path / 'samples')))
+    drums = str(tmp_path / 'samples' / 'drums')
+    makeTree(tmp_path, ['samples/drums/loops/a.wav', 'samples/drums/loops/b.wav', 'samples/drums/loops/old/c.wav'])
+
+    loops = Directory(os.path.join(drums, 'loops'))
+    trie.insert(loops, drums)
+    assert loops.parent == drums
+    assert trie[os.path.join(drums, 'loops', 'old')].file_count == 1
+    assert (trie[drums].file_count, trie[str(tmp_path / 'samples')].file_count) == (4, 5)
+    trie.adjust(os.path.join(drums, 'loops'), 0, 2.5)
+    assert trie[str(tmp_path / 'samples')].duration == 2.5
+
+    assert trie.remove(os.path.join(drums, 'loops')) is loops
+    assert os.path.join(drums, 'loops', 'old') not in trie
+    assert (trie[drums].file_count, trie[str(tmp_path / 'samples')].file_count) == (1, 2)
+    assert trie[str(tmp_path / 'samples')].duration == 0.0
+    assert trie.remove(os.path.join(drums, 'loops')) is None
+    trie.remove(str(tmp_path / 'samples'))
+    assert trie.roots == {} and list(trie.values()) == []
+
+
+def testWorkersDoNotImportTheGui():
+    # what a spawned worker process does with the GUI's main module
+    gui = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sound_file_explorer.py')
+    modules = set(sys.modules)
+    runpy.run_path(gui, run_name='__mp_main__')
+    assert not {'sfe_classes', 'sfe_functions', 'PySimpleGUI', 'pygame'} & (set(sys.modules) - modules)